@@ -0,0 +1,14 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Offline analysis of the Swarm vs. Iridium experiment, with NumPy.
+#
+# swarm.load() and iridium.load() read each side's logs into a Deliveries
+# table of whole-column int64 arrays, and summary works on those. Text is
+# turned into numbers a column at a time (analysis.columns,
+# analysis.timestamps), never a row at a time, so tens of millions of rows
+# take seconds. python3 -m analysis prints the comparison.
+
+from analysis.deliveries import Deliveries, UNKNOWN
+from analysis import columns, timestamps, swarm, iridium, summary
@@ -0,0 +1,84 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Compare Swarm and Iridium delivery, from the host directory:
+#
+#   python3 -m analysis --swarm unit1 unit2 --iridium webhooks.csv
+#
+# --swarm takes one directory per unit (a copy of its CIRCUITPY drive, or a
+# simulator --fs directory), --iridium the backend's webhook CSV logs.
+
+import argparse
+import time
+
+import numpy as np
+
+from analysis import swarm, iridium, summary
+
+
+def duration(seconds):
+  if seconds is None or seconds != seconds:
+    return '-'
+  if seconds < 120:
+    return '%.0fs' % seconds
+  if seconds < 7200:
+    return '%.1fm' % (seconds / 60)
+  return '%.1fh' % (seconds / 3600)
+
+
+def report(sources):
+  names = [d.source for d in sources]
+  print('%-16s' % '' + ''.join('%18s' % n for n in names))
+  rows = [('units', lambda d, s, l: str(len(d.units))),
+          ('messages', lambda d, s, l: str(s['sent'])),
+          ('attempted', lambda d, s, l: str(s['attempted'])),
+          ('delivered', lambda d, s, l: str(s['delivered'])),
+          ('success', lambda d, s, l: '-' if s['rate'] is None else '%.1f%%' % (s['rate'] * 100))]
+  rows = rows + [(key, lambda d, s, l, key=key: duration(l.get(key))) for key in
+                 ['p%d' % q for q in summary.QUANTILES] + ['mean', 'max']]
+  stats = [(d, summary.success(d), summary.latency(d)) for d in sources]
+  for label, value in rows:
+    print('%-16s' % label + ''.join('%18s' % value(*s) for s in stats))
+
+  print()
+  print('%-16s' % 'hour (UTC)' + ''.join('%8s%10s' % (n, 'median') for n in names))
+  hours = [summary.byHour(d) for d in sources]
+  for h in range(24):
+    print('%-16s' % ('%02d' % h) + ''.join('%8d%10s' % (counts[h], duration(medians[h]))
+                                           for counts, delivered, medians in hours))
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Swarm vs. Iridium delivery statistics')
+  parser.add_argument('--swarm', nargs='*', default=[], metavar='DIR', help='Swarm unit directories')
+  parser.add_argument('--iridium', nargs='*', default=[], metavar='CSV', help='Iridium webhook logs')
+  parser.add_argument('--iridium-interval', type=float, default=iridium.SEND_INTERVAL / 60,
+                      help='minutes between Iridium sends')
+  parser.add_argument('--save', metavar='NPZ', help='also write the loaded tables to this .npz file')
+  args = parser.parse_args()
+
+  start = time.perf_counter()
+  sources = []
+  if args.swarm:
+    sources.append(swarm.load(args.swarm))
+  if args.iridium:
+    sources.append(iridium.load(args.iridium, int(args.iridium_interval * 60)))
+  if not sources:
+    parser.error('nothing to analyse, give --swarm and/or --iridium')
+  loaded = time.perf_counter() - start
+  report(sources)
+  print()
+  print('%d rows loaded in %.2fs' % (sum(len(d) for d in sources), loaded))
+
+  if args.save:
+    arrays = {}
+    for d in sources:
+      for name in ('unit', 'id', 'sent', 'received'):
+        arrays['%s_%s' % (d.source, name)] = getattr(d, name)
+      arrays['%s_units' % d.source] = np.array(d.units)
+    np.savez_compressed(args.save, **arrays)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,138 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Vectorised CSV reading.
+#
+# A file is read into one uint8 array and described by the start and end
+# offsets of its lines. Fields are located by where the commas are, and then
+# gathered into (rows, width) character matrices that are converted column by
+# column with NumPy, so no Python code runs per row. The CSV files written by
+# the firmware and the Iridium backend have no quoting, which this relies on.
+
+import numpy as np
+
+NEWLINE = 0x0A
+COMMA = 0x2C
+MAX_DIGITS = 18  # longer numbers don't fit an int64 and are rejected
+
+# hex digit values by character, -1 for anything else
+HEX_VALUES = np.full(256, -1, dtype=np.int16)
+HEX_VALUES[np.frombuffer(b'0123456789', dtype=np.uint8)] = np.arange(10)
+HEX_VALUES[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16)
+HEX_VALUES[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+
+
+def lines(buf):
+  # start and end offsets of the non-empty lines in buf, ends exclude '\r\n'
+  if len(buf) == 0:
+    empty = np.zeros(0, dtype=np.int64)
+    return empty, empty
+  newlines = np.flatnonzero(buf == NEWLINE)
+  if len(newlines) == 0 or newlines[-1] != len(buf) - 1:
+    newlines = np.append(newlines, len(buf))
+  starts = np.concatenate(([0], newlines[:-1] + 1)).astype(np.int64)
+  ends = newlines.astype(np.int64)
+  crlf = (ends > starts) & (buf[np.maximum(ends - 1, 0)] == 0x0D)
+  ends = ends - crlf
+  keep = ends > starts
+  return starts[keep], ends[keep]
+
+
+def readLines(path):
+  buf = np.fromfile(path, dtype=np.uint8)
+  starts, ends = lines(buf)
+  return buf, starts, ends
+
+
+def fromStrings(strings):
+  # the same (buf, starts, ends) for a list of str, e.g. values out of a JSON file
+  if len(strings) == 0:
+    buf = np.zeros(0, dtype=np.uint8)
+    return (buf,) + lines(buf)
+  buf = np.frombuffer('\n'.join(strings).encode() + b'\n', dtype=np.uint8)
+  lengths = np.fromiter((len(s) for s in strings), dtype=np.int64, count=len(strings))
+  starts = np.concatenate(([0], np.cumsum(lengths + 1)[:-1])).astype(np.int64)
+  return buf, starts, starts + lengths
+
+
+def split(buf, starts, ends, count, optional=0):
+  # field boundaries of lines with count fields, or up to optional more whose
+  # contents are dropped: (valid, fieldStarts, fieldEnds), valid marks the
+  # usable lines and the field arrays are (valid lines, count)
+  commas = np.flatnonzero(buf == COMMA)
+  line = np.searchsorted(ends, commas, side='right')
+  inLine = line < len(starts)
+  inLine[inLine] = commas[inLine] >= starts[line[inLine]]
+  commas = commas[inLine]
+  line = line[inLine]
+  perLine = np.bincount(line, minlength=len(starts))
+  valid = (perLine >= count - 1) & (perLine <= count - 1 + optional)
+  if optional:
+    # each comma's place in its line, to keep the first count - 1 and find where field count ends
+    rank = np.arange(len(commas)) - (np.cumsum(perLine) - perLine)[line]
+    lineEnds = ends.copy()
+    extra = valid[line] & (rank == count - 1)
+    lineEnds[line[extra]] = commas[extra]
+    keep = valid[line] & (rank < count - 1)
+  else:
+    lineEnds = ends
+    keep = valid[line]
+  positions = commas[keep].reshape(-1, count - 1)
+  # column-major, so each field's column is contiguous for the converters
+  fieldStarts = np.asfortranarray(np.column_stack((starts[valid], positions + 1)))
+  fieldEnds = np.asfortranarray(np.column_stack((positions, lineEnds[valid])))
+  return valid, fieldStarts, fieldEnds
+
+
+def gather(buf, starts, width):
+  # (rows, width) matrix of the characters from each start; whatever lies past
+  # the end of a field is junk the callers mask out by the field's length
+  if width <= 0 or len(buf) == 0:
+    return np.zeros((len(starts), max(0, width)), dtype=np.uint8)
+  return buf[np.minimum(starts[:, None] + np.arange(width), len(buf) - 1)]
+
+
+def column(buf, starts, offset):
+  # the character offset places into each field, one column of gather() without
+  # building the whole matrix
+  if len(buf) == 0:
+    return np.zeros(len(starts), dtype=np.uint8)
+  return np.take(buf, starts + offset, mode='clip')
+
+
+def integers(buf, starts, ends):
+  # decimal integers with an optional leading '-', returns (values, ok);
+  # converted a character column at a time to keep the temporaries small
+  lengths = ends - starts
+  width = min(MAX_DIGITS, int(lengths.max()) if len(lengths) else 0)
+  values = np.zeros(len(starts), dtype=np.int64)
+  if width == 0:
+    return values, np.zeros(len(starts), dtype=bool)
+  negative = column(buf, starts, 0) == 0x2D
+  ok = (lengths > negative) & (lengths <= width)
+  for j in range(width):
+    digit = column(buf, starts, j) - np.uint8(0x30)
+    inField = lengths > j
+    isDigit = digit <= 9
+    ok &= isDigit | ~inField | (negative if j == 0 else False)
+    values = np.where(inField & isDigit, values * 10 + digit, values)
+  return np.where(negative, -values, values), ok
+
+
+def hexBytes(buf, starts, ends, size):
+  # fields of exactly 2 * size hex digits to a (rows, size) uint8 matrix, and ok
+  chars = gather(buf, starts, 2 * size)
+  nibbles = HEX_VALUES[chars]
+  ok = ((ends - starts) == 2 * size) & np.all(nibbles >= 0, axis=1)
+  nibbles = np.maximum(nibbles, 0)
+  return (nibbles[:, 0::2] * 16 + nibbles[:, 1::2]).astype(np.uint8), ok
+
+
+def text(buf, starts, ends):
+  # field contents as a NumPy bytes array, for the odd column that stays textual
+  lengths = ends - starts
+  width = max(1, int(lengths.max()) if len(lengths) else 1)
+  chars = gather(buf, starts, width)
+  chars[np.arange(width) >= lengths[:, None]] = 0
+  return chars.view('S%d' % width).ravel()
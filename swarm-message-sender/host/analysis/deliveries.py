@@ -0,0 +1,77 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Columnar table of sent messages, the common form both loaders produce.
+
+import numpy as np
+
+UNKNOWN = -1  # received time of a message that hasn't arrived
+
+
+class Deliveries:
+  # One row per message: the unit that sent it (an index into units), its id,
+  # when it was sent and when it reached the backend, all int64 seconds since
+  # 1970. expected is the number of messages each unit tried to send when the
+  # source can't list the ones that never arrived (Iridium), otherwise None.
+
+  def __init__(self, source, units, unit, id, sent, received, expected=None):
+    self.source = source
+    self.units = units
+    self.unit = unit
+    self.id = id
+    self.sent = sent
+    self.received = received
+    self.expected = expected
+
+  def __len__(self):
+    return len(self.id)
+
+  @property
+  def delivered(self):
+    return self.received != UNKNOWN
+
+  @property
+  def latency(self):
+    # of the delivered messages only
+    delivered = self.delivered
+    return self.received[delivered] - self.sent[delivered]
+
+  @property
+  def end(self):
+    # the last moment each unit's log knows about
+    last = np.maximum(self.sent, self.received)
+    end = np.zeros(len(self.units), dtype=np.int64)
+    np.maximum.at(end, self.unit, last)
+    return end
+
+  @staticmethod
+  def concat(source, parts):
+    units = []
+    columns = {'unit': [], 'id': [], 'sent': [], 'received': []}
+    expected = []
+    for part in parts:
+      columns['unit'].append(part.unit + len(units))
+      for name in ('id', 'sent', 'received'):
+        columns[name].append(getattr(part, name))
+      units.extend(part.units)
+      expected.append(part.expected if part.expected is not None else np.full(len(part.units), -1))
+    if not parts:
+      empty = np.zeros(0, dtype=np.int64)
+      return Deliveries(source, [], empty, empty, empty, empty)
+    joined = [np.concatenate(columns[name]) for name in ('unit', 'id', 'sent', 'received')]
+    expected = np.concatenate(expected)
+    return Deliveries(source, units, *joined, expected=None if np.all(expected < 0) else expected)
+
+
+def merge(unit, id, sent, received):
+  # collapse rows describing the same message (archive, journal and stats.csv
+  # can all mention it) into one, keeping whatever times are known
+  if len(id) == 0:
+    return unit, id, sent, received
+  order = np.lexsort((id, unit))
+  unit = unit[order]
+  id = id[order]
+  first = np.flatnonzero(np.concatenate(([True], (id[1:] != id[:-1]) | (unit[1:] != unit[:-1]))))
+  return (unit[first], id[first], np.maximum.reduceat(sent[order], first),
+          np.maximum.reduceat(received[order], first))
@@ -0,0 +1,67 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Loads the Iridium side of the experiment from the backend's webhook log.
+#
+# IridiumMessageSender.ino sends the 6 bytes  YY MM DD hh mm ss  of its GPS
+# clock every SEND_INTERVAL_MIN minutes. The webhook log is a CSV with a header
+# naming its columns; 'data' (the payload in hex) and 'transmit_time' (when the
+# gateway got it, '22-07-01 13:05:12' or ISO) are needed, 'imei' tells units
+# apart and 'momsn' numbers each unit's messages. Rows with any other payload
+# are skipped.
+#
+# Messages that never made it aren't in the log, so Deliveries.expected holds
+# the number of send slots in each unit's span instead.
+
+import numpy as np
+
+from analysis import columns, timestamps
+from analysis.deliveries import Deliveries
+
+SEND_INTERVAL = 15 * 60  # SEND_INTERVAL_MIN in the sketch
+PAYLOAD_SIZE = 6
+
+
+def load(paths, interval=SEND_INTERVAL):
+  parts = []
+  for path in paths:
+    buf, starts, ends = columns.readLines(path)
+    if len(starts) == 0:
+      continue
+    names = bytes(buf[starts[0]:ends[0]]).decode().strip().split(',')
+    for required in ('data', 'transmit_time'):
+      if required not in names:
+        raise ValueError('%s: no %s column' % (path, required))
+    valid, fieldStarts, fieldEnds = columns.split(buf, starts[1:], ends[1:], len(names))
+
+    def field(name):
+      return fieldStarts[:, names.index(name)], fieldEnds[:, names.index(name)]
+
+    payload, payloadOk = columns.hexBytes(buf, *field('data'), PAYLOAD_SIZE)
+    received, receivedOk = timestamps.parse(buf, *field('transmit_time'))
+    p = payload.astype(np.int64)
+    sent = timestamps.civilSeconds(2000 + p[:, 0], p[:, 1], p[:, 2], p[:, 3], p[:, 4], p[:, 5])
+    keep = payloadOk & receivedOk & (p[:, 1] >= 1) & (p[:, 1] <= 12) & (p[:, 2] >= 1)
+    if 'imei' in names:
+      imei = columns.text(buf, *field('imei'))[keep]
+    else:
+      imei = np.full(keep.sum(), path.encode())
+    if 'momsn' in names:
+      id = columns.integers(buf, *field('momsn'))[0][keep]
+    else:
+      id = np.arange(keep.sum(), dtype=np.int64)
+    imeis, unit = np.unique(imei, return_inverse=True)
+    sent = sent[keep]
+    parts.append(Deliveries('iridium', [i.decode() for i in imeis], unit.astype(np.int64), id, sent,
+                            received[keep], expected=slots(unit, sent, len(imeis), interval)))
+  return Deliveries.concat('iridium', parts)
+
+
+def slots(unit, sent, count, interval):
+  # send slots between each unit's first and last message
+  first = np.full(count, np.iinfo(np.int64).max)
+  last = np.zeros(count, dtype=np.int64)
+  np.minimum.at(first, unit, sent)
+  np.maximum.at(last, unit, sent)
+  return (last - first) // interval + 1
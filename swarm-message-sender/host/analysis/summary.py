@@ -0,0 +1,61 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Latency distributions, success rates and time-of-day breakdowns of a
+# Deliveries table, all computed on whole columns.
+
+import numpy as np
+
+from analysis import swarm, timestamps
+
+QUANTILES = (50, 90, 99)
+
+
+def latency(deliveries):
+  # count, mean and QUANTILES of the delivery latency in seconds
+  values = deliveries.latency
+  result = {'delivered': len(values)}
+  if len(values):
+    result['mean'] = float(values.mean())
+    result['max'] = int(values.max())
+    for q, value in zip(QUANTILES, np.percentile(values, QUANTILES)):
+      result['p%d' % q] = float(value)
+  return result
+
+
+def success(deliveries):
+  # delivered messages over the ones that had their chance, per source:
+  # Swarm knows its expired messages, Iridium only how many slots there were
+  delivered = int(deliveries.delivered.sum())
+  if deliveries.expected is not None:
+    attempted = int(deliveries.expected.sum())
+  else:
+    attempted = delivered + int(swarm.expired(deliveries).sum())
+  return {'sent': len(deliveries), 'attempted': attempted, 'delivered': delivered,
+          'rate': delivered / attempted if attempted else None}
+
+
+def byHour(deliveries):
+  # per UTC hour the message was sent: messages, delivered, median latency
+  hour = timestamps.hourOfDay(deliveries.sent)
+  delivered = deliveries.delivered
+  counts = np.bincount(hour, minlength=24)
+  deliveredCounts = np.bincount(hour[delivered], minlength=24)
+  lat = deliveries.latency
+  order = np.lexsort((lat, hour[delivered]))
+  starts = np.cumsum(deliveredCounts) - deliveredCounts
+  medians = np.full(24, np.nan)
+  has = deliveredCounts > 0
+  sortedLatency = lat[order]
+  low = starts[has] + (deliveredCounts[has] - 1) // 2
+  high = starts[has] + deliveredCounts[has] // 2
+  medians[has] = (sortedLatency[low] + sortedLatency[high]) / 2
+  return counts, deliveredCounts, medians
+
+
+def byUnit(deliveries):
+  # messages and delivered messages per unit
+  count = np.bincount(deliveries.unit, minlength=len(deliveries.units))
+  delivered = np.bincount(deliveries.unit[deliveries.delivered], minlength=len(deliveries.units))
+  return count, delivered
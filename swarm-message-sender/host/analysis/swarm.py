@@ -0,0 +1,97 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Loads what the Swarm message sender leaves on its CIRCUITPY drive.
+#
+# A unit's directory may hold any of
+#   archive.bin    completed or expired messages, see ../root/swarm_archive.py
+#   messages.json  the resident messages, with messages.log journalled on top
+#   stats.csv      id,time_tx,latency[,energy[,inferred]]  of every delivered message
+# and the three are joined on the message id, so a message is counted once
+# however many of them mention it. Old units only have stats.csv and
+# messages.json; their undelivered messages are whatever messages.json holds.
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'root'))
+
+import swarm_journal
+from analysis import columns, timestamps
+from analysis.deliveries import Deliveries, UNKNOWN, merge
+
+# the Tile gives up on a message after 48 hours, see MESSAGES_INFLIGHT_EXPIRY
+EXPIRY = 48 * 60 * 60
+
+
+# swarm_archive.py records, read in place through a memory map
+RECORD = np.dtype([('id', '<u4'), ('tile_msg_id', '<u8'), ('time_tx', '<u4'), ('time_rx_sat', '<u4')])
+HEADER_SIZE = 8
+
+
+def loadBinaryArchive(path):
+  count = (os.path.getsize(path) - HEADER_SIZE) // RECORD.itemsize
+  if count <= 0:
+    empty = np.zeros(0, dtype=np.int64)
+    return empty, empty, empty
+  records = np.memmap(path, dtype=RECORD, mode='r', offset=HEADER_SIZE, shape=(count,))
+  sent = records['time_tx'].astype(np.int64)
+  received = records['time_rx_sat'].astype(np.int64)
+  keep = sent > 0
+  return records['id'].astype(np.int64)[keep], sent[keep], np.where(received > 0, received, UNKNOWN)[keep]
+
+
+def loadStats(path):
+  buf, starts, ends = columns.readLines(path)
+  valid, fieldStarts, fieldEnds = columns.split(buf, starts, ends, 3, optional=2)
+  id, idOk = columns.integers(buf, fieldStarts[:, 0], fieldEnds[:, 0])
+  sent, sentOk = timestamps.parse(buf, fieldStarts[:, 1], fieldEnds[:, 1])
+  latency, latencyOk = columns.integers(buf, fieldStarts[:, 2], fieldEnds[:, 2])
+  keep = idOk & sentOk & latencyOk
+  return id[keep], sent[keep], (sent + latency)[keep]
+
+
+def loadResident(path):
+  # messages.json replayed with its journal, the way loadMessages() does on the device
+  messages, records = swarm_journal.load(path, os.path.join(os.path.dirname(path), 'messages.log'))
+  ids = [id for id in messages if id.isdigit()]
+  id = np.array([int(i) for i in ids], dtype=np.int64)
+  sent, sentOk = timestamps.parseStrings([messages[i].get('time_tx', '') for i in ids])
+  received, receivedOk = timestamps.parseStrings([messages[i].get('time_rx_sat', '') for i in ids])
+  return id[sentOk], sent[sentOk], np.where(receivedOk, received, UNKNOWN)[sentOk]
+
+
+def loadUnit(directory):
+  parts = []
+  for name, loader in (('archive.bin', loadBinaryArchive), ('messages.json', loadResident),
+                       ('stats.csv', loadStats)):
+    path = os.path.join(directory, name)
+    if os.path.exists(path) or name == 'messages.json':
+      parts.append(loader(path))
+  id, sent, received = [np.concatenate([part[i] for part in parts]) for i in range(3)]
+  return id, sent, received
+
+
+def load(directories):
+  # one unit per directory, named after it
+  units = []
+  unit = []
+  columnsById = ([], [], [])
+  for directory in directories:
+    id, sent, received = loadUnit(directory)
+    unit.append(np.full(len(id), len(units), dtype=np.int64))
+    for i, column in enumerate((id, sent, received)):
+      columnsById[i].append(column)
+    units.append(os.path.basename(os.path.normpath(directory)))
+  if not units:
+    return Deliveries.concat('swarm', [])
+  unit, id, sent, received = merge(np.concatenate(unit), *[np.concatenate(c) for c in columnsById])
+  return Deliveries('swarm', units, unit, id, sent, received)
+
+
+def expired(deliveries):
+  # undelivered messages the Tile has given up on by the end of their unit's log
+  return ~deliveries.delivered & (deliveries.sent + EXPIRY < deliveries.end[deliveries.unit])
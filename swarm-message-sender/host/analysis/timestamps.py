@@ -0,0 +1,69 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Bulk timestamp parsing into int64 seconds since 1970 (UTC).
+#
+# Accepted layouts, told apart by their length:
+#   19 chars  2022-07-01T13:00:05  TileClock.iso() in ../root/swarm_time.py (a
+#                                  space instead of the 'T' works too)
+#   17 chars  22-07-01 13:00:05    the Iridium backend's transmit_time
+# Anything else, or digits out of range, comes back with ok False.
+
+import numpy as np
+
+from analysis import columns
+
+# offsets of the two-digit century, year, month, day, hour, minute and second
+LAYOUTS = ((19, (0, 2, 5, 8, 11, 14, 17)),
+           (17, (None, 0, 3, 6, 9, 12, 15)))
+
+
+def civilSeconds(year, month, day, hour, minute, second):
+  # seconds since 1970 for arrays of calendar fields, proleptic Gregorian
+  y = year - (month <= 2)
+  era = np.floor_divide(y, 400)
+  yoe = y - era * 400
+  mp = (month + 9) % 12
+  doy = (153 * mp + 2) // 5 + day - 1
+  doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+  days = era * 146097 + doe - 719468
+  return days * 86400 + hour * 3600 + minute * 60 + second
+
+
+def parse(buf, starts, ends):
+  # timestamps in the fields buf[starts:ends], returns (seconds, ok)
+  lengths = ends - starts
+  seconds = np.zeros(len(starts), dtype=np.int64)
+  ok = np.zeros(len(starts), dtype=bool)
+  for length, layout in LAYOUTS:
+    rows = np.flatnonzero(lengths == length)
+    if len(rows) == 0:
+      continue
+    fieldStarts = starts[rows]
+    good = np.ones(len(rows), dtype=bool)
+    values = []
+    for offset in layout:
+      if offset is None:
+        values.append(20)
+        continue
+      tens = columns.column(buf, fieldStarts, offset) - np.uint8(0x30)
+      ones = columns.column(buf, fieldStarts, offset + 1) - np.uint8(0x30)
+      good &= (tens <= 9) & (ones <= 9)
+      values.append(tens.astype(np.int64) * 10 + ones)
+    century, year, month, day, hour, minute, second = values
+    good = good & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & \
+           (hour <= 23) & (minute <= 59) & (second <= 60)
+    seconds[rows] = np.where(good, civilSeconds(century * 100 + year, month, day, hour, minute, second), 0)
+    ok[rows] = good
+  return seconds, ok
+
+
+def parseStrings(strings):
+  # the same for a list of str
+  buf, starts, ends = columns.fromStrings(strings)
+  return parse(buf, starts, ends)
+
+
+def hourOfDay(seconds):
+  return (seconds // 3600) % 24
@@ -0,0 +1,601 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Benchmarks for the firmware hot paths, run on CPython against the sim/
+# stand-in modules.
+#
+#   python3 bench.py                 run everything and compare with the baseline
+#   python3 bench.py tile            only benchmarks whose name contains 'tile'
+#   python3 bench.py --update        run and store the results as the new baseline
+#
+# code.py is loaded up to its '### BEGIN' marker, so every function and global
+# is available without booting. For each benchmark the best time per call over
+# several rounds and the peak bytes allocated during one operation are reported.
+# Times are also expressed relative to a fixed reference loop timed alongside
+# each benchmark, which takes most of the machine's speed (and how busy it is)
+# out of the comparison. A benchmark regresses when its relative time is over
+# the baseline's by more than --tolerance (25%), or it allocates more than 10%
+# (and 64 bytes) over it, and the exit status is then 1. test_bench.py runs
+# the same checks under pytest, one test per benchmark.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import sim
+from bench_tile_parser import TranscriptUART
+
+BASELINE = os.path.join(HERE, 'bench_baseline.json')
+TRANSCRIPT = os.path.join(HERE, 'transcripts', 'tile-1h.txt')
+TOLERANCE = 0.25
+ROUNDS = 9
+MIN_TIME = 0.02
+
+benchmarks = []
+
+
+def bench(name, allocates=True):
+  # setup(fw) returns the operation to time, or (operation, calls per operation);
+  # with allocates=False the run fails if the operation allocates at all
+  def register(setup):
+    benchmarks.append((name, setup, allocates))
+    return setup
+  return register
+
+
+def loadFirmware():
+  with open(os.path.join(sim.FIRMWARE, 'code.py')) as f:
+    source = f.read()
+  source = source[:source.index('### BEGIN')]
+  fw = {'__name__': 'code', '__file__': 'code.py'}
+  exec(compile(source, os.path.join(sim.FIRMWARE, 'code.py'), 'exec'), fw)
+  fw['readPreferences']()
+  # what displayInit() would leave behind, without the splash screen delays
+  from adafruit_display_text import label
+  fw['displayLines'][:] = [label.Label(None, text=20 * ' ') for line in range(6)]
+  return fw
+
+
+class NullSocket:
+  def __init__(self, incoming=b''):
+    self.incoming = incoming
+    self.sent = 0
+
+  def send(self, data):
+    self.sent = self.sent + len(data)
+    return len(data)
+
+  write = send
+
+  def recv_into(self, buf, size=0):
+    n = len(self.incoming)
+    buf[0:n] = self.incoming
+    return n
+
+  def close(self):
+    pass
+
+
+class PasteSocket(NullSocket):
+  # incoming handed out a receive at a time, as a paste arrives, then EAGAIN
+  def __init__(self, incoming):
+    NullSocket.__init__(self, incoming)
+    self.at = 0
+
+  def recv_into(self, buf, size=0):
+    n = min(size or len(buf), len(self.incoming) - self.at)
+    if n == 0:
+      raise OSError(11, 'EAGAIN')
+    buf[0:n] = self.incoming[self.at:self.at + n]
+    self.at = self.at + n
+    return n
+
+
+class NullListener:
+  def accept(self):
+    raise OSError(11, 'EAGAIN')
+
+
+def configuredTile(fw, uart):
+  # wire the parser up the way tileInit() does, without the modem bring-up
+  fw['tileStart'] = lambda state=None: None
+  fw['tileInit'](None)
+  fw['tile'] = uart
+  fw['tileState'] = fw['TILE_STATE_CONFIGURED']
+  fw['tileClock'].setDT(b'20220701130000,V', 0)
+
+
+def drained(fw, op):
+  # nothing answers the Tile commands op queues, forget them so the queue stays empty
+  commands = fw['tileCommands']
+  def run():
+    op()
+    commands.clear()
+  return run
+
+
+def sentence(s):
+  cs = 0
+  for c in s[1:].encode():
+    cs = cs ^ c
+  return ('%s*%02x\n' % (s, cs)).encode()
+
+
+@bench('tilePoll transcript (per sentence)')
+def benchTilePoll(fw):
+  with open(TRANSCRIPT, 'rb') as f:
+    data = f.read()
+  uart = TranscriptUART(data)
+  configuredTile(fw, uart)
+  fw['mdata'][:] = []
+  fw['messageAccepted'] = lambda line: None
+  fw['messageSent'] = lambda line: None
+  fw['print'] = lambda *args, **kwargs: None
+  def op():
+    uart.pos = 0
+    while uart.fill():
+      fw['tilePoll']()
+  return op, data.count(b'\n')
+
+
+def benchSentence(line):
+  def setup(fw):
+    configuredTile(fw, None)
+    fw['print'] = lambda *args, **kwargs: None
+    data = sentence(line)
+    parser = fw['tileParser']
+    # in the receive buffer, as poll() hands it over
+    n = len(data)
+    parser.rx[0:n] = data
+    def op():
+      parser.feed(parser.rx, n)
+    return op
+  return setup
+
+bench('tileParseLine $RT RSSI')(benchSentence('$RT RSSI=-104'))
+bench('tileParseLine $RT packet')(benchSentence('$RT RSSI=-107,SNR=3,FDEV=-1210,TS=2022-07-01 13:00:05,DI=0x3a7f21'))
+bench('tileParseLine $DT')(benchSentence('$DT 20220701130005,V'))
+bench('tileParseLine $GN')(benchSentence('$GN 44.9778,-93.2650,256,0,0'))
+bench('tileParseLine $GS (unhandled)')(benchSentence('$GS 109,214,10,0,G3'))
+
+
+@bench('tileParseLine hook, unhandled $GS', allocates=False)
+def benchUnhandled(fw):
+  # what the firmware does with a sentence nothing handles, without the framing
+  configuredTile(fw, None)
+  fw['print'] = lambda *args, **kwargs: None
+  data = bytearray(sentence('$GS 109,214,10,0,G3').strip())
+  tag = fw['sentenceTag']('$GS')
+  parseLine = fw['tileParseLine']
+  return lambda: parseLine(tag, data, len(data))
+
+
+@bench('tileCommands $TD burst of 4, answered')
+def benchTileCommands(fw):
+  # four messages in flight at once, their $TD OKs matched back in order
+  uart = NullSocket()
+  commands = fw['tileCommands']
+  tag = fw['sentenceTag']('$TD')
+  data = sentence('$TD AI=123,7b7d')
+  ok = bytearray(sentence('$TD OK,5000000123').strip())
+  ids = ['%010d' % i for i in range(4)]
+  def op():
+    for id in ids:
+      commands.send(uart, data, id, 10, 0.0)
+    for id in ids:
+      commands.answer(tag, ok, len(ok))
+    commands.poll(uart, 1.0)
+  return op, 4
+
+
+@bench('makeTileCmd')
+def benchMakeTileCmd(fw):
+  return lambda: fw['makeTileCmd']('$MT C=U')
+
+
+@bench('tdBuffer.td 51 byte payload')
+def benchTdCommand(fw):
+  # hex and checksum in one pass into the preallocated buffer, nothing of the payload's size allocated
+  payload = b'{"id":"1234567890","payload":"2022-07-01T13:00:05"}'
+  return lambda: fw['tdBuffer'].td(123, payload)
+
+
+def benchPayload(encoding):
+  def setup(fw):
+    fw['config']['encoding'] = encoding
+    fw['tile'] = NullSocket()
+    fw['tileClock'].setDT(b'20220701130005', 0)
+    fw['lastGN'] = (44.9778, -93.2650, 256)
+    fw['inaData'].update({1: (3.95, -0.08), 2: (5.2, 0.2), 3: (3.3, 0.085)})
+    fw['print'] = lambda *args, **kwargs: None
+    return drained(fw, fw['sendMessage'])
+  return setup
+
+bench('sendMessage json')(benchPayload('json'))
+bench('sendMessage binary')(benchPayload('binary'))
+bench('sendMessage binary ina gps')(benchPayload('binary ina gps'))
+
+
+@bench('samplePoll into batch')
+def benchSamplePoll(fw):
+  fw['config']['telemetry'] = 5
+  fw['tile'] = NullSocket()
+  fw['tileClock'].setDT(b'20220701130005', 0)
+  fw['inaData'].update({1: (3.95, -0.08), 2: (5.2, 0.2), 3: (3.3, 0.085)})
+  fw['print'] = lambda *args, **kwargs: None
+  def op():
+    fw['nextSampleTime'] = 0
+    fw['samplePoll']()
+  return drained(fw, op)
+
+
+def benchInaPoll(ready):
+  def setup(fw):
+    import busio
+    fw['config']['monitor'] = 'poll'
+    fw['i2c'] = busio.I2C(None, None)
+    fw['inaInit']()
+    device = sim.i2cDevices[0x40]
+    # one look at the rails per cycle, so the model costs little next to inaPoll
+    device.step = 1e9
+    def op():
+      if ready:
+        # as if a conversion cycle had just completed
+        device.converted = device.clock.now() - device.cycleTime()
+      fw['inaPoll']()
+    return op
+  return setup
+
+bench('inaPoll, conversion ready')(benchInaPoll(True))
+bench('inaPoll, not ready')(benchInaPoll(False))
+
+
+def benchInaMonitor(pin):
+  def setup(fw):
+    import board
+    import busio
+    fw['config']['monitor'] = 'alert'
+    fw['INA_ALERT_PIN'] = board.D6 if pin else None
+    fw['i2c'] = busio.I2C(None, None)
+    fw['inaInit']()
+    fw['inaPoll']()
+    def op():
+      # between reads of the rails, with nothing flagged
+      fw['inaNextRead'] = time.monotonic() + 60
+      fw['inaPoll']()
+    return op
+  return setup
+
+bench('inaPoll, alert flags clear')(benchInaMonitor(False))
+bench('inaPoll, alert pin high')(benchInaMonitor(True))
+
+
+@bench('inaPoll, profiling')
+def benchInaPollProfiling(fw):
+  import busio
+  fw['i2c'] = busio.I2C(None, None)
+  fw['inaInit']()
+  fw['profileStart'](True)
+  device = sim.i2cDevices[0x40]
+  device.step = 1e9
+  def op():
+    device.converted = device.clock.now() - device.cycleTime()
+    fw['inaPoll']()
+  return op
+
+
+@bench('powerProfile.window, full ring')
+def benchPowerWindow(fw):
+  profile = fw['PowerProfile']()
+  reading = [3.95, 0.1, 5.2, 0.2, 3.3, 0.085]
+  for i in range(profile.size):
+    profile.add(i * 50, reading)
+  return profile.window
+
+
+@bench('scheduler.due in the early window')
+def benchSchedulerDue(fw):
+  import random
+  rng = random.Random(1)
+  scheduler = fw['scheduler']
+  for i in range(500):
+    scheduler.learn(rng.randrange(24), rng.randrange(300, 20000))
+  scheduler.hearNoise(-100)
+  scheduler.sent(0, 60 * 60)
+  return lambda: scheduler.due(45 * 60, 13, 60 * 60)
+
+
+@bench('deliveryStats.add')
+def benchDeliveryStatsAdd(fw):
+  return lambda: fw['deliveryStats'].add('2022-07-01T13:00:05', 1810)
+
+
+@bench('@show stats quantiles')
+def benchDeliveryStatsSummary(fw):
+  import random
+  rng = random.Random(1)
+  stats = fw['deliveryStats']
+  for i in range(5000):
+    stats.add('2022-07-01T%02d:00:05' % rng.randrange(24), int(rng.lognormvariate(7.5, 1)))
+  return stats.summary
+
+
+@bench('tileClock.stamp')
+def benchTileClockStamp(fw):
+  clock = fw['tileClock']
+  clock.setDT(b'20220701130005', 0)
+  return clock.stamp
+
+
+@bench('tileClock.stamp, next second')
+def benchTileClockTick(fw):
+  clock = fw['tileClock']
+  clock.setDT(b'20220701130005', 0)
+  def op():
+    clock.base = clock.base + 1
+    clock.stamp()
+  return op
+
+
+@bench('tileClock.iso')
+def benchTileClockISO(fw):
+  clock = fw['tileClock']
+  clock.setDT(b'20220701130005', 0)
+  return clock.iso
+
+
+@bench('parseTS $RT')
+def benchParseTS(fw):
+  buf = bytearray(b'$RT RSSI=-110,SNR=-5,FDEV=-1420,TS=2022-07-01 13:00:05,DI=0x0bfb73*4c')
+  start = buf.index(b'TS=') + 3
+  return lambda: fw['parseTS'](buf, start)
+
+
+@bench('isoSeconds')
+def benchIsoSeconds(fw):
+  return lambda: fw['isoSeconds']('2022-07-01T13:00:05')
+
+
+def benchSaveMessages(count):
+  def setup(fw):
+    messages = {}
+    for i in range(count):
+      messages['%010d' % i] = {"tile_msg_id": str(5000000000 + i), "time_tx": '2022-07-01T13:00:05',
+                               "time_rx_sat": '2022-07-01T13:10:41'}
+    fw['messagesById'] = messages
+    return fw['saveMessages']
+  return setup
+
+bench('saveMessages 10')(benchSaveMessages(10))
+bench('saveMessages 1k')(benchSaveMessages(1000))
+bench('saveMessages 10k')(benchSaveMessages(10000))
+
+
+def archiveRecords(count):
+  return [(i * 2654435761 % 4294967296, 5000000000 + i, 1656680405 + i * 60, 1656680405 + i * 90)
+          for i in range(count)]
+
+
+@bench('archive.append')
+def benchArchiveAppend(fw):
+  # includes the index merge every INDEX_TAIL_MAX records, amortised
+  import swarm_archive
+  swarm_archive.write(fw['ARCHIVE_FILE'], archiveRecords(1000))
+  archive = fw['Archive'](fw['ARCHIVE_FILE'])
+  records = archiveRecords(1000 + swarm_archive.INDEX_TAIL_MAX + 1)[1000:]
+  def op():
+    for record in records:
+      archive.append(*record)
+  return op, len(records)
+
+
+@bench('archive.lookup 10k')
+def benchArchiveLookup(fw):
+  import swarm_archive
+  records = archiveRecords(10000)
+  swarm_archive.write(fw['ARCHIVE_FILE'], records)
+  archive = fw['Archive'](fw['ARCHIVE_FILE'])
+  return lambda: archive.lookup(records[4321][0])
+
+
+@bench('writePreferences')
+def benchWritePreferences(fw):
+  return fw['writePreferences']
+
+
+@bench('readPreferences')
+def benchReadPreferences(fw):
+  fw['writePreferences']()
+  return fw['readPreferences']
+
+
+def benchTcpCommand(command):
+  def setup(fw):
+    import wifi
+    wifi.radio.start_ap('swarm')
+    fw['wifi'] = wifi
+    fw['tile'] = NullSocket()
+    fw['tcplistener'] = NullListener()
+    fw['tcpClients'].append(fw['TcpClient'](NullSocket(command), ('127.0.0.1', 50000)))
+    fw['print'] = lambda *args, **kwargs: None
+    return drained(fw, fw['tcpPoll'])
+  return setup
+
+bench('tcpPoll @show battery')(benchTcpCommand(b'@show battery\n'))
+bench('tcpPoll @show')(benchTcpCommand(b'@show\n'))
+bench('tcpPoll passthrough $MT C=U')(benchTcpCommand(b'$MT C=U*12\n'))
+
+
+@bench('tcpPoll pasted batch of 32 lines')
+def benchTcpPaste(fw):
+  # @show and $ lines pasted in at once, framed a receive buffer at a time
+  import wifi
+  wifi.radio.start_ap('swarm')
+  fw['wifi'] = wifi
+  fw['tile'] = NullSocket()
+  fw['tcplistener'] = NullListener()
+  fw['print'] = lambda *args, **kwargs: None
+  conn = PasteSocket(16 * b'@show samples\r\n$MT C=U*12\r\n')
+  client = fw['TcpClient'](conn, ('127.0.0.1', 50000))
+  fw['tcpClients'].append(client)
+  commands = fw['tileCommands']
+  def op():
+    conn.at = 0
+    while conn.at < len(conn.incoming) or client.rxStart < client.rxEnd:
+      fw['tcpPoll']()
+      commands.clear()
+  return op, 32
+
+
+def consoleClients(fw, count):
+  for i in range(count):
+    fw['tcpClients'].append(fw['TcpClient'](NullSocket(), ('127.0.0.1', 50000 + i)))
+  fw['tileClock'].setDT(b'20220701130000,V', 0)
+
+
+@bench('logTile $RT RSSI, 2 clients')
+def benchLogTile(fw):
+  consoleClients(fw, 2)
+  data = bytearray(sentence('$RT RSSI=-104').strip())
+  tag = fw['sentenceTag']('$RT')
+  return lambda: fw['logTile'](tag, data, len(data))
+
+
+@bench('logTCP, 2 clients')
+def benchLogTCP(fw):
+  consoleClients(fw, 2)
+  return lambda: fw['logTCP']('$TD OK,5000000123')
+
+
+
+@bench('streamOut INA frame, 2 clients')
+def benchStreamINA(fw):
+  # packed into the preallocated frame and copied into each client's buffer
+  clients = fw['streamClients']
+  for i in range(2):
+    clients.append(fw['TcpClient'](NullSocket(), ('127.0.0.1', 50000 + i)))
+  reading = [3.952, 0.044, 2.008, 0.076, 3.304, 0.084]
+  frames = fw['streamFrames']
+  def op():
+    fw['streamOut'](frames.ina(fw['streamMs'](), reading))
+    for client in clients:
+      client.drain()
+  return op
+
+def reference():
+  n = 0
+  for i in range(1000):
+    n = n ^ (i * 7)
+  return n
+
+
+def best(op, rounds, minTime):
+  # calibrate so each round runs for about minTime, return the best time per call
+  calls = 1
+  while True:
+    start = time.perf_counter()
+    for i in range(calls):
+      op()
+    elapsed = time.perf_counter() - start
+    if elapsed >= minTime:
+      break
+    calls = calls * 2
+  fastest = elapsed
+  for r in range(rounds - 1):
+    start = time.perf_counter()
+    for i in range(calls):
+      op()
+    fastest = min(fastest, time.perf_counter() - start)
+  return fastest / calls
+
+
+def measure(setup, rounds, minTime):
+  fw = loadFirmware()
+  result = setup(fw)
+  op, per = result if isinstance(result, tuple) else (result, 1)
+  op()
+  seconds = best(op, rounds, minTime)
+  ref = min(best(reference, rounds, minTime / 4), best(reference, rounds, minTime / 4))
+  tracemalloc.start()
+  # the first traced call also counts what tracemalloc allocates for itself
+  op()
+  base = tracemalloc.get_traced_memory()[0]
+  tracemalloc.reset_peak()
+  op()
+  peak = tracemalloc.get_traced_memory()[1] - base
+  tracemalloc.stop()
+  return seconds / per * 1e6, seconds / per / ref, max(0, peak)
+
+
+def loadBaseline():
+  try:
+    with open(BASELINE) as f:
+      return json.load(f)
+  except OSError:
+    return {}
+
+
+def compare(relative, allocated, allocates, old, tolerance=TOLERANCE):
+  # (status, regressed) of a result against its baseline entry old, or None
+  status = ''
+  regressed = False
+  if old is not None:
+    status = '%+6.0f%%' % ((relative / old['relative'] - 1) * 100)
+    if relative > old['relative'] * (1 + tolerance):
+      status = status + ' SLOWER'
+      regressed = True
+    if allocated > old['bytes'] * 1.1 + 64:
+      status = status + ' ALLOCATES MORE (was %d)' % old['bytes']
+      regressed = True
+  if not allocates and allocated > 0:
+    status = status + ' ALLOCATES'
+    regressed = True
+  return status, regressed
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the firmware hot paths')
+  parser.add_argument('filter', nargs='*', help='only run benchmarks whose name contains one of these')
+  parser.add_argument('--update', action='store_true', help='store the results as the new baseline')
+  parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed relative slowdown, 0.25 = 25%% slower')
+  parser.add_argument('--rounds', type=int, default=ROUNDS)
+  parser.add_argument('--min-time', type=float, default=MIN_TIME, help='seconds per round')
+  args = parser.parse_args()
+
+  sim.install(tempfile.mkdtemp(prefix='swarm-bench-'))
+  baseline = loadBaseline()
+
+  results = {}
+  failed = []
+  for name, setup, allocates in benchmarks:
+    if args.filter and not any(f in name for f in args.filter):
+      continue
+    us, relative, allocated = measure(setup, args.rounds, args.min_time)
+    results[name] = {'us': round(us, 3), 'relative': round(relative, 5), 'bytes': round(allocated, 1)}
+    old = None if args.update else baseline.get(name)
+    status, regressed = compare(relative, allocated, allocates, old, args.tolerance)
+    if regressed:
+      failed.append(name)
+    print('%-36s %12.2f us %10.0f bytes  %s' % (name, us, allocated, status))
+
+  if args.update:
+    baseline.update(results)
+    with open(BASELINE, 'w') as f:
+      json.dump(baseline, f, indent=2, sort_keys=True)
+      f.write('\n')
+    print('baseline updated')
+  elif failed:
+    print('%d regression(s)' % len(failed))
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
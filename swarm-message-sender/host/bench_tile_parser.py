@@ -0,0 +1,126 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Host-side throughput benchmark for the Tile sentence parser.
+#
+# Feeds Tile transcripts (one sentence per line, as captured from the UART)
+# through swarm_tile.TileParser and through the line handling code.py used
+# before it, and reports bytes and sentences per second for each.
+#
+#   python3 bench_tile_parser.py [transcript ...]
+#
+# With no arguments every file in transcripts/ is used.
+
+import glob
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'root'))
+
+from swarm_tile import TileParser
+
+UART_BUFFER = 8192
+
+
+class TranscriptUART:
+  # hands out a transcript the way busio.UART does, at most one receive buffer at a time
+  def __init__(self, data):
+    self.data = data
+    self.pos = 0
+    self.available = 0
+
+  def fill(self):
+    self.available = min(UART_BUFFER, len(self.data) - self.pos)
+    return self.available
+
+  def readinto(self, buf):
+    n = min(len(buf), self.available)
+    if n == 0:
+      return None
+    buf[0:n] = self.data[self.pos:self.pos + n]
+    self.pos = self.pos + n
+    self.available = self.available - n
+    return n
+
+  def read(self, nbytes):
+    n = min(nbytes, self.available)
+    if n == 0:
+      return None
+    chars = self.data[self.pos:self.pos + n]
+    self.pos = self.pos + n
+    self.available = self.available - n
+    return chars
+
+
+def legacyParser(counts):
+  # the tilePoll()/tileParseLine() front end code.py used before swarm_tile
+  tileLine = bytearray(800)
+  tilePtr = 0
+  def poll(uart):
+    nonlocal tilePtr
+    while True:
+      chars = uart.read(20)
+      if chars == None:
+        return
+      for c in chars:
+        if c == 0x0A:
+          line = tileLine[:tilePtr].decode()
+          tilePtr = 0
+          if len(line) < 4 or line[len(line) - 3] != '*':
+            continue
+          cksum1 = 0
+          cksum2 = int(line[-2:], 16)
+          for ch in line[1:-3]:
+            cksum1 = cksum1 ^ ord(ch)
+          if cksum1 != cksum2:
+            continue
+          parse = line[:-3].split(' ')
+          counts[0] = counts[0] + 1
+        elif c == 0x08 and tilePtr != 0:
+          tilePtr = tilePtr - 1
+        elif c >= 0x20 and c <= 0x7f and tilePtr < len(tileLine):
+          tileLine[tilePtr] = c
+          tilePtr = tilePtr + 1
+  return poll
+
+
+def tileParser(counts):
+  parser = TileParser(800)
+  def handler(line, n):
+    counts[0] = counts[0] + 1
+  for name in ('$TILE', '$FV', '$DT', '$GS', '$GN', '$RT', '$MT', '$TD'):
+    parser.register(name, handler)
+  return parser.poll
+
+
+def run(name, makeParser, data, repeat):
+  counts = [0]
+  start = time.perf_counter()
+  for i in range(repeat):
+    uart = TranscriptUART(data)
+    poll = makeParser(counts)
+    while uart.fill():
+      poll(uart)
+  elapsed = time.perf_counter() - start
+  total = len(data) * repeat
+  print('  %-8s %9.0f bytes/s %9.0f sentences/s  (%d sentences)' % (name, total / elapsed, counts[0] / elapsed, counts[0] // repeat))
+  return elapsed
+
+
+def main(argv):
+  paths = argv[1:] or sorted(glob.glob(os.path.join(HERE, 'transcripts', '*.txt')))
+  for path in paths:
+    with open(path, 'rb') as f:
+      data = f.read().replace(b'\r\n', b'\n')
+    repeat = max(1, 2000000 // max(1, len(data)))
+    print('%s: %d bytes x %d' % (os.path.basename(path), len(data), repeat))
+    legacy = run('legacy', legacyParser, data, repeat)
+    parser = run('parser', tileParser, data, repeat)
+    print('  speedup  %.2fx' % (legacy / parser))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,158 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Converts message history to and from the binary archive of
+# ../root/swarm_archive.py.
+#
+#   python3 convert_archive.py to-bin unit1 -o unit1.bin
+#   python3 convert_archive.py to-json unit1/archive.bin > messages.json
+#   python3 convert_archive.py to-stats unit1/archive.bin > stats.csv
+#   python3 convert_archive.py lookup unit1/archive.bin 0467184531
+#
+# to-bin joins what a unit directory holds (archive.bin, messages.json with
+# its messages.log, stats.csv) on the message id and writes
+# one record per message, ordered by time_tx, with a complete index. The
+# other commands read an archive through mmap without copying it.
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'root'))
+
+import swarm_archive
+import swarm_journal
+from swarm_time import isoSeconds, isoString
+
+
+class MappedArchive:
+  # archive.bin and archive.idx mapped read-only; records are unpacked straight
+  # out of the mapping and the index is binary searched in place
+
+  def __init__(self, path):
+    self.files = []
+    self.data = self.map(path)
+    magic, version, size = struct.unpack_from(swarm_archive.HEADER, self.data)
+    if magic != swarm_archive.ARCHIVE_MAGIC or size != swarm_archive.RECORD_SIZE:
+      raise ValueError('%s is not an archive' % path)
+    self.count = (len(self.data) - swarm_archive.HEADER_SIZE) // swarm_archive.RECORD_SIZE
+    self.index = None
+    self.indexed = 0
+    try:
+      index = self.map(swarm_archive.indexPath(path))
+      magic, version, size, indexed = struct.unpack_from(swarm_archive.INDEX_HEADER, index)
+      if magic == swarm_archive.INDEX_MAGIC and size == swarm_archive.ENTRY_SIZE and indexed <= self.count:
+        self.index = index
+        self.indexed = indexed
+    except (OSError, ValueError, struct.error):
+      pass
+
+  def map(self, path):
+    f = open(path, 'rb')
+    self.files.append(f)
+    if os.fstat(f.fileno()).st_size == 0:
+      return memoryview(b'')
+    return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+  def record(self, n):
+    return struct.unpack_from(swarm_archive.RECORD, self.data,
+                              swarm_archive.HEADER_SIZE + n * swarm_archive.RECORD_SIZE)
+
+  def records(self):
+    return (self.record(n) for n in range(self.count))
+
+  def lookup(self, id):
+    lo = 0
+    hi = self.indexed
+    while lo < hi:
+      mid = (lo + hi) // 2
+      key, n = struct.unpack_from(swarm_archive.ENTRY, self.index,
+                                  swarm_archive.INDEX_HEADER_SIZE + mid * swarm_archive.ENTRY_SIZE)
+      if key == id:
+        return self.record(n)
+      if key < id:
+        lo = mid + 1
+      else:
+        hi = mid
+    for n in range(self.indexed, self.count):
+      if self.record(n)[0] == id:
+        return self.record(n)
+    return None
+
+
+def readUnit(directory):
+  # id -> [tile_msg_id, time_tx, time_rx_sat] from everything in a unit directory
+  messages = {}
+
+  def update(id, tileMsgId, timeTx, timeRxSat):
+    message = messages.setdefault(id, [0, 0, 0])
+    for i, value in enumerate((tileMsgId, timeTx, timeRxSat)):
+      message[i] = max(message[i], value)
+
+  path = os.path.join(directory, 'archive.bin')
+  if os.path.exists(path):
+    for record in MappedArchive(path).records():
+      update(*record)
+  resident, records = swarm_journal.load(os.path.join(directory, 'messages.json'),
+                                         os.path.join(directory, 'messages.log'))
+  for id, message in resident.items():
+    if id.isdigit() and message.get('tile_msg_id', '').isdigit():
+      update(int(id), int(message['tile_msg_id']), isoSeconds(message.get('time_tx', '')),
+             isoSeconds(message.get('time_rx_sat', '')))
+
+  path = os.path.join(directory, 'stats.csv')
+  if os.path.exists(path):
+    with open(path) as f:
+      for line in f:
+        fields = line.strip().split(',')
+        if len(fields) in (3, 4, 5) and fields[0].isdigit() and fields[2].isdigit():
+          timeTx = isoSeconds(fields[1])
+          update(int(fields[0]), 0, timeTx, timeTx + int(fields[2]))
+  return messages
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Convert message history to and from archive.bin')
+  parser.add_argument('command', choices=['to-bin', 'to-json', 'to-stats', 'lookup'])
+  parser.add_argument('path', help='unit directory for to-bin, archive.bin otherwise')
+  parser.add_argument('ids', nargs='*', help='message ids to look up')
+  parser.add_argument('-o', '--output', help='archive to write, default archive.bin in the unit directory')
+  args = parser.parse_args()
+
+  if args.command == 'to-bin':
+    messages = readUnit(args.path)
+    records = sorted(((id,) + tuple(m) for id, m in messages.items()), key=lambda r: (r[2], r[0]))
+    output = args.output or os.path.join(args.path, 'archive.bin')
+    swarm_archive.write(output, records)
+    print('%s: %d messages' % (output, len(records)), file=sys.stderr)
+    return
+
+  archive = MappedArchive(args.path)
+  if args.command == 'lookup':
+    for id in args.ids:
+      record = archive.lookup(int(id))
+      if record is None:
+        print('%s not archived' % id)
+      else:
+        print('%010d,%d,%s,%s' % (record[0], record[1], isoString(record[2]), isoString(record[3])))
+  elif args.command == 'to-stats':
+    for id, tileMsgId, timeTx, timeRxSat in archive.records():
+      if timeTx and timeRxSat:
+        print('%010d,%s,%d' % (id, isoString(timeTx), timeRxSat - timeTx))
+  else:
+    messages = {}
+    for id, tileMsgId, timeTx, timeRxSat in archive.records():
+      message = {'tile_msg_id': str(tileMsgId), 'time_tx': isoString(timeTx)}
+      if timeRxSat:
+        message['time_rx_sat'] = isoString(timeRxSat)
+      messages['%010d' % id] = message
+    json.dump(messages, sys.stdout)
+    print()
+
+
+if __name__ == '__main__':
+  main()
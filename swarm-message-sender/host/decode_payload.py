@@ -0,0 +1,62 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Decode $TD payloads the way the backend sees them.
+#
+#   python3 decode_payload.py ENKF2MwE1ay9Bw==
+#   python3 decode_payload.py --encoding hex 10d285d8cc04d5acbd07
+#   python3 decode_payload.py < payloads.txt
+#
+# The Swarm Hive delivers message data base64 encoded, the default; the Tile
+# and the TCP console show it in hex, which takes --encoding hex. The
+# encoding is never guessed, since many base64 payloads are valid hex too.
+# Each payload is printed as one line of JSON. The format itself lives in
+# ../root/swarm_payload.py so the firmware and this decoder can't drift apart.
+
+import argparse
+import base64
+import binascii
+import json
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'root'))
+
+import swarm_payload
+
+
+def payloadBytes(text, encoding='base64'):
+  text = text.strip()
+  if encoding == 'hex':
+    return binascii.unhexlify(text)
+  return base64.b64decode(text, validate=True)
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Decode Swarm message payloads')
+  parser.add_argument('payloads', nargs='*', help='payloads, read from stdin if none are given')
+  parser.add_argument('--encoding', choices=['base64', 'hex'], default='base64',
+                      help='base64 as the Hive delivers it (default) or hex as the Tile shows it')
+  args = parser.parse_args()
+
+  failed = 0
+  for text in args.payloads or sys.stdin:
+    if not text.strip():
+      continue
+    try:
+      message = swarm_payload.decode(payloadBytes(text, args.encoding))
+    except (ValueError, IndexError, struct.error, binascii.Error) as e:
+      print('%s: %s' % (text.strip(), e), file=sys.stderr)
+      failed = failed + 1
+      continue
+    if 'time' in message:
+      message['iso'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(message['time']))
+    print(json.dumps(message))
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,95 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Delivery latency report over one or more stats.csv logs.
+#
+#   python3 latency_stats.py simfs/stats.csv
+#   python3 latency_stats.py unit1/stats.csv --save unit1.json
+#   python3 latency_stats.py unit1.json unit2.json unit3/stats.csv
+#   python3 latency_stats.py stats.csv --messages simfs/messages.json
+#
+# CSV logs are streamed, so their length doesn't matter. Every input, CSV or a
+# summary saved earlier with --save, is merged into one report; --save writes
+# the merged summary. --messages counts the messages still waiting for a
+# satellite in a messages.json snapshot and the journal next to it.
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'root'))
+
+import swarm_journal
+from swarm_stats import DeliveryStats
+
+
+def outstanding(path):
+  # the snapshot and its journal put together the way loadMessages() does
+  messages, records = swarm_journal.load(path, os.path.join(os.path.dirname(path), 'messages.log'))
+  return sum(1 for m in messages.values() if 'time_rx_sat' not in m)
+
+
+def duration(seconds):
+  if seconds is None:
+    return '-'
+  if seconds < 120:
+    return '%ds' % seconds
+  if seconds < 7200:
+    return '%.1fm' % (seconds / 60)
+  return '%.1fh' % (seconds / 3600)
+
+
+def report(stats, waiting):
+  print('delivered   %d' % stats.count)
+  if stats.inferred > 0:
+    # found sent after a sleep, their latency is an upper bound
+    print('inferred    %d' % stats.inferred)
+  if waiting is not None:
+    print('outstanding %d' % waiting)
+  if stats.count == 0:
+    return
+  print('from        %s' % stats.first)
+  print('to          %s' % stats.last)
+  print('min         %s' % duration(stats.min))
+  for q in (0.5, 0.9, 0.99):
+    print('p%-10d %s' % (round(q * 100), duration(stats.sketch.quantile(q))))
+  print('max         %s' % duration(stats.max))
+  print('mean        %s' % duration(stats.mean()))
+  print()
+  print('hour (UTC)  count  mean latency')
+  widest = max(stats.hourMean(h) or 0 for h in range(24))
+  for h in range(24):
+    if stats.hourCount[h] > 0:
+      mean = stats.hourMean(h)
+      print('%02d %12d  %-8s %s' % (h, stats.hourCount[h], duration(mean), '#' * round(mean / widest * 40) if widest else ''))
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Delivery latency statistics from stats.csv')
+  parser.add_argument('inputs', nargs='+', help='stats.csv logs or summaries saved with --save')
+  parser.add_argument('--save', help='write the merged summary to this JSON file')
+  parser.add_argument('--messages', help='messages.json to count outstanding messages in')
+  args = parser.parse_args()
+
+  stats = DeliveryStats()
+  for path in args.inputs:
+    if path.endswith('.json'):
+      with open(path) as f:
+        stats.merge(DeliveryStats.fromDict(json.load(f)))
+    else:
+      part = DeliveryStats()
+      bad = part.load(path)
+      if bad:
+        print('%s: skipped %d malformed lines' % (path, bad), file=sys.stderr)
+      stats.merge(part)
+
+  report(stats, outstanding(args.messages) if args.messages else None)
+  if args.save:
+    with open(args.save, 'w') as f:
+      json.dump(stats.toDict(), f)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,242 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Host-side simulation of the Swarm message sender hardware.
+#
+# sim/modules holds stand-ins for the CircuitPython modules code.py imports
+# (board, busio, microcontroller, wifi, socketpool, displayio, ...). They are
+# wired to the models in this package: a virtual clock, a scripted Tile on
+# the UART, an INA3221 register map on I2C, an NVM bytearray and localhost
+# sockets. install() puts them in place and run() boots code.py unmodified,
+# rebooting it whenever it calls microcontroller.reset() or the watchdog
+# fires, the way the FeatherS2 would, and waking it from deep sleep.
+
+import asyncio
+import builtins
+import os
+import shutil
+import sys
+import time as _time
+
+from sim.clock import Clock, ScaledSelector
+from sim.tile import TileModel
+from sim.ina3221 import FakeINA3221, tileRails
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIRMWARE = os.path.normpath(os.path.join(HERE, '..', '..', 'root'))
+MODULES = os.path.join(HERE, 'modules')
+NVM_SIZE = 8192
+
+clock = None
+tile = None
+i2cDevices = {}
+nvm = None
+watchdog = None
+fsdir = None
+portOffset = 2300
+pins = {}
+# the pin the INA3221's CRITICAL and WARNING outputs pull low, board.D6 in code.py
+INA_ALERT_PIN = 'D6'
+sockets = []
+display = []
+resets = 0
+boardPins = {}
+# alarm.sleep_memory, which survives deep sleep but not a reset, and the alarm
+# that ended the last deep sleep
+SLEEP_MEMORY_SIZE = 4096
+sleepMemory = bytearray(SLEEP_MEMORY_SIZE)
+wakeAlarm = None
+slept = 0.0
+
+
+class Reset(BaseException):
+  # microcontroller.reset() or a watchdog timeout
+  pass
+
+
+class DeepSleep(Reset):
+  # alarm.exit_and_deep_sleep_until_alarms(), run() sleeps until one of the
+  # alarms goes off once code.py is out of the way
+  def __init__(self, alarms):
+    super().__init__('deep sleep')
+    self.alarms = alarms
+
+
+class SimulationEnd(BaseException):
+  pass
+
+
+class WatchDog:
+  def __init__(self):
+    self.timeout = None
+    self.mode = None
+    self.lastFeed = 0.0
+
+  def feed(self):
+    self.lastFeed = clock.monotonic()
+
+  def deinit(self):
+    # as on the board, a watchdog that resets can't be turned off
+    if self.mode == 'RESET':
+      raise RuntimeError('WatchDogTimer cannot be deinitialized once mode is set to RESET')
+    self.mode = None
+
+  def check(self):
+    if self.mode is not None and self.timeout and clock.monotonic() - self.lastFeed > self.timeout:
+      self.mode = None
+      raise Reset('watchdog')
+
+
+class SimEventLoopPolicy(asyncio.DefaultEventLoopPolicy):
+  def new_event_loop(self):
+    return asyncio.SelectorEventLoop(ScaledSelector(clock))
+
+
+def hostPath(path):
+  # files code.py opens at the root of CIRCUITPY ('/messages.json') live in fsdir
+  if isinstance(path, str) and path.startswith('/') and os.path.dirname(path) == '/':
+    return os.path.join(fsdir, path[1:])
+  return path
+
+
+def patchFilesystem():
+  hostOpen = builtins.open
+  def simOpen(file, *args, **kwargs):
+    return hostOpen(hostPath(file), *args, **kwargs)
+  builtins.open = simOpen
+  for name in ('remove', 'stat', 'listdir', 'mkdir', 'rmdir'):
+    def wrap(f):
+      return lambda path, *args, **kwargs: f(hostPath(path), *args, **kwargs)
+    setattr(os, name, wrap(getattr(os, name)))
+  hostRename = os.rename
+  os.rename = lambda src, dst: hostRename(hostPath(src), hostPath(dst))
+
+
+def install(workdir, speed=1.0, seed=None, start=None, ports=2300, **tileOptions):
+  # workdir plays the part of the CIRCUITPY drive for everything code.py reads and
+  # writes, the firmware itself is always imported from ../root
+  global clock, tile, nvm, watchdog, fsdir, portOffset
+  fsdir = os.path.abspath(workdir)
+  os.makedirs(fsdir, exist_ok=True)
+  for name in os.listdir(FIRMWARE):
+    if not name.endswith('.py') and os.path.isfile(os.path.join(FIRMWARE, name)) and \
+       not os.path.exists(os.path.join(fsdir, name)):
+      shutil.copy(os.path.join(FIRMWARE, name), fsdir)
+  portOffset = ports
+  clock = Clock(speed, start)
+  tile = TileModel(clock, seed=seed, **tileOptions)
+  i2cDevices[0x40] = FakeINA3221(clock, rails=tileRails(tile), pins=pins, alertPin=INA_ALERT_PIN)
+  watchdog = WatchDog()
+  clock.hooks.append(watchdog.check)
+
+  nvm = bytearray(NVM_SIZE)
+  try:
+    with open(os.path.join(fsdir, 'nvm.bin'), 'rb') as f:
+      f.readinto(nvm)
+  except OSError:
+    pass
+
+  _time.monotonic = clock.monotonic
+  _time.monotonic_ns = clock.monotonic_ns
+  _time.time = clock.time
+  _time.sleep = clock.sleep
+  _time.mktime = clock.mktime
+  _time.localtime = clock.localtime
+  patchFilesystem()
+  asyncio.set_event_loop_policy(SimEventLoopPolicy())
+  sys.path.insert(0, FIRMWARE)
+  sys.path.insert(0, MODULES)
+  os.chdir(fsdir)
+
+
+def saveNvm():
+  with open(os.path.join(fsdir, 'nvm.bin'), 'wb') as f:
+    f.write(nvm)
+
+
+def reboot(wake=None):
+  # forget everything that lives on the FeatherS2, the Tile and the INA3221 keep
+  # running; wake is the alarm that ended a deep sleep, None for a reset
+  global resets, wakeAlarm
+  if wake is None:
+    resets = resets + 1
+    sleepMemory[:] = bytes(SLEEP_MEMORY_SIZE)
+  wakeAlarm = wake
+  tile.listening = False
+  for s in sockets:
+    try:
+      s.close()
+    except OSError:
+      pass
+  del sockets[:]
+  del display[:]
+  pins.clear()
+  watchdog.mode = None
+  for name in list(sys.modules):
+    module = sys.modules[name]
+    path = getattr(module, '__file__', None) or ''
+    if path.startswith(FIRMWARE) or path.startswith(MODULES):
+      del sys.modules[name]
+
+
+def sleepUntil(alarms, step=0.1):
+  # advance the clock until one of the alarm.time and alarm.pin alarms goes
+  # off, pumping the Tile, and return that alarm. A PinAlarm on RX goes off at
+  # the first line the Tile sends while the UART is deinitialized.
+  global slept
+  start = clock.monotonic()
+  try:
+    while True:
+      tile.pump()
+      for alarm in alarms:
+        if hasattr(alarm, 'pin'):
+          if tile.missed if alarm.pin.name == 'RX' else pins.get(alarm.pin.name, alarm.pull) == alarm.value:
+            return alarm
+        elif alarm.monotonic_time is not None:
+          if clock.monotonic() >= alarm.monotonic_time:
+            return alarm
+        elif clock.time() >= alarm.epoch_time:
+          return alarm
+      clock.sleep(step)
+  finally:
+    slept = slept + clock.monotonic() - start
+
+
+def stopAfter(seconds):
+  def check():
+    if clock.monotonic() >= seconds:
+      # only once, so asyncio can still cancel the firmware's tasks on the way out
+      clock.hooks.remove(check)
+      raise SimulationEnd()
+  clock.hooks.append(check)
+
+
+def run(duration=None, maxResets=None):
+  # boot code.py until the run ends, returns the number of resets
+  if duration is not None:
+    stopAfter(duration)
+  try:
+    while True:
+      with open(os.path.join(FIRMWARE, 'code.py')) as f:
+        code = compile(f.read(), os.path.join(FIRMWARE, 'code.py'), 'exec')
+      wake = None
+      try:
+        exec(code, {'__name__': '__main__', '__file__': 'code.py'})
+        # code.py returning is a soft reload on the board
+        clock.sleep(1)
+      except DeepSleep as e:
+        # the watchdog and the UART are powered down with the CPU
+        watchdog.mode = None
+        tile.listening = False
+        wake = sleepUntil(e.alarms)
+      except Reset as e:
+        print('sim: reset (%s) at %.1fs' % (e, clock.monotonic()))
+      reboot(wake)
+      if maxResets is not None and resets > maxResets:
+        break
+  except SimulationEnd:
+    pass
+  finally:
+    saveNvm()
+  return resets
@@ -0,0 +1,99 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Virtual clock for the simulator. Simulated time runs `speed` times faster
+# than wall-clock time, and everything that waits (time.sleep, the asyncio
+# selector) waits 1/speed as long. Hooks run on every wait so the watchdog
+# and the end of the run can be checked without a thread.
+
+import calendar
+import selectors
+import time as _time
+
+# CircuitPython's time.mktime() counts from 2000-01-01, code.py adds this back
+CP_EPOCH_OFFSET = 946684800
+
+# sim.install() replaces time.sleep with Clock.sleep, which needs the real one
+realSleep = _time.sleep
+
+
+class Clock:
+  def __init__(self, speed=1.0, start=None):
+    self.speed = float(speed)
+    self.epoch = _time.time() if start is None else start
+    self.realStart = _time.perf_counter()
+    self.hooks = []
+    self.waited = 0.0  # wall-clock seconds spent in sleep() and select()
+
+  def monotonic(self):
+    return (_time.perf_counter() - self.realStart) * self.speed
+
+  def monotonic_ns(self):
+    return int((_time.perf_counter() - self.realStart) * self.speed * 1000000000)
+
+  def time(self):
+    return int(self.epoch + self.monotonic())
+
+  def now(self):
+    # virtual epoch seconds as a float, for models that need sub-second timing
+    return self.epoch + self.monotonic()
+
+  def sleep(self, seconds):
+    self.check()
+    if seconds > 0:
+      start = _time.perf_counter()
+      realSleep(seconds / self.speed)
+      self.waited = self.waited + _time.perf_counter() - start
+    self.check()
+
+  def busy(self):
+    # the fraction of wall-clock time spent running rather than waiting
+    elapsed = _time.perf_counter() - self.realStart
+    return 0.0 if elapsed <= 0 else 1.0 - self.waited / elapsed
+
+  def check(self):
+    for hook in self.hooks:
+      hook()
+
+  def mktime(self, t):
+    return calendar.timegm(tuple(t[:6]) + (0, 0, 0)) - CP_EPOCH_OFFSET
+
+  def localtime(self, secs=None):
+    if secs is None:
+      secs = self.time()
+    return _time.gmtime(secs)
+
+
+class ScaledSelector(selectors.BaseSelector):
+  # wraps the default selector so asyncio's timeouts, computed in virtual
+  # seconds, turn into the matching wall-clock wait
+
+  def __init__(self, clock):
+    self.clock = clock
+    self.selector = selectors.DefaultSelector()
+
+  def register(self, fileobj, events, data=None):
+    return self.selector.register(fileobj, events, data)
+
+  def unregister(self, fileobj):
+    return self.selector.unregister(fileobj)
+
+  def modify(self, fileobj, events, data=None):
+    return self.selector.modify(fileobj, events, data)
+
+  def select(self, timeout=None):
+    self.clock.check()
+    if timeout is not None:
+      timeout = max(0.0, timeout / self.clock.speed)
+    start = _time.perf_counter()
+    ready = self.selector.select(timeout)
+    self.clock.waited = self.clock.waited + _time.perf_counter() - start
+    self.clock.check()
+    return ready
+
+  def close(self):
+    self.selector.close()
+
+  def get_map(self):
+    return self.selector.get_map()
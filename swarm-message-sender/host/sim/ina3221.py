@@ -0,0 +1,174 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Register-level model of the INA3221 on the I2C bus, for
+# barbudor_ina3221.INA3221. Channel readings come from a function of
+# virtual time so solar days and transmit spikes can be scripted.
+#
+# Conversions run continuously at the rate the config register sets:
+# a cycle of averaging x (bus + shunt conversion time) per enabled channel.
+# The voltage registers change to the averages over a cycle when it
+# completes, which also sets the conversion ready flag (CVRF) until
+# mask/enable is read.
+#
+# The alert flags follow the datasheet: critical compares each conversion
+# with the channel's limit (here the rails every step of virtual time through
+# the cycles since the last check), warning compares the averages, and the
+# power-valid flag (PVF) is set while power isn't valid, that is from a bus
+# voltage below the lower limit until all of them are above the upper one.
+# Reading mask/enable clears the critical and warning flags. With pins and
+# alertPin the CRITICAL and WARNING outputs drive that pin low while a flag
+# is up.
+
+import math
+
+SHUNT_LSB = 0.00004
+BUS_LSB = 0.008
+AVERAGING = (1, 4, 16, 64, 128, 256, 512, 1024)
+CONVERSION_TIME = (0.000140, 0.000204, 0.000332, 0.000588, 0.001100, 0.002116, 0.004156, 0.008244)
+CRITICAL_FLAGS = (0x0200, 0x0100, 0x0080)
+WARNING_FLAGS = (0x0020, 0x0010, 0x0008)
+PVF = 0x0004
+ALERT_STEP = 0.05
+ALERT_STEPS_MAX = 2000
+
+
+def defaultRails(t, shunt):
+  # battery slowly discharging, solar following the sun, 3V3 rail steady
+  hour = (t % 86400) / 3600.0
+  sun = max(0.0, math.sin((hour - 6) / 12.0 * math.pi))
+  return ((3.95, 0.120 - 0.200 * sun),
+          (5.2 * sun, 0.200 * sun),
+          (3.30, 0.085))
+
+
+def tileRails(tile, rails=defaultRails):
+  # rails plus the Tile's transmissions on 3V3, drawn from the battery
+  def withTile(t, shunt):
+    battery, solar, supply = rails(t, shunt)
+    extra = tile.supplyCurrent(t)
+    return ((battery[0], battery[1] + extra * supply[0] / battery[0]), solar, (supply[0], supply[1] + extra))
+  return withTile
+
+
+def signed(value):
+  return value - 0x10000 if value & 0x8000 else value
+
+
+class FakeINA3221:
+  def __init__(self, clock, rails=defaultRails, shunt=(0.01, 0.01, 0.01), pins=None, alertPin=None,
+               step=ALERT_STEP):
+    self.clock = clock
+    self.rails = rails
+    self.shunt = shunt
+    self.pins = pins
+    self.alertPin = alertPin
+    # how finely the rails are sampled within a cycle
+    self.step = step
+    if pins is not None and alertPin is not None:
+      # keep converting between reads so the pin can go low on its own
+      clock.hooks.append(self.convert)
+    self.registers = {0x00: 0x7127, 0x0F: 0x0002, 0x10: 0x2710, 0x11: 0x2328,
+                      0xFE: 0x5449, 0xFF: 0x3220}
+    for reg in range(0x07, 0x0F):
+      self.registers[reg] = 0x7FF8 if reg <= 0x0C else 0
+    self.pointer = 0
+    self.transactions = 0
+    self.converted = clock.now()
+
+  def cycleTime(self):
+    config = self.registers[0x00]
+    channels = max(1, bin(config & 0x7000).count('1'))
+    return channels * AVERAGING[(config >> 9) & 7] * (CONVERSION_TIME[(config >> 6) & 7] + CONVERSION_TIME[(config >> 3) & 7])
+
+  def convert(self):
+    # catch up with the conversions that have completed by now
+    cycle = self.cycleTime()
+    now = self.clock.now()
+    if now - self.converted >= cycle:
+      last = now - (now - self.converted) % cycle
+      self.critical(self.converted, last)
+      self.converted = last
+      self.sample(cycle)
+
+  def critical(self, start, end):
+    steps = min(ALERT_STEPS_MAX, int((end - start) / self.step) + 1)
+    flags = 0
+    for i in range(steps):
+      rails = self.rails(end - i * (end - start) / steps, self.shunt)
+      for ch in range(3):
+        if self.shuntCode(rails[ch][1], ch) > signed(self.registers[0x07 + ch * 2]):
+          flags = flags | CRITICAL_FLAGS[ch]
+    self.alert(flags)
+
+  def shuntCode(self, amps, ch):
+    return int(round(amps * self.shunt[ch] / SHUNT_LSB)) << 3
+
+  def sample(self, cycle=0.0):
+    # the mean of the rails over the cycle that just completed
+    now = self.clock.now()
+    steps = min(ALERT_STEPS_MAX, int(cycle / self.step) + 1)
+    rails = [[0.0, 0.0], [0.0, 0.0], [0.0, 0.0]]
+    for i in range(steps):
+      r = self.rails(now - i * cycle / steps, self.shunt)
+      for ch in range(3):
+        rails[ch][0] = rails[ch][0] + r[ch][0] / steps
+        rails[ch][1] = rails[ch][1] + r[ch][1] / steps
+    flags = 0
+    low = False
+    high = True
+    for ch in range(3):
+      volts, amps = rails[ch]
+      shunt = self.shuntCode(amps, ch)
+      bus = int(round(volts / BUS_LSB)) << 3
+      self.registers[0x01 + ch * 2] = shunt & 0xFFFF
+      self.registers[0x02 + ch * 2] = bus & 0xFFFF
+      if shunt > signed(self.registers[0x08 + ch * 2]):
+        flags = flags | WARNING_FLAGS[ch]
+      low = low or bus < signed(self.registers[0x11])
+      high = high and bus > signed(self.registers[0x10])
+    if low:
+      flags = flags | PVF
+    elif high:
+      self.registers[0x0F] = self.registers[0x0F] & ~PVF
+    # conversion ready
+    self.alert(flags | 0x0001)
+
+  def alert(self, flags):
+    self.registers[0x0F] = self.registers[0x0F] | flags
+    self.updatePin()
+
+  def updatePin(self):
+    if self.pins is not None and self.alertPin is not None:
+      self.pins[self.alertPin] = not self.registers[0x0F] & 0x03B8
+
+  # bus side, called by busio.I2C
+
+  def write(self, data):
+    self.transactions = self.transactions + 1
+    if len(data) == 0:
+      return
+    self.pointer = data[0]
+    if len(data) >= 3:
+      value = (data[1] << 8) | data[2]
+      if self.pointer == 0x00 and value & 0x8000:
+        value = 0x7127
+      self.registers[self.pointer] = value
+      if self.pointer == 0x00:
+        # a new configuration restarts the conversion cycle
+        self.converted = self.clock.now()
+        self.registers[0x0F] = self.registers[0x0F] & ~0x0001
+
+  def read(self, n):
+    self.transactions = self.transactions + 1
+    self.convert()
+    value = self.registers.get(self.pointer, 0)
+    if self.pointer == 0x0F:
+      # reading mask/enable clears the flags, but for power valid
+      self.registers[0x0F] = value & (0x7C00 | PVF)
+      self.updatePin()
+    out = bytearray(n)
+    for i in range(n):
+      out[i] = (value >> 8) & 0xFF if i % 2 == 0 else value & 0xFF
+    return out
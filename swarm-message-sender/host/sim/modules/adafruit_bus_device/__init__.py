@@ -0,0 +1 @@
+# Stand-in for adafruit_bus_device.
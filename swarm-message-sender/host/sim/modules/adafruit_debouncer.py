@@ -0,0 +1,29 @@
+# Stand-in for adafruit_debouncer, without the debounce interval.
+
+
+class Debouncer:
+  def __init__(self, io, interval=0.010):
+    self.io = io
+    self.state = self.read()
+    self.previous = self.state
+
+  def read(self):
+    if callable(self.io):
+      return self.io()
+    return self.io.value
+
+  def update(self):
+    self.previous = self.state
+    self.state = self.read()
+
+  @property
+  def value(self):
+    return self.state
+
+  @property
+  def rose(self):
+    return self.state and not self.previous
+
+  @property
+  def fell(self):
+    return self.previous and not self.state
@@ -0,0 +1 @@
+# Stand-in for adafruit_display_text.
@@ -0,0 +1,11 @@
+# Stand-in for adafruit_display_text.label.
+
+
+class Label:
+  def __init__(self, font, text='', color=0xFFFFFF, scale=1, x=0, y=0, **kwargs):
+    self.font = font
+    self.text = text
+    self.color = color
+    self.scale = scale
+    self.x = x
+    self.y = y
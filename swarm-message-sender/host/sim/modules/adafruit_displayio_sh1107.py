@@ -0,0 +1,7 @@
+# Stand-in for adafruit_displayio_sh1107.
+
+import displayio
+
+
+class SH1107(displayio.Display):
+  pass
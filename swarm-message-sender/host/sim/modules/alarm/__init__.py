@@ -0,0 +1,26 @@
+# Stand-in for the CircuitPython alarm module. Sleeping advances the virtual
+# clock until one of the alarms goes off, see sim.sleepUntil(). While the UART
+# is deinitialized whatever the Tile sends is lost, and a PinAlarm on board.RX
+# goes off at the first such line. Deep sleep raises sim.DeepSleep, which
+# sim.run() turns into a reboot that keeps sleep_memory and sets wake_alarm.
+
+import sim
+from alarm import pin, time
+
+sleep_memory = sim.sleepMemory
+wake_alarm = sim.wakeAlarm
+
+
+def light_sleep_until_alarms(*alarms):
+  global wake_alarm
+  if not alarms:
+    raise ValueError('no alarms')
+  wake_alarm = sim.sleepUntil(alarms)
+  return wake_alarm
+
+
+def exit_and_deep_sleep_until_alarms(*alarms):
+  for alarm in alarms:
+    if isinstance(alarm, pin.PinAlarm) and alarm.pin.name == 'RX':
+      raise ValueError('RX cannot wake the board from deep sleep')
+  raise sim.DeepSleep(alarms)
@@ -0,0 +1,19 @@
+# Stand-in for the CircuitPython board module: every pin name is a Pin. The
+# Pins are kept in sim.boardPins so they are the same objects after a reboot,
+# as an alarm.wake_alarm from before a deep sleep expects.
+
+import sim
+
+
+class Pin:
+  def __init__(self, name):
+    self.name = name
+
+  def __repr__(self):
+    return 'board.' + self.name
+
+
+def __getattr__(name):
+  pin = sim.boardPins.setdefault(name, Pin(name))
+  globals()[name] = pin
+  return pin
@@ -0,0 +1,76 @@
+# Stand-in for the CircuitPython busio module. The UART is the simulated
+# Tile and I2C reaches the devices registered in sim.i2cDevices.
+
+import sim
+
+
+class UART:
+  def __init__(self, tx, rx, *, baudrate=9600, bits=8, parity=None, stop=1, timeout=1, receiver_buffer_size=64):
+    self.tile = sim.tile
+    self.tile.rxSize = receiver_buffer_size
+    self.tile.listen()
+    self.baudrate = baudrate
+    self.timeout = timeout
+
+  def read(self, nbytes=None):
+    sim.clock.check()
+    return self.tile.read(nbytes)
+
+  def readinto(self, buf, nbytes=None):
+    sim.clock.check()
+    return self.tile.readinto(buf, nbytes)
+
+  def readline(self):
+    raise NotImplementedError
+
+  def write(self, buf):
+    if isinstance(buf, str):
+      buf = buf.encode()
+    return self.tile.write(buf)
+
+  @property
+  def in_waiting(self):
+    return self.tile.in_waiting
+
+  def reset_input_buffer(self):
+    self.tile.read()
+
+  def deinit(self):
+    self.tile.listening = False
+
+
+class I2C:
+  def __init__(self, scl, sda, *, frequency=100000, timeout=255):
+    self.frequency = frequency
+    self.locked = False
+
+  def try_lock(self):
+    if self.locked:
+      return False
+    self.locked = True
+    return True
+
+  def unlock(self):
+    self.locked = False
+
+  def scan(self):
+    return sorted(sim.i2cDevices)
+
+  def device(self, address):
+    if address not in sim.i2cDevices:
+      raise OSError(19, 'No such device')
+    return sim.i2cDevices[address]
+
+  def writeto(self, address, buffer, *, start=0, end=None):
+    self.device(address).write(bytes(buffer[start:end]))
+
+  def readfrom_into(self, address, buffer, *, start=0, end=None):
+    end = len(buffer) if end is None else end
+    buffer[start:end] = self.device(address).read(end - start)
+
+  def writeto_then_readfrom(self, address, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0, in_end=None):
+    self.writeto(address, buffer_out, start=out_start, end=out_end)
+    self.readfrom_into(address, buffer_in, start=in_start, end=in_end)
+
+  def deinit(self):
+    pass
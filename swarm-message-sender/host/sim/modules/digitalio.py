@@ -0,0 +1,32 @@
+# Stand-in for the CircuitPython digitalio module. Input levels come from
+# sim.pins, keyed by pin name; unset inputs read as pulled up.
+
+import sim
+
+
+class Direction:
+  INPUT = 'INPUT'
+  OUTPUT = 'OUTPUT'
+
+
+class Pull:
+  UP = 'UP'
+  DOWN = 'DOWN'
+
+
+class DigitalInOut:
+  def __init__(self, pin):
+    self.pin = pin
+    self.direction = Direction.INPUT
+    self.pull = None
+
+  @property
+  def value(self):
+    return sim.pins.get(self.pin.name, self.pull != Pull.DOWN)
+
+  @value.setter
+  def value(self, value):
+    sim.pins[self.pin.name] = bool(value)
+
+  def deinit(self):
+    pass
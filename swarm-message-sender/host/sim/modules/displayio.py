@@ -0,0 +1,64 @@
+# Stand-in for the CircuitPython displayio module. Nothing is drawn, the
+# text of labels shown on the display can be read back from sim.display.
+
+import sim
+
+
+def release_displays():
+  del sim.display[:]
+
+
+class I2CDisplay:
+  def __init__(self, i2c, device_address=0x3C, reset=None):
+    self.i2c = i2c
+    self.device_address = device_address
+
+
+class Group(list):
+  def __init__(self, max_size=None, scale=1, x=0, y=0):
+    list.__init__(self)
+    self.scale = scale
+    self.x = x
+    self.y = y
+
+
+class Palette(list):
+  def __init__(self, colors):
+    list.__init__(self, [0] * colors)
+
+
+class Bitmap:
+  def __init__(self, width, height, value_count):
+    self.width = width
+    self.height = height
+
+
+class OnDiskBitmap:
+  def __init__(self, file):
+    self.file = file
+    self.pixel_shader = Palette(2)
+
+
+class TileGrid:
+  def __init__(self, bitmap, pixel_shader=None, x=0, y=0, **kwargs):
+    self.bitmap = bitmap
+    self.pixel_shader = pixel_shader
+    self.x = x
+    self.y = y
+
+
+class Display:
+  def __init__(self, bus, width=128, height=64, **kwargs):
+    self.bus = bus
+    self.width = width
+    self.height = height
+    self.root_group = None
+    sim.display.append(self)
+
+  def show(self, group):
+    self.root_group = group
+
+  def lines(self):
+    # text of every label currently shown, top to bottom
+    labels = [item for item in (self.root_group or []) if hasattr(item, 'text')]
+    return [label.text for label in sorted(labels, key=lambda label: label.y)]
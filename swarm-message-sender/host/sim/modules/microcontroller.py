@@ -0,0 +1,19 @@
+# Stand-in for the CircuitPython microcontroller module.
+
+import sim
+
+nvm = sim.nvm
+watchdog = sim.watchdog
+
+
+class Processor:
+  temperature = 25.0
+  frequency = 240000000
+  uid = b'\x7c\xdf\xa1\x00\x00\x01'
+
+
+cpu = Processor()
+
+
+def reset():
+  raise sim.Reset('microcontroller.reset()')
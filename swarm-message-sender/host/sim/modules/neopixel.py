@@ -0,0 +1,28 @@
+# Stand-in for the neopixel library.
+
+GRB = 'GRB'
+GRBW = 'GRBW'
+RGB = 'RGB'
+RGBW = 'RGBW'
+
+
+class NeoPixel(list):
+  def __init__(self, pin, n, bpp=3, brightness=1.0, auto_write=True, pixel_order=None):
+    list.__init__(self, [(0,) * bpp] * n)
+    self.pin = pin
+    self.bpp = bpp
+    self.brightness = brightness
+    self.auto_write = auto_write
+    self.writes = 0
+
+  def write(self):
+    self.writes = self.writes + 1
+
+  show = write
+
+  def fill(self, color):
+    for i in range(len(self)):
+      self[i] = color
+
+  def deinit(self):
+    pass
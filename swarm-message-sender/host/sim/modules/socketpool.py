@@ -0,0 +1,72 @@
+# Stand-in for the CircuitPython socketpool module on top of host sockets.
+# Ports are moved up by sim.portOffset so port 23 doesn't need root.
+
+import socket
+
+import sim
+
+
+class Socket:
+  def __init__(self, sock):
+    self.sock = sock
+    sim.sockets.append(self)
+
+  def settimeout(self, value):
+    self.sock.settimeout(value)
+
+  def setblocking(self, flag):
+    self.sock.setblocking(flag)
+
+  def setsockopt(self, level, optname, value):
+    self.sock.setsockopt(level, optname, value)
+
+  def bind(self, address):
+    self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.sock.bind((address[0], address[1] + sim.portOffset))
+
+  def listen(self, backlog):
+    self.sock.listen(backlog)
+
+  def accept(self):
+    conn, addr = self.sock.accept()
+    return Socket(conn), addr
+
+  def connect(self, address):
+    self.sock.connect((address[0], address[1] + sim.portOffset))
+
+  def send(self, data):
+    if isinstance(data, str):
+      data = data.encode()
+    return self.sock.send(data)
+
+  def recv_into(self, buffer, bufsize=0):
+    return self.sock.recv_into(buffer, bufsize)
+
+  def close(self):
+    self.sock.close()
+    if self in sim.sockets:
+      sim.sockets.remove(self)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+class SocketPool:
+  AF_INET = socket.AF_INET
+  SOCK_STREAM = socket.SOCK_STREAM
+  SOCK_DGRAM = socket.SOCK_DGRAM
+  SOL_SOCKET = socket.SOL_SOCKET
+  SO_REUSEADDR = socket.SO_REUSEADDR
+  EAGAIN = 11
+
+  def __init__(self, radio):
+    self.radio = radio
+
+  def socket(self, family=socket.AF_INET, type=socket.SOCK_STREAM, proto=0):
+    return Socket(socket.socket(family, type, proto))
+
+  def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+    return socket.getaddrinfo(host, port, family, type, proto, flags)
@@ -0,0 +1,14 @@
+# Stand-in for the CircuitPython supervisor module.
+
+import time
+
+runtime = None
+
+
+def reload():
+  import microcontroller
+  microcontroller.reset()
+
+
+def ticks_ms():
+  return int(time.monotonic() * 1000) & 0x3FFFFFFF
@@ -0,0 +1,3 @@
+# Stand-in for the CircuitPython terminalio module.
+
+FONT = object()
@@ -0,0 +1,11 @@
+# Stand-in for the CircuitPython watchdog module, the timer itself is
+# microcontroller.watchdog.
+
+
+class WatchDogMode:
+  RAW = 'RAW'
+  RESET = 'RESET'
+
+
+class WatchDogTimeout(Exception):
+  pass
@@ -0,0 +1,44 @@
+# Stand-in for the CircuitPython wifi module. Both station and access point
+# mode end up on the loopback interface.
+
+import ipaddress
+
+
+class Radio:
+  def __init__(self):
+    self._enabled = True
+    self.ipv4_address = None
+    self.ipv4_address_ap = None
+    self.mac_address = b'\x7c\xdf\xa1\x12\x34\x56'
+    self.hostname = 'featherS2'
+
+  @property
+  def enabled(self):
+    return self._enabled
+
+  @enabled.setter
+  def enabled(self, value):
+    # turning the radio off drops the connection and the access point
+    self._enabled = bool(value)
+    if not self._enabled:
+      self.ipv4_address = None
+      self.ipv4_address_ap = None
+
+  def connect(self, ssid, password=None, *, channel=0, bssid=None, timeout=None):
+    if not self.enabled:
+      raise ConnectionError('radio disabled')
+    self.ipv4_address = ipaddress.IPv4Address('127.0.0.1')
+
+  def start_ap(self, ssid, password=None, *, channel=1, authmode=None, max_connections=4):
+    if not self.enabled:
+      raise ConnectionError('radio disabled')
+    self.ipv4_address_ap = ipaddress.IPv4Address('127.0.0.1')
+
+  def stop_ap(self):
+    self.ipv4_address_ap = None
+
+  def stop_station(self):
+    self.ipv4_address = None
+
+
+radio = Radio()
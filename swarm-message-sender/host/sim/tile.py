@@ -0,0 +1,251 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Scripted model of a Swarm Tile on the other end of the UART.
+#
+# It answers the commands code.py uses ($FV, $RS, $DT, $GS, $GN, $RT, $TD,
+# $MT) and emits the periodic sentences the Tile sends once a rate has been
+# set. Everything happens in virtual time: pending output is scheduled and
+# only becomes readable when the clock reaches it, and output that would not
+# fit in the receive buffer is dropped and counted like a UART overrun.
+
+import heapq
+import random
+import time as _time
+
+
+def checksum(s):
+  cs = 0
+  for c in s[1:].encode():
+    cs = cs ^ c
+  return '%s*%02x\n' % (s, cs)
+
+
+TX_TIME = 1.5
+TX_CURRENT = 0.8
+
+
+class TileModel:
+  def __init__(self, clock, seed=None, bootTime=2.0, responseDelay=0.02, sentDelay=(300, 3600),
+               rssiRange=(-108, -88), packetRate=0.02, position=(44.9778, -93.2650, 256), passes=None):
+    self.clock = clock
+    self.random = random.Random(seed)
+    self.bootTime = bootTime
+    self.responseDelay = responseDelay
+    self.sentDelay = sentDelay
+    # UTC hours with a satellite pass, if given a message is sent at the next one
+    # instead of after sentDelay
+    self.passes = sorted(passes) if passes else None
+    self.rssiRange = rssiRange
+    self.packetRate = packetRate
+    self.position = position
+    self.events = []
+    self.seq = 0
+    self.rxBuffer = bytearray()
+    self.rxSize = 8192
+    self.overruns = 0
+    # False while the UART is deinitialized, what the Tile sends then is lost
+    self.listening = True
+    self.missed = False
+    self.lost = 0
+    self.command = bytearray()
+    self.rates = {}
+    self.unsent = []
+    self.nextMsgId = self.random.randint(5000000000, 5999999999)
+    self.log = None
+    # end times of the transmissions the messages go out in, each added as it starts
+    self.transmissions = []
+
+  # UART side, called by the busio.UART stand-in
+
+  def write(self, data):
+    for c in bytes(data):
+      if c == 0x0A:
+        line = self.command.decode('ascii', 'replace').strip()
+        self.command = bytearray()
+        if line:
+          self.handle(line)
+      elif c != 0x0D:
+        self.command.append(c)
+    return len(data)
+
+  def readinto(self, buf, nbytes=None):
+    self.pump()
+    n = min(len(buf) if nbytes is None else nbytes, len(self.rxBuffer))
+    if n == 0:
+      return None
+    buf[0:n] = self.rxBuffer[0:n]
+    del self.rxBuffer[0:n]
+    return n
+
+  def read(self, nbytes=None):
+    self.pump()
+    n = len(self.rxBuffer) if nbytes is None else min(nbytes, len(self.rxBuffer))
+    if n == 0:
+      return None
+    data = bytes(self.rxBuffer[0:n])
+    del self.rxBuffer[0:n]
+    return data
+
+  @property
+  def in_waiting(self):
+    self.pump()
+    return len(self.rxBuffer)
+
+  # scheduling
+
+  def at(self, when, action):
+    self.seq = self.seq + 1
+    heapq.heappush(self.events, (when, self.seq, action))
+
+  def send(self, sentence, delay=None):
+    line = checksum(sentence).encode()
+    self.at(self.clock.now() + (self.responseDelay if delay is None else delay), lambda: self.emit(line))
+
+  def inject(self, offset, sentence):
+    # script a sentence `offset` virtual seconds from now
+    self.send(sentence, offset)
+
+  def listen(self):
+    self.listening = True
+    self.missed = False
+
+  def emit(self, line):
+    if self.log is not None:
+      self.log(line)
+    if not self.listening:
+      self.missed = True
+      self.lost = self.lost + 1
+      return
+    if len(self.rxBuffer) + len(line) > self.rxSize:
+      self.overruns = self.overruns + 1
+      return
+    self.rxBuffer.extend(line)
+
+  def pump(self):
+    now = self.clock.now()
+    while self.events and self.events[0][0] <= now:
+      when, seq, action = heapq.heappop(self.events)
+      action()
+
+  # protocol
+
+  def handle(self, line):
+    if '*' in line:
+      body, cs = line.rsplit('*', 1)
+      if checksum(body)[-3:-1] != cs.lower():
+        self.send(body.split(' ')[0] + ' ERR,BADCHECKSUM')
+        return
+    else:
+      body = line
+    parts = body.split(' ', 1)
+    cmd = parts[0]
+    arg = parts[1] if len(parts) > 1 else ''
+    if cmd == '$FV':
+      self.send('$FV 2021-07-16-00:27:13,v1.1.0')
+    elif cmd == '$RS':
+      self.reboot()
+    elif cmd in ('$DT', '$GS', '$GN', '$RT'):
+      self.rate(cmd, arg)
+    elif cmd == '$TD':
+      self.transmit(arg)
+    elif cmd == '$MT':
+      if arg == 'C=U':
+        self.send('$MT %d' % len(self.unsent))
+      elif arg == 'D=U':
+        self.unsent = []
+        self.send('$MT OK')
+      else:
+        self.send('$MT ERR,BADPARAM')
+    else:
+      self.send(cmd + ' ERR,UNKNOWN')
+
+  def reboot(self):
+    self.send('$RS OK')
+    self.rates = {}
+    self.events = [e for e in self.events if not getattr(e[2], 'periodic', False)]
+    heapq.heapify(self.events)
+    self.send('$TILE BOOT,STARTING', self.bootTime / 2)
+    self.send('$TILE BOOT,RUNNING', self.bootTime)
+
+  def rate(self, cmd, arg):
+    if arg == '@':
+      self.send(self.sentence(cmd))
+      return
+    if arg == '?':
+      self.send('%s %d' % (cmd, self.rates.get(cmd, 0)))
+      return
+    try:
+      seconds = int(arg)
+    except ValueError:
+      self.send(cmd + ' ERR,BADPARAM')
+      return
+    self.send(cmd + ' OK')
+    first = cmd not in self.rates or self.rates[cmd] == 0
+    self.rates[cmd] = seconds
+    if seconds > 0 and first:
+      self.periodic(cmd)
+
+  def periodic(self, cmd):
+    def tick():
+      seconds = self.rates.get(cmd, 0)
+      if seconds <= 0:
+        return
+      self.emit(checksum(self.sentence(cmd)).encode())
+      if cmd == '$RT' and self.random.random() < self.packetRate:
+        self.emit(checksum(self.packet()).encode())
+      self.at(self.clock.now() + seconds, tick)
+    tick.periodic = True
+    self.at(self.clock.now() + self.responseDelay * 2, tick)
+
+  def sentence(self, cmd):
+    if cmd == '$DT':
+      return '$DT ' + _time.strftime('%Y%m%d%H%M%S', _time.gmtime(self.clock.time())) + ',V'
+    if cmd == '$GS':
+      return '$GS 109,214,10,0,G3'
+    if cmd == '$GN':
+      return '$GN %.4f,%.4f,%d,0,0' % self.position
+    return '$RT RSSI=%d' % self.random.randint(*self.rssiRange)
+
+  def packet(self):
+    ts = _time.strftime('%Y-%m-%d %H:%M:%S', _time.gmtime(self.clock.time()))
+    return '$RT RSSI=%d,SNR=%d,FDEV=%d,TS=%s,DI=0x%06x' % (self.random.randint(-112, -95),
+      self.random.randint(-5, 12), self.random.randint(-3000, 3000), ts, self.random.randint(0, 0xffffff))
+
+  def transmit(self, arg):
+    if ',' not in arg and '"' not in arg:
+      self.send('$TD ERR,BADDATA')
+      return
+    msgId = self.nextMsgId
+    self.nextMsgId = self.nextMsgId + 1
+    self.unsent.append(msgId)
+    self.send('$TD OK,%d' % msgId)
+    when = self.nextPass() if self.passes else self.clock.now() + self.random.uniform(*self.sentDelay)
+    def transmitting():
+      if msgId in self.unsent:
+        self.transmissions = self.transmissions[-15:] + [when]
+    def sent():
+      if msgId in self.unsent:
+        self.unsent.remove(msgId)
+        self.emit(checksum('$TD SENT RSSI=%d,SNR=%d,FDEV=%d,%d' % (self.random.randint(-110, -98),
+          self.random.randint(0, 12), self.random.randint(-3000, 3000), msgId)).encode())
+    self.at(max(self.clock.now(), when - TX_TIME), transmitting)
+    self.at(when, sent)
+
+  def supplyCurrent(self, t):
+    # extra current the Tile draws from 3V3 at time t, TX_CURRENT while it
+    # transmits in the TX_TIME before a message is reported sent
+    for end in self.transmissions:
+      if end - TX_TIME <= t < end:
+        return TX_CURRENT
+    return 0.0
+
+  def nextPass(self):
+    now = self.clock.now()
+    day = now - now % 86400
+    for offset in (0, 86400):
+      for hour in self.passes:
+        when = day + offset + hour * 3600 + self.random.uniform(0, 600)
+        if when > now:
+          return when
@@ -0,0 +1,69 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Run the unmodified firmware on the host against simulated hardware.
+#
+#   python3 simulate.py --speed 1000 --duration 86400
+#
+# The firmware is loaded from ../root. The working directory (default ./simfs)
+# stands in for the rest of the CIRCUITPY drive: messages.json, stats.csv and
+# nvm.bin end up there and survive between runs.
+# The TCP console listens on port 23 + --ports (2323 by default), and
+# --profile writes cProfile stats for the run.
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import sim
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Run code.py against simulated hardware')
+  parser.add_argument('--fs', default='simfs', help='directory standing in for CIRCUITPY')
+  parser.add_argument('--speed', type=float, default=1.0, help='simulated seconds per wall-clock second')
+  parser.add_argument('--duration', type=float, default=None, help='simulated seconds to run for')
+  parser.add_argument('--seed', type=int, default=None)
+  parser.add_argument('--ports', type=int, default=2300, help='added to every port the firmware binds')
+  parser.add_argument('--boot-time', type=float, default=2.0, help='seconds the Tile takes to reboot')
+  parser.add_argument('--sent-delay', type=float, nargs=2, default=(300, 3600), metavar=('MIN', 'MAX'),
+                      help='seconds from $TD OK to $TD SENT')
+  parser.add_argument('--passes', type=float, nargs='+', metavar='HOUR',
+                      help='UTC hours of satellite passes, messages are sent at the next one instead of after --sent-delay')
+  parser.add_argument('--script', help='file of "<seconds> <sentence>" lines the Tile sends at those times')
+  parser.add_argument('--trace', action='store_true', help='print everything the Tile sends')
+  parser.add_argument('--profile', help='write cProfile stats to this file')
+  args = parser.parse_args()
+
+  sim.install(args.fs, speed=args.speed, seed=args.seed, ports=args.ports,
+              bootTime=args.boot_time, sentDelay=tuple(args.sent_delay), passes=args.passes)
+  if args.trace:
+    sim.tile.log = lambda line: print('tile: %.3f %s' % (sim.clock.monotonic(), line.decode().strip()))
+  if args.script:
+    with open(args.script) as f:
+      for line in f:
+        line = line.strip()
+        if line and not line.startswith('#'):
+          offset, sentence = line.split(' ', 1)
+          sim.tile.inject(float(offset), sentence)
+
+  if args.profile:
+    import cProfile
+    profile = cProfile.Profile()
+    profile.enable()
+  try:
+    resets = sim.run(args.duration)
+  finally:
+    if args.profile:
+      profile.disable()
+      profile.dump_stats(args.profile)
+  print('sim: %.0f simulated seconds, %d resets, %d UART overruns' % (sim.clock.monotonic(), resets, sim.tile.overruns))
+  print('sim: %.0f seconds asleep, %d Tile lines lost while asleep' % (sim.slept, sim.tile.lost))
+  print('sim: busy %.1f%% of the time, waiting in time.sleep() or asyncio the rest' % (100 * sim.clock.busy()))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,176 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Client for the binary telemetry stream of ../root/swarm_stream.py.
+#
+#   python3 stream_client.py 192.168.4.1
+#   python3 stream_client.py localhost --port 2324 --duration 60 -o run.npz
+#
+# Prints what came in every --every seconds and, with -o, saves everything
+# received as one NumPy structured array per frame type (ina, rt, dt, gn,
+# msg), each with a 'unix' column of seconds since 1970 worked out from the
+# board's ms and the Tile times in the HELLO and DT frames. The ms wrap
+# around after 49 days of uptime, the 'unix' column doesn't.
+#
+# StreamDecoder can be used on its own: feed() it what the socket delivers
+# and take arrays() whenever a dashboard redraws. Frame bodies are only
+# copied, by type, into growing buffers; they become arrays with one
+# np.frombuffer() per type, so no Python runs per field. Needs NumPy.
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'root'))
+
+import swarm_stream
+
+
+def frameDtype(format, names):
+  # a struct body format like '<IhhhB' as a packed little-endian dtype
+  fields = []
+  for name, code in zip(names, format[1:].replace('4s', 's')):
+    fields.append((name, 'S4' if code == 's' else '<' + code))
+  return np.dtype(fields)
+
+
+DTYPES = {type: frameDtype(*frame) for type, frame in swarm_stream.FRAMES.items()}
+
+
+class StreamDecoder:
+
+  def __init__(self):
+    self.pending = bytearray()
+    self.bodies = {type: bytearray() for type in DTYPES}
+    self.skipped = 0  # frames of types or sizes this client doesn't know
+    self.hello = None
+    # the newest Tile time and the board ms it was heard at
+    self.clock = None
+
+  def feed(self, data):
+    pending = self.pending
+    pending += data
+    i = 0
+    end = len(pending)
+    while end - i >= swarm_stream.HEADER_SIZE:
+      size, type = struct.unpack_from(swarm_stream.HEADER, pending, i)
+      start = i + swarm_stream.HEADER_SIZE
+      if end - start < size:
+        break
+      dtype = DTYPES.get(type)
+      if dtype is None or dtype.itemsize != size:
+        self.skipped = self.skipped + 1
+      else:
+        self.bodies[type] += pending[start:start + size]
+        if type == swarm_stream.FRAME_HELLO or type == swarm_stream.FRAME_DT:
+          self.time(type, pending, start)
+      i = start + size
+    del pending[:i]
+
+  def time(self, type, buf, start):
+    if type == swarm_stream.FRAME_HELLO:
+      ms, magic, version, t = struct.unpack_from(swarm_stream.FRAMES[type][0], buf, start)
+      if magic != swarm_stream.STREAM_MAGIC:
+        raise ValueError('not a telemetry stream')
+      self.hello = (ms, version)
+    else:
+      ms, t = struct.unpack_from(swarm_stream.FRAMES[type][0], buf, start)
+    if t != 0:
+      self.clock = (ms, t)
+
+  def arrays(self, clear=True):
+    # frame type name -> structured array of the frames since the last call
+    result = {}
+    for type, body in self.bodies.items():
+      if type == swarm_stream.FRAME_HELLO:
+        continue
+      frames = np.frombuffer(bytes(body), dtype=DTYPES[type])
+      if clear:
+        del body[:]
+      result[swarm_stream.FRAME_NAMES[type]] = frames
+    return result
+
+  def unix(self, ms):
+    # board ms as seconds since 1970, NaN until the Tile time is known
+    if self.clock is None:
+      return np.full(len(ms), np.nan)
+    # the uint32 difference taken as signed copes with ms wrapping around
+    since = (ms.astype(np.uint32) - np.uint32(self.clock[0])).view(np.int32)
+    return self.clock[1] + since / 1000
+
+
+def withUnix(frames, unix):
+  # frames with a 'unix' column appended
+  dtype = np.dtype(frames.dtype.descr + [('unix', '<f8')])
+  result = np.empty(len(frames), dtype=dtype)
+  for name in frames.dtype.names:
+    result[name] = frames[name]
+  result['unix'] = unix
+  return result
+
+
+def summary(arrays):
+  parts = ['%s %d' % (name, len(frames)) for name, frames in arrays.items() if len(frames) > 0]
+  ina = arrays['ina']
+  if len(ina) > 0:
+    last = ina[-1]
+    parts.append('BAT %dmV %dmA SOL %dmV %dmA 3V3 %dmV %dmA' % tuple(last[['bat_mv', 'bat_ma', 'sol_mv', 'sol_ma', 'v3_mv', 'v3_ma']]))
+  rt = arrays['rt']
+  if len(rt) > 0:
+    parts.append('RSSI %d' % rt['rssi'][-1])
+  return ' | '.join(parts) if parts else 'nothing'
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Receive the binary telemetry stream')
+  parser.add_argument('host')
+  parser.add_argument('--port', type=int, default=24)
+  parser.add_argument('--duration', type=float, help='seconds to listen, until interrupted by default')
+  parser.add_argument('--every', type=float, default=1.0, help='seconds between printed summaries')
+  parser.add_argument('-o', '--output', help='save what was received to this .npz')
+  args = parser.parse_args()
+
+  decoder = StreamDecoder()
+  buf = bytearray(65536)
+  view = memoryview(buf)
+  saved = {}
+  conn = socket.create_connection((args.host, args.port))
+  conn.settimeout(args.every)
+  start = time.monotonic()
+  shown = start
+  try:
+    while args.duration is None or time.monotonic() - start < args.duration:
+      try:
+        n = conn.recv_into(buf)
+        if n == 0:
+          break
+        decoder.feed(view[:n])
+      except socket.timeout:
+        pass
+      now = time.monotonic()
+      if now - shown >= args.every:
+        shown = now
+        arrays = decoder.arrays()
+        print(summary(arrays))
+        for name, frames in arrays.items():
+          saved.setdefault(name, []).append(withUnix(frames, decoder.unix(frames['ms'])))
+  except KeyboardInterrupt:
+    pass
+  finally:
+    conn.close()
+  for name, frames in decoder.arrays().items():
+    saved.setdefault(name, []).append(withUnix(frames, decoder.unix(frames['ms'])))
+  if args.output:
+    np.savez(args.output, **{name: np.concatenate(parts) for name, parts in saved.items()})
+    print('%s: %s' % (args.output, ', '.join('%s %d' % (name, sum(len(p) for p in parts))
+                                               for name, parts in saved.items())), file=sys.stderr)
+
+
+if __name__ == '__main__':
+  main()
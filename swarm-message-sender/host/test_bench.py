@@ -0,0 +1,27 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# bench.py under pytest, one test per benchmark, failing on the same
+# regressions against bench_baseline.json:
+#
+#   python3 -m pytest test_bench.py
+#   python3 -m pytest test_bench.py -k tileCommands
+
+import pytest
+
+import bench
+import sim
+
+
+@pytest.fixture(scope='module')
+def baseline(tmp_path_factory):
+  sim.install(str(tmp_path_factory.mktemp('swarm-bench')))
+  return bench.loadBaseline()
+
+
+@pytest.mark.parametrize('name, setup, allocates', bench.benchmarks, ids=[b[0] for b in bench.benchmarks])
+def test_benchmark(baseline, name, setup, allocates):
+  us, relative, allocated = bench.measure(setup, bench.ROUNDS, bench.MIN_TIME)
+  status, regressed = bench.compare(relative, allocated, allocates, baseline.get(name))
+  assert not regressed, '%s: %.2f us, %d bytes %s' % (name, us, allocated, status)
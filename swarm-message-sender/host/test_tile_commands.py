@@ -0,0 +1,131 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# TileCommands from ../root/swarm_tile.py driven the way code.py drives it:
+# commands go out through send() and poll(), the Tile's sentences come back
+# through answer().
+#
+#   python3 -m pytest test_tile_commands.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'root'))
+
+from swarm_tile import TileCommands, command, sentenceTag
+
+TAG_TD = sentenceTag('$TD')
+TAG_DT = sentenceTag('$DT')
+
+
+class RecordingUART:
+  def __init__(self):
+    self.written = []
+
+  def write(self, data):
+    self.written.append(bytes(data))
+
+
+def line(s):
+  # a sentence as TileParser hands it over, without the newline
+  data = bytearray(command(s).strip())
+  return data, len(data)
+
+
+def answer(commands, tag, s):
+  return commands.answer(tag, *line(s))
+
+
+def queue(window=8, size=16):
+  commands = TileCommands(window=window, size=size, grace=10)
+  timeouts = []
+  commands.onTimeout = lambda tag, context: timeouts.append((tag, context))
+  return commands, RecordingUART(), timeouts
+
+
+def test_late_answer_after_timeout():
+  commands, uart, timeouts = queue()
+  commands.send(uart, command('$TD AI=1,00'), 'first', 5, 0.0)
+  commands.poll(uart, 6.0)
+  assert timeouts == [(TAG_TD, 'first')]
+  assert commands.stale == 1
+  # held back until the late answer is in, so it can't be taken for this one's
+  commands.send(uart, command('$TD AI=1,01'), 'second', 5, 6.0)
+  assert len(uart.written) == 1
+  assert len(commands.waiting) == 1
+  assert not answer(commands, TAG_TD, '$TD OK,5000000001')
+  assert commands.context is None
+  assert commands.late == 1
+  assert commands.stale == 0
+  commands.poll(uart, 7.0)
+  assert uart.written[1] == command('$TD AI=1,01')
+  assert answer(commands, TAG_TD, '$TD OK,5000000002')
+  assert commands.context == 'second'
+
+
+def test_lost_answer_expires_after_grace():
+  commands, uart, timeouts = queue()
+  commands.send(uart, command('$TD AI=1,00'), 'first', 5, 0.0)
+  commands.send(uart, command('$TD AI=1,01'), 'second', 5, 0.0)
+  commands.poll(uart, 6.0)
+  assert timeouts == [(TAG_TD, 'first'), (TAG_TD, 'second')]
+  commands.poll(uart, 16.0)
+  assert commands.inflight == []
+  assert commands.stale == 0
+  assert not answer(commands, TAG_TD, '$TD OK,5000000001')
+  assert commands.late == 0
+
+
+def test_periodic_report_does_not_answer_rate_command():
+  commands, uart, timeouts = queue()
+  commands.send(uart, command('$DT 5'), None, 5, 0.0)
+  assert not answer(commands, TAG_DT, '$DT 20220701130005,V')
+  assert len(commands.inflight) == 1
+  assert answer(commands, TAG_DT, '$DT OK')
+  assert commands.inflight == []
+
+
+def test_query_answered_by_report():
+  commands, uart, timeouts = queue()
+  commands.send(uart, command('$DT 5'), 'rate', 5, 0.0)
+  commands.send(uart, command('$DT @'), 'time', 5, 0.0)
+  # the rate command only takes an OK, the query takes the report
+  assert answer(commands, TAG_DT, '$DT 20220701130005,V')
+  assert commands.context == 'time'
+  assert answer(commands, TAG_DT, '$DT OK')
+  assert commands.context == 'rate'
+
+
+def test_td_err_answers_oldest_td():
+  commands, uart, timeouts = queue()
+  commands.send(uart, command('$TD AI=1,00'), 'first', 5, 0.0)
+  commands.send(uart, command('$TD AI=1,01'), 'second', 5, 0.0)
+  # $TD SENT reports a transmission, it answers nothing
+  assert not answer(commands, TAG_TD, '$TD SENT RSSI=-104,SNR=-5,FDEV=-1420,5000000001')
+  assert answer(commands, TAG_TD, '$TD ERR,BUSY')
+  assert commands.context == 'first'
+  assert answer(commands, TAG_TD, '$TD OK,5000000002')
+  assert commands.context == 'second'
+  assert timeouts == []
+
+
+def test_window_overflow_waits():
+  commands, uart, timeouts = queue(window=2, size=2)
+  for i in range(4):
+    assert commands.send(uart, command('$TD AI=1,%02x' % i), i, 5, 0.0)
+  assert uart.written == [command('$TD AI=1,00'), command('$TD AI=1,01')]
+  assert [entry[1] for entry in commands.waiting] == [2, 3]
+  # both the window and the waiting list are full
+  assert not commands.send(uart, command('$TD AI=1,04'), 4, 5, 0.0)
+  assert answer(commands, TAG_TD, '$TD OK,5000000000')
+  assert commands.context == 0
+  commands.poll(uart, 1.0)
+  assert uart.written[2:] == [command('$TD AI=1,02')]
+  assert [entry[1] for entry in commands.waiting] == [3]
+  for i in (1, 2):
+    assert answer(commands, TAG_TD, '$TD OK,500000000%d' % i)
+    assert commands.context == i
+  commands.poll(uart, 2.0)
+  assert uart.written[3:] == [command('$TD AI=1,03')]
+  assert commands.waiting == []
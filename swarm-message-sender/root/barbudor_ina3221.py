@@ -172,7 +172,7 @@ class INA3221:
 
     def read(self, reg):
         """Return value from device register"""
-        buf = bytearray(3)
+        buf = self._buf
         buf[0] = reg
         with self.i2c_device as i2c:
             i2c.write_then_readinto(buf, buf, out_end=1, in_start=1)
@@ -191,6 +191,8 @@ class INA3221:
         self.i2c_device = I2CDevice(i2c_bus, i2c_addr)
         self.i2c_addr = i2c_addr
         self.shunt_resistor = shunt_resistor
+        self._buf = bytearray(3)
+        self.flags = 0
 
         self.write(C_REG_CONFIG,  C_AVERAGING_16_SAMPLES | \
                                   C_VBUS_CONV_TIME_1MS | \
@@ -241,7 +243,7 @@ class INA3221:
     def set_shunt_critical_alert_limit(self, channel, voltage):
         """Sets the channel's shunt voltage critical alert limit in Volts"""
         assert 1 <= channel <= 3, "channel argument must be 1, 2, or 3"
-        value = self._to_unsigned(round(voltage * C_SHUNT_ADC_LSB) * 8)
+        value = self._to_unsigned(round(voltage / C_SHUNT_ADC_LSB) * 8)
         self.write(C_REG_CRITICAL_ALERT_LIMIT_CH[channel], value)
 
     def shunt_warning_alert_limit(self, channel=1):
@@ -254,11 +256,80 @@ class INA3221:
     def set_shunt_warning_alert_limit(self, channel, voltage):
         """Sets the channel's shunt voltage warning alert limit in Volts"""
         assert 1 <= channel <= 3, "channel argument must be 1, 2, or 3"
-        value = self._to_unsigned(round(voltage * C_SHUNT_ADC_LSB) * 8)
+        value = self._to_unsigned(round(voltage / C_SHUNT_ADC_LSB) * 8)
         self.write(C_REG_WARNING_ALERT_LIMIT_CH[channel], value)
 
+    def power_valid_limits(self):
+        """Returns the (upper, lower) power-valid bus voltage limits in Volts"""
+        upper = self._to_signed(self.read(C_REG_POWER_VALID_UPPER_LIMIT)) / 8
+        lower = self._to_signed(self.read(C_REG_POWER_VALID_LOWER_LIMIT)) / 8
+        return upper * C_BUS_ADC_LSB, lower * C_BUS_ADC_LSB
+
+    def set_power_valid_limits(self, upper, lower):
+        """Sets the power-valid bus voltage limits in Volts. Power is valid once
+        all three bus voltages rise above upper and stays valid until one of them
+        falls below lower."""
+        self.write(C_REG_POWER_VALID_UPPER_LIMIT, self._to_unsigned(round(upper / C_BUS_ADC_LSB) * 8))
+        self.write(C_REG_POWER_VALID_LOWER_LIMIT, self._to_unsigned(round(lower / C_BUS_ADC_LSB) * 8))
+
+    def set_alert_latch(self, warning=True, critical=True):
+        """Latches the warning and critical alert flags (and their pins) until
+        mask/enable is read, instead of following the measurement"""
+        value = 0
+        if warning:
+            value |= C_WARNING_LATCH_ENABLE
+        if critical:
+            value |= C_CRITICAL_LATCH_ENABLE
+        self.update(C_REG_MASK_ENABLE, C_WARNING_LATCH_ENABLE | C_CRITICAL_LATCH_ENABLE, value)
+
+    def alert_flags(self):
+        """Reads the mask/enable register and returns its flags (the
+        ``C_CRITICAL_FLAG_CH``, ``C_WARNING_FLAG_CH``, ``C_POWER_ALERT_FLAG``,
+        ... bits), also kept in ``flags``. Reading clears the latched flags and
+        the conversion ready flag."""
+        buf = self._buf
+        buf[0] = C_REG_MASK_ENABLE
+        with self.i2c_device as i2c:
+            i2c.write_then_readinto(buf, buf, out_end=1, in_start=1)
+        self.flags = (buf[1] << 8) | buf[2]
+        return self.flags
+
     @property
     def is_ready(self):
         """Returns the CVRF (ConVersion Ready Flag) from the mask/enable register """
         regvalue = self.read(C_REG_MASK_ENABLE)
-        return (regvalue & C_CONV_READY_FLAG) != 0
\ No newline at end of file
+        return (regvalue & C_CONV_READY_FLAG) != 0
+
+    def read_all(self, values=None, force=False):
+        """Reads the shunt and bus voltages of all three channels at once, if a
+        conversion cycle has completed since the last call (the CVRF flag) or
+        ``force`` is set, in which case they are those of the last cycle.
+
+        The INA3221 has no register auto-increment, so these are still seven
+        register reads (mask/enable, then 0x01-0x06), but they are done under one
+        bus lock into one preallocated buffer, without the per-call asserts, and
+        all six values come from the same conversion cycle.
+
+        Fills ``values`` (a list of 6, allocated if None) with
+        ``[bus1, current1, bus2, current2, bus3, current3]`` in Volts and Amps
+        and returns it, or returns None if no new conversion is ready. Reading
+        mask/enable clears its alert flags, so the value read is kept in
+        ``flags``."""
+        buf = self._buf
+        with self.i2c_device as i2c:
+            buf[0] = C_REG_MASK_ENABLE
+            i2c.write_then_readinto(buf, buf, out_end=1, in_start=1)
+            self.flags = (buf[1] << 8) | buf[2]
+            if not self.flags & C_CONV_READY_FLAG and not force:
+                return None
+            if values is None:
+                values = [0.0] * 6
+            for channel in range(3):
+                buf[0] = C_REG_SHUNT_VOLTAGE_CH[channel + 1]
+                i2c.write_then_readinto(buf, buf, out_end=1, in_start=1)
+                shunt = self._to_signed((buf[1] << 8) | buf[2]) / 8 * C_SHUNT_ADC_LSB
+                buf[0] = C_REG_BUS_VOLTAGE_CH[channel + 1]
+                i2c.write_then_readinto(buf, buf, out_end=1, in_start=1)
+                values[2 * channel] = self._to_signed((buf[1] << 8) | buf[2]) / 8 * C_BUS_ADC_LSB
+                values[2 * channel + 1] = shunt / self.shunt_resistor[channel]
+        return values
@@ -12,15 +12,33 @@ import neopixel
 from adafruit_display_text import label
 import adafruit_displayio_sh1107
 from barbudor_ina3221 import *
+from swarm_tile import TileParser, TileCommands, CommandBuffer, command, sentenceTag, parseInt, indexOf, TAG_INVALID
+from swarm_payload import ENCODERS, SampleBatch, inaValues
+from swarm_schedule import SendScheduler
+from swarm_stats import DeliveryStats, parseStatsLine
+from swarm_archive import Archive
+from swarm_time import TileClock, parseTS, compactString, isoSeconds, isoString
+from swarm_power import PowerProfile
+from swarm_sleep import SleepState
+import swarm_journal
+from swarm_stream import StreamFrames, FRAME_HELLO, FRAME_RT, FRAME_DT, FRAME_GN, FRAME_MSG, \
+  MSG_ACCEPTED, MSG_REJECTED, MSG_SENT, STREAM_MAGIC, STREAM_VERSION
 import supervisor
 import sys
 import microcontroller
 import json
-from binascii import hexlify, a2b_base64
+import os
+import errno
+from binascii import a2b_base64
 from microcontroller import watchdog as w
 from watchdog import WatchDogMode
 from adafruit_debouncer import Debouncer
 import gc
+# asyncio and adafruit_ticks need CircuitPython 7.1 or later; lib/ has their
+# sources, the bundle's .mpy builds replace them on the device
+import asyncio
+from adafruit_ticks import ticks_ms
+import alarm
 
 try:
     import urandom as random
@@ -29,31 +47,53 @@ except ImportError:
 
 
 tile = None
-tileLine = bytearray(800)
-tilePtr = 0
+tileParser = TileParser(800)
 
 TILE_STATE_UNKNOWN = 0
 TILE_STATE_REBOOTING = 1
-TILE_STATE_2 = 2
-TILE_STATE_3 = 3
-TILE_STATE_4 = 4
-TILE_STATE_5 = 5
-TILE_STATE_CONFIGURED = 6
-
-
-tileStateTable = [('$FV',   '$FV 20',              4, TILE_STATE_2, TILE_STATE_REBOOTING),  # 0 state
-                  ('$RS',   '$TILE BOOT,RUNNING', 30, TILE_STATE_2, TILE_STATE_REBOOTING),  # 1 state
-                  ('$DT 5', '$DT OK',              4, TILE_STATE_3, TILE_STATE_REBOOTING),  # 2 state
-                  ('$GS 5', '$GS OK',              4, TILE_STATE_4, TILE_STATE_REBOOTING),  # 3 state
-                  ('$GN 5', '$GN OK',              4, TILE_STATE_5, TILE_STATE_REBOOTING),  # 4 state
-                  ('$RT 5', '$RT OK',              4, TILE_STATE_CONFIGURED, TILE_STATE_REBOOTING),  # 5 state
-                  (None,     None,                 0, TILE_STATE_CONFIGURED, TILE_STATE_CONFIGURED)]  # 6 state
-tileTimeout = 0.0
+TILE_STATE_CONFIGURING = 2
+TILE_STATE_CONFIGURED = 3
+
+# The Tile is brought up by tileBringUp() from tilePoll(), so the other tasks
+# keep running meanwhile. Each state sends its commands and waits up to the
+# timeout for every reply, then moves on to the success or the failure state.
+# The configuration commands don't depend on each other and all go out at
+# once; on a timeout only the unanswered ones are sent again, up to
+# TILE_CONFIG_TRIES times. Every consecutive failure waits twice as long as
+# the one before before the next command, from TILE_BACKOFF up to
+# TILE_BACKOFF_MAX.
+tileStateTable = [(['$FV'], ['$FV 20'],              4, TILE_STATE_CONFIGURING, TILE_STATE_REBOOTING),  # 0 state
+                  (['$RS'], ['$TILE BOOT,RUNNING'], 30, TILE_STATE_CONFIGURING, TILE_STATE_REBOOTING),  # 1 state
+                  (['$DT 5', '$GS 5', '$GN 5', '$RT 5'],
+                   ['$DT OK', '$GS OK', '$GN OK', '$RT OK'], 4, TILE_STATE_CONFIGURED, TILE_STATE_REBOOTING),  # 2 state
+                  ([],      [],                      0, TILE_STATE_CONFIGURED, TILE_STATE_CONFIGURED)]  # 3 state
+TILE_CONFIG_TRIES = 3
+TILE_BACKOFF = 1
+TILE_BACKOFF_MAX = 60
+# in full power mode the Tile sends $DT every 5 seconds, silence this long means it needs a restart
+TILE_SILENCE = 60
+tileTimeout = 0.0  # 0 until the state's commands are sent, -1 once every reply is in
 tileState = TILE_STATE_UNKNOWN
+tilePending = []  # indexes of the state's commands still waiting for a reply
+tileRetryAt = 0.0
+tileTries = 0
+tileFailures = 0
+tileStarted = 0.0
+tileConfiguredIn = None
+tileBringUps = 0
+tileRetries = 0
+tileLastHeard = 0.0
+TAG_TILE = sentenceTag('$TILE')
+TAG_DT = sentenceTag('$DT')
+# commands in flight and their answers, see swarm_tile.py
+tileCommands = TileCommands()
+# where $TD commands are built
+tdBuffer = CommandBuffer()
+APP_ID = 123
+TILE_COMMAND_TIMEOUT = 10
 tileMessageFilters = ['$DT', '$RT', '$GS', '$GN', '$MT']
+tileMessageFilterTags = [sentenceTag(f) for f in tileMessageFilters]
 
-tcpLine = bytearray(800)
-tcpPtr = 0
 i2c = None
 
 TCPHOST = ""
@@ -61,54 +101,301 @@ TCPPORT = 23
 TIMEOUT = None
 BACKLOG = 2
 MAXBUF = 256
-TCPSTATE_LISTENING = 1
-TCPSTATE_CONNECTED = 2
-TCPSTATE = TCPSTATE_LISTENING
+TCP_MAX_CLIENTS = 4
+TCP_OUTBUF = 4096
+TCP_LINE = 800
+TCP_LINES_PER_POLL = 8  # of a pasted batch, see tcpReceive()
+# buffered output goes out in one send once it reaches this size or gets this old
+TCP_FLUSH_SIZE = 1024
+TCP_FLUSH_LATENCY = 0.1
 tcplistener = None
-tcpconn = None
+tcpClients = []
+tcpDropped = 0
+# binary telemetry frames (swarm_stream.py) for host dashboards, on their own port
+STREAMPORT = 24
+STREAM_MAX_CLIENTS = 2
+streamListener = None
+streamClients = []
+streamFrames = StreamFrames()
 
 config = None
 displayLines = []
 inaChannel = 1
 inaConnected = False
 inaData = {1: (None, None), 2: (None, None), 3: (None, None)}
+# filled in place by INA3221.read_all(): bus V and current A of channels 1, 2, 3
+inaReading = [0.0] * 6
+# current summed per channel over every reading since boot, for the mean @show reports
+inaSums = [0.0, 0.0, 0.0]
+inaReadings = 0
+INA_NAMES = {1: 'BAT:', 2: 'SOL:', 3: '3V3:'}
+INA_SHUNT = (0.01, 0.01, 0.01)
+inaShown = 0
+inaNextRead = 0
+# whether a conversion cycle has completed since inaInit(), so the rails can be read
+inaCycled = False
+inaAlertPin = None
+# the power-valid flag as last read, None before the first read
+inaPowerFlag = None
+# (ISO time, text) of the last alerts
+inaAlerts = []
 
 switchA = None
 switchC = None
 
 accumulate = ""
-inaTime = 0
 
 pixels = neopixel.NeoPixel(board.IO38, 2, bpp=4, pixel_order=neopixel.GRBW)
 
 mdata = []
+# the last GPS fix as (lat, lon, alt), None without one
 lastGN = None
-lastDT = None
+# the Tile's $DT time, see swarm_time.py
+tileClock = TileClock()
 lastRSSI = None
-lastId = None
-nextSendTime = 0
 nextStatusTime = 0
+# messages go out every config['interval'] minutes, moved earlier or later by the scheduler
+STATS_FILE = "/stats.csv"
+# what scheduler and deliveryStats learned from stats.csv, and its size then,
+# so that a boot doesn't have to read the whole log again
+STATS_SUMMARY_FILE = "/stats.json"
+scheduler = SendScheduler()
+deliveryStats = DeliveryStats()
+statsSummarySaved = False  # STATS_SUMMARY_FILE covers all of stats.csv
+tileUnsent = 0
+
+# INA samples taken every config['telemetry'] seconds are batched into as few
+# $TD messages as possible. A batch goes out when it is full, when its oldest
+# sample reaches SAMPLE_MAX_AGE or right away for a priority sample (the battery
+# dropping below BATTERY_LOW), but not while the Tile already holds
+# SAMPLE_MAX_UNSENT unsent messages; samples that don't fit then are dropped.
+SAMPLE_MAX_AGE = 15 * 60
+SAMPLE_MAX_UNSENT = 4
+BATTERY_LOW = 3.5
+sampleBatch = SampleBatch()
+nextSampleTime = 0
+samplesDropped = 0
+batteryLow = False
+
+# how often each task wakes up, in seconds
+TILE_POLL_INTERVAL = 0.05
+TCP_POLL_INTERVAL = 0.05
+TCP_LISTEN_INTERVAL = 0.25
+BUTTON_POLL_INTERVAL = 0.05
+# telemetry samples are taken no more often than this
+TELEMETRY_MIN_INTERVAL = 5
+# how often to check for a finished INA3221 conversion cycle (about 6 s with
+# INA_CONFIG), and to update inaData and the display at most
+INA_READY_INTERVAL = 1
+INA_SHOW_INTERVAL = 5
+INA_CONFIG_MASK = C_AVERAGING_MASK | C_VBUS_CONV_TIME_MASK | C_SHUNT_CONV_TIME_MASK | C_MODE_MASK
+INA_CONFIG = C_AVERAGING_128_SAMPLES | C_VBUS_CONV_TIME_8MS | C_SHUNT_CONV_TIME_8MS | C_MODE_SHUNT_AND_BUS_CONTINOUS
+# while profiling, a cycle of 4 x 1.1 ms conversions on 3 channels takes about
+# 26 ms, so every PROFILE_INTERVAL poll finds a new one; shorter conversions
+# only add noise at a rate the loop can't keep up with anyway
+INA_PROFILE_CONFIG = C_AVERAGING_4_SAMPLES | C_VBUS_CONV_TIME_1MS | C_SHUNT_CONV_TIME_1MS | C_MODE_SHUNT_AND_BUS_CONTINOUS
+# With config['monitor'] == 'alert' the INA3221 watches the rails itself: it
+# checks every single conversion against the critical limits and each average
+# against the warning limits, and latches what it finds, so the firmware only
+# reads the flags every INA_ALERT_INTERVAL (or the pin every INA_PIN_INTERVAL
+# if the CRITICAL and WARNING outputs are wired to INA_ALERT_PIN; they are open
+# drain and active low, so both can share it) and the rails every
+# INA_MONITOR_INTERVAL or when something is flagged. There is one power-valid
+# window for all three bus voltages, so a change of its flag is a dying battery
+# or the solar panel going dark or coming back, told apart by reading the rails;
+# it has no output on the pin, so with the pin it shows at the next read.
+INA_ALERT_PIN = None
+INA_ALERT_INTERVAL = 5
+INA_PIN_INTERVAL = 0.25
+INA_MONITOR_INTERVAL = 60
+# current limits in A per channel (BAT, SOL, 3V3), None for none; the Tile
+# draws about 0.9 A while it transmits
+INA_CRITICAL_LIMITS = (None, None, 1.5)
+INA_WARNING_LIMITS = (None, None, 0.5)
+INA_NO_LIMIT = 4095 * C_SHUNT_ADC_LSB
+# power is valid once every bus is above INA_PV_UPPER, until one is below INA_PV_LOWER
+INA_PV_UPPER = 3.2
+INA_PV_LOWER = 3.1
+INA_ALERT_FLAGS = C_CRITICAL_FLAG_CH[1] | C_CRITICAL_FLAG_CH[2] | C_CRITICAL_FLAG_CH[3] | C_WARNING_FLAG_CH[1] | C_WARNING_FLAG_CH[2] | C_WARNING_FLAG_CH[3]
+INA_ALERTS_MAX = 8
+PROFILE_INTERVAL = 0.05
+# the 3V3 rail feeds the Tile, its energy per message goes into stats.csv
+PROFILE_TX_CHANNEL = 3
+PROFILE_EVENTS_MAX = 8
+profiling = False
+powerProfile = PowerProfile()
+# (tag, message id, ISO time, [mJ per channel]) of the last events profiled
+powerEvents = []
+SEND_POLL_INTERVAL = 10
+HEALTH_INTERVAL = 5
+# a task that hasn't come back from its sleep this much later is considered hung
+HEALTH_GRACE = 20
+taskDeadlines = {}
+WATCHDOG_TIMEOUT = 60
+
+# Low-power operation, config['power']:
+#   full   the board never sleeps and WiFi stays up, as it always has
+#   light  whenever nothing is going on the board light sleeps until the next
+#          message or telemetry sample is due, for at most config['sleep']
+#          seconds, or until the Tile sends something, button A is pressed or
+#          the INA3221 alert pin (if wired) goes low
+#   deep   the same in deep sleep, which ends in a reset; what isn't on flash
+#          or in NVM goes into alarm.sleep_memory, see swarm_sleep.py
+# In both, the Tile's periodic sentences are turned off and asked for on
+# waking instead, and WiFi only comes up at power-on and when button A is
+# pressed, going down again SLEEP_WIFI_WINDOW after the last client leaves.
+# The sentence that wakes the board from light sleep is lost, and the Tile
+# can't wake it from deep sleep (RX isn't an RTC pin), so a $TD SENT can go
+# unheard; after every wake the Tile is asked how many messages it still holds,
+# and as it sends them in order, the oldest in-flight messages beyond that
+# count are taken as sent when it was asked. config['sleep'] trades power for
+# latency: it bounds how late the board notices anything it isn't woken for.
+POWER_MODES = ['full', 'light', 'deep']
+SLEEP_MIN = 10
+SLEEP_MAX = 3600
+SLEEP_POLL_INTERVAL = 1
+SLEEP_AWAKE = 5  # stay awake this long after anything happens on the Tile
+SLEEP_SHORTEST = 5  # not worth going to sleep for less
+SLEEP_WIFI_WINDOW = 10 * 60
+sleepAwakeUntil = 0
+sleepWifiUntil = 0
+# a SleepState to put back once the Tile time is known again after deep sleep
+sleepResume = None
+# the alarm that ended a deep sleep, until the Tile is up again
+sleepBootWake = None
+sleepReconcile = False
+sleepTotal = 0.0
+sleepWakes = {'timer': 0, 'tile': 0, 'button': 0, 'ina': 0}
+wifiOn = False
+buttonPins = []
+# button A woke the board and is still down, its release isn't a press
+buttonWoke = False
 
 messagesById = {}
 messagesByTileMsgId = {}
 
-
-def logTCP(s, newline=True):
-  if tcpconn != None:
+# messages.json is a snapshot; every accept/sent event is appended to the
+# journal and the snapshot is only rewritten when the journal is compacted
+MESSAGES_FILE = "/messages.json"
+JOURNAL_FILE = "/messages.log"
+JOURNAL_COMPACT_RECORDS = 256
+journalRecords = 0
+
+# only in-flight messages and the most recently completed ones stay resident,
+# older completed messages are moved out to the archive on flash, see swarm_archive.py
+ARCHIVE_FILE = "/archive.bin"
+archive = Archive(ARCHIVE_FILE)
+MESSAGES_MAX_COMPLETED = 32
+MESSAGES_MAX_AGE = 24 * 60 * 60
+MESSAGES_INFLIGHT_EXPIRY = 48 * 60 * 60  # the tile gives up on unsent messages after 48 hours
+completedIds = []
+# $TD SENT lines heard before the Tile time, see tileOnDT()
+sentWaiting = []
+SENT_WAITING_MAX = 16
+
+
+class TcpClient:
+  # One console session. Output goes into a ring buffer that tcpPoll() drains with
+  # non-blocking sends, so a slow client never holds up the rest of the loop; a
+  # client whose buffer overflows is dropped.
+
+  def __init__(self, conn, addr):
+    self.conn = conn
+    self.addr = addr
+    self.line = bytearray(TCP_LINE)
+    self.lineView = memoryview(self.line)
+    self.ptr = 0
+    # received and not yet framed into lines, rx[rxStart:rxEnd]
+    self.rx = bytearray(MAXBUF)
+    self.rxView = memoryview(self.rx)
+    self.rxStart = 0
+    self.rxEnd = 0
+    self.out = bytearray(TCP_OUTBUF)
+    self.view = memoryview(self.out)
+    self.head = 0
+    self.count = 0
+    self.since = 0
+    self.overflowed = False
+    self.closed = False
+    # sentence types this client doesn't want to see, tag -> name
+    self.muted = {}
+    # raw power samples while profiling, see @profile stream
+    self.power = False
+    for f, tag in zip(tileMessageFilters, tileMessageFilterTags):
+      self.muted[tag] = f
+
+  def send(self, data):
+    if isinstance(data, str):
+      data = data.encode()
+    n = len(data)
+    size = len(self.out)
+    if self.overflowed or self.count + n > size:
+      self.overflowed = True
+      return
+    if self.count == 0:
+      self.since = time.monotonic()
+    tail = (self.head + self.count) % size
+    first = min(n, size - tail)
+    self.out[tail:tail + first] = data[0:first]
+    if first < n:
+      self.out[0:n - first] = data[first:n]
+    self.count = self.count + n
+    if self.count >= TCP_FLUSH_SIZE:
+      self.drain()
+
+  def due(self, now):
+    return self.count >= TCP_FLUSH_SIZE or (self.count > 0 and now - self.since >= TCP_FLUSH_LATENCY)
+
+  def drain(self):
+    size = len(self.out)
+    while self.count > 0:
+      end = min(self.head + self.count, size)
+      try:
+        sent = self.conn.send(self.view[self.head:end])
+      except OSError as e:
+        if e.errno not in (errno.EAGAIN, errno.ETIMEDOUT):
+          self.closed = True
+        return
+      if not sent:
+        return
+      self.head = (self.head + sent) % size
+      self.count = self.count - sent
+    # start over at the front so the next batch is contiguous and goes out in one send
+    self.head = 0
+
+  def close(self):
     try:
-      if (lastDT is not None):
-        tcpconn.send(getISOString(lastDT) + " ")
-      tcpconn.send(s)
-      if newline:
-        tcpconn.send('\n')
-    except:
+      self.conn.close()
+    except OSError as e:
       pass
 
+
+def logTCP(s, newline=True):
+  if len(tcpClients) == 0:
+    return
+  stamp = tileClock.stamp()
+  s = s.encode()
+  for client in tcpClients:
+    client.send(stamp)
+    client.send(s)
+    if newline:
+      client.send(b'\n')
+
+def logTile(tag, buf, n):
+  line = memoryview(buf)[0:n]
+  stamp = tileClock.stamp()
+  for client in tcpClients:
+    if tag not in client.muted:
+      client.send(stamp)
+      client.send(line)
+      client.send(b'\n')
+
 def log(s, newline=True):
   displayLine(1, s)
   logTCP(s, newline)
 
-def displayInit():
+def displayInit(logo=True):
+  # logo is False after deep sleep, there's no need to hold up every wake
   displayio.release_displays()
   display_bus = displayio.I2CDisplay(i2c, device_address=0x3C)
 
@@ -119,7 +406,7 @@ def displayInit():
   display = adafruit_displayio_sh1107.SH1107(display_bus, width=WIDTH, height=HEIGHT)
 
   # SWARM LOGO
-  splash = displayio.Group(max_size=10)
+  splash = displayio.Group()
   splash.y = 16
   display.show(splash)
   color_palette = displayio.Palette(1)
@@ -129,18 +416,20 @@ def displayInit():
   image = displayio.OnDiskBitmap(image_file)
   image_sprite = displayio.TileGrid(image, pixel_shader=image.pixel_shader)
   splash.append(image_sprite)
-  time.sleep(1)
+  if logo:
+    time.sleep(1)
   splash.pop()
 
   STRING = "Swarm Message Sender"
   text_area2 = label.Label( terminalio.FONT, text=STRING, scale=1, color=0xFFFFFF, x=0, y=3)
   splash.append(text_area2)
-  time.sleep(1)
+  if logo:
+    time.sleep(1)
   splash.pop()
 
   # SWARM LOGO
 
-  splash = displayio.Group(max_size=10)
+  splash = displayio.Group()
   display.show(splash)
 
   color_bitmap = displayio.Bitmap(WIDTH, HEIGHT, 1)
@@ -168,18 +457,9 @@ def displayLine(line, text):
   displayLines[line].text = text
 
 
-def appendChecksum(bytes):
-  cs = 0
-  for c in bytes[1:]:
-    cs = cs ^ c
-  return bytes + b'*%02X\n'%cs
-
 def makeTileCmd(cmd):
-  cbytes = cmd.encode()
-  cs = 0
-  for c in cbytes[1:]:
-    cs = cs ^ c
-  return cbytes + b'*%02X\n'%cs
+  # cmd is a constant, its bytes are built once, see swarm_tile.command()
+  return command(cmd)
 
 
 def wifiInit():
@@ -208,134 +488,265 @@ def wifiInit():
 
 def tileCheck(line):
   global tileTimeout
-  if  tileStateTable[tileState][1] in line:
-    tileTimeout = -1.0
-
-
-def tileStart():
-  global tileState, tileTimeout
-  displayLine(0, "Connecting to modem...")
-  tileState = TILE_STATE_UNKNOWN
-  while tileState != TILE_STATE_CONFIGURED:
-    tile.write(b'\n' + makeTileCmd(tileStateTable[tileState][0]))
-    tileTimeout = time.monotonic() + tileStateTable[tileState][2]
-    while (tileTimeout > 0.0) and (tileTimeout > time.monotonic()):
-      tilePoll()
-      w.feed()
-    if tileTimeout  < 0.0:
-      tileState = tileStateTable[tileState][3]
+  if tileTimeout <= 0.0:
+    return
+  replies = tileStateTable[tileState][1]
+  for i in tilePending:
+    if replies[i] in line:
+      tilePending.remove(i)
+      if len(tilePending) == 0:
+        tileTimeout = -1.0
+      return
+
+
+def tileStart(state=TILE_STATE_UNKNOWN):
+  # (re)start the bring-up, tilePoll() drives it from here
+  global tileStarted, tileBringUps, tileConfiguredIn
+  displayLine(1, "Connecting to modem...")
+  tileClock.clear()
+  tileCommands.clear()
+  tileStarted = time.monotonic()
+  tileConfiguredIn = None
+  tileBringUps = tileBringUps + 1
+  tileEnter(state, tileStarted)
+
+
+def tileEnter(state, at):
+  global tileState, tileTimeout, tileRetryAt, tileTries
+  tileState = state
+  tileTimeout = 0.0
+  tileRetryAt = at
+  tileTries = 0
+  tilePending[:] = range(len(tileStateTable[state][0]))
+  if state == TILE_STATE_CONFIGURED:
+    tileConfigured()
+
+
+def tileBackoff():
+  return min(TILE_BACKOFF_MAX, TILE_BACKOFF * 2 ** (tileFailures - 1))
+
+
+def tileBringUp():
+  global tileTimeout, tileRetryAt, tileTries, tileFailures, tileRetries
+  if tileState == TILE_STATE_CONFIGURED:
+    return
+  now = time.monotonic()
+  entry = tileStateTable[tileState]
+  if tileTimeout < 0.0:
+    tileFailures = 0
+    tileEnter(entry[3], now)
+  elif tileTimeout > 0.0:
+    if now < tileTimeout:
+      return
+    tileFailures = tileFailures + 1
+    tileRetries = tileRetries + 1
+    tileTries = tileTries + 1
+    if tileState == TILE_STATE_CONFIGURING and tileTries < TILE_CONFIG_TRIES:
+      # only what went unanswered goes out again
+      tileTimeout = 0.0
+      tileRetryAt = now + tileBackoff()
     else:
-      tileState = tileStateTable[tileState][4]
+      tileEnter(entry[4], now + tileBackoff())
+  elif now >= tileRetryAt:
+    tile.write(b'\n')
+    for i in tilePending:
+      tile.write(makeTileCmd(entry[0][i]))
+    tileTimeout = now + entry[2]
+
+
+def tileConfigured():
+  global tileConfiguredIn, tileLastHeard, sleepBootWake
+  tileLastHeard = time.monotonic()
+  tileConfiguredIn = tileLastHeard - tileStarted
+  log(f"Tile configured in {tileConfiguredIn:.1f}s")
+  if config['power'] == 'full':
+    # the time now rather than with the first periodic $DT
+    tileSend(makeTileCmd('$DT @'))
+    return
+  if sleepBootWake is not None:
+    # the Tile stayed up through the deep sleep with its rates off, see tileInit()
+    sleepWoke(sleepCause(sleepBootWake))
+    sleepBootWake = None
+    return
+  sleepTileRates()
+
 
+def tileSend(cmd, context=None, timeout=TILE_COMMAND_TIMEOUT):
+  # cmd with its checksum, queued behind the commands still waiting for answers
+  if not tileCommands.send(tile, cmd, context, timeout, time.monotonic()):
+    logTCP(f'tileSend: queue full, dropped {bytes(cmd[:3]).decode()}')
+    return False
+  return True
 
-def tileInit():
+
+def tileCommandTimeout(tag, context):
+  if context is not None:
+    logTCP(f'tileSend: no answer for message {context}')
+  elif tag == TAG_DT and not tileClock.valid and tileState == TILE_STATE_CONFIGURED:
+    # not even the time, the Tile wasn't up after all
+    log("Tile not answering, restarting")
+    tileStart()
+
+
+def tileWatch():
+  # the Tile rebooted or stopped talking, bring it up again
+  if tileState == TILE_STATE_CONFIGURED and config['power'] == 'full' and \
+     time.monotonic() - tileLastHeard > TILE_SILENCE:
+    log("Tile silent, restarting")
+    tileStart()
+
+
+def tileUART():
   global tile
   tile = busio.UART(board.TX,board.RX,baudrate=115200,receiver_buffer_size=8192,timeout=0.0)
-  tileStart()
-
 
-def tileParseLine(line):
-  global lastDT, lastGN, lastRSSI
-  if len(line) < 4:
+def tileInit(woke):
+  # after a deep sleep the Tile is still configured, only the board was reset
+  tileUART()
+  tileParser.onSentence = tileParseLine
+  tileCommands.onTimeout = tileCommandTimeout
+  tileParser.register('$RT', tileOnRT)
+  tileParser.register('$TD', tileOnTD)
+  tileParser.register('$DT', tileOnDT)
+  tileParser.register('$GN', tileOnGN)
+  tileParser.register('$MT', tileOnMT)
+  if woke is not None and config['power'] != 'full':
+    tileStart(TILE_STATE_CONFIGURED)
+  else:
+    tileStart()
+
+
+def tileParseLine(tag, buf, n):
+  # sees every line before it is dispatched to the handlers registered in tileInit()
+  global sleepAwakeUntil, tileLastHeard
+  if len(tcpClients) > 0:
+    logTile(tag, buf, n)
+  if tag not in tileParser.handlers and tag != TAG_TILE and tileState == TILE_STATE_CONFIGURED and \
+     len(tileCommands.inflight) == 0:
+    # nothing handles it or waits for an answer: skip the clock read, the awake
+    # deadline and the answer lookup, most of what a line costs; invalid lines
+    # end here too
+    return True
+  tileLastHeard = time.monotonic()
+  sleepAwakeUntil = tileLastHeard + SLEEP_AWAKE
+  if tag == TAG_INVALID:
+    return True
+  if tileState != TILE_STATE_CONFIGURED:
+    tileCheck(buf[:n].decode())
+    return True
+  if tag == TAG_TILE and n > 18 and buf[6:18] == b'BOOT,RUNNING':
+    # it reset by itself and lost its settings
+    log("Tile rebooted")
+    tileStart(TILE_STATE_CONFIGURING)
+    return True
+  # it may answer a command, see TileCommands for which
+  tileCommands.answer(tag, buf, n)
+  return False
+
+def tileOnRT(buf, n):
+  global lastRSSI
+  # $RT RSSI=-104*xx arrives continuously, handle it straight from the buffer
+  if n > 12 and buf[4] == 0x52 and buf[5] == 0x53 and buf[6] == 0x53 and buf[7] == 0x49 and indexOf(buf, 0x2C, 8, n - 3) < 0:
+    irssi = parseInt(buf, 9, n - 3)
+    lastRSSI = irssi
+    if len(streamClients) > 0:
+      streamSend(FRAME_RT, irssi, 0, 0, 0)
+    scheduler.hearNoise(irssi)
+    if config['wifi'] == 'enabled':
+      if irssi > -91:
+        pixels[0] = (16, 0, 0, 0)
+      elif irssi < -95:
+        pixels[0] = (0, 16, 0, 0)
+      else:
+        pixels[0] = (16, 16, 0, 0)
+      pixels.write()
     return
-  if line[len(line) - 3] != '*':
+  line = buf[:n].decode()
+  if line[4:8] == 'RSSI':
+    rdata = line[4:-3].split(',')
+    rtdata = []
+    for r in rdata:
+      rtdata.append(r.split('='))
+    rtdata = dict(rtdata)
+    streamSend(FRAME_RT, int(rtdata['RSSI']), int(rtdata['SNR']), int(rtdata['FDEV']), 1)
+    ts = line.find('TS=')
+    ts = parseTS(buf, ts + 3) if ts > 0 and ts + 22 <= n else None
+    print(rtdata)
+    displayLine(4, ('' if ts is None else compactString(ts)) + ' S' + rtdata['DI'][2:])
+    displayLine(5, 'R:' + rtdata['RSSI'] + ' S:' + rtdata['SNR'] + ' F:' + rtdata['FDEV'])
+
+def tileOnTD(buf, n):
+  line = buf[:n].decode()
+  if len(mdata) > 10:
+    mdata.pop(0)
+  mdata.append(line)
+  if line.startswith("$TD OK"):
+    messageAccepted(line)
+  elif line.startswith("$TD ERR") and tileCommands.context is not None:
+    logTCP(f'messageAccepted: message {tileCommands.context} rejected')
+    streamSend(FRAME_MSG, MSG_REJECTED, int(tileCommands.context), 0, 0, 0, 0)
+  if line.startswith("$TD SENT"):
+    messageSent(line)
+
+def tileOnDT(buf, n):
+  # $DT 20220701130005,V*xx, or $DT OK*34 after the rate is set
+  if not tileClock.setDT(buf, 4):
+    tileClock.clear()
     return
-  cksum1 = 0
-  cksum2 = int(line[-2:], 16)
-  for c in line[1:-3]:
-    cksum1 = cksum1 ^ ord(c)
-  if cksum1 != cksum2:
+  if len(streamClients) > 0:
+    streamSend(FRAME_DT, tileClock.unix())
+  while len(sentWaiting) > 0:
+    messageSent(sentWaiting.pop(0))
+  if sleepResume is not None:
+    sleepRestore()
+
+def tileOnGN(buf, n):
+  # keeps the last fix as (lat, lon, alt); OK and ERR answers and lines with
+  # empty fields leave None, so payloads never see anything but a fix
+  global lastGN
+  line = buf[:n].decode()
+  try:
+    fields = line[4:line.index('*')].split(',')
+    lat = float(fields[0])
+    lon = float(fields[1])
+    alt = int(float(fields[2]))
+    course = int(float(fields[3]))
+    speed = int(float(fields[4]))
+  except (ValueError, IndexError):
+    lastGN = None
     return
-  if tileState != TILE_STATE_CONFIGURED:
-    tileCheck(line)
-    return
-  if line[0:3] == "$TD":
-    if len(mdata) > 10:
-      mdata.pop(0)
-    mdata.append(line)
-    if line.startswith("$TD OK"):
-      messageAccepted(line)
-    if line.startswith("$TD SENT"):
-      messageSent(line)
-  if line[0:3] == "$DT":
-    if line == "$DT OK*34":
-      lastDT = None
-    else:
-      lastDT = line[4:-3]
-  if line[0:3] == "$GN":
-    if line == "$GN OK*2d":
-        lastGN = None
-    else:
-        lastGN = line
-  parse = line[:-3].split(' ')
-  if parse[0] == '$RT':
-    packetReceived(line)
-    if 'RSSI' in parse[1]:
-      if ',' in parse[1]:
-        rdata = line[4:-3].split(',')
-        rtdata = []
-        for r in rdata:
-          rtdata.append(r.split('='))
-        rtdata = dict(rtdata)
-        if 'T' in rtdata['TS']:
-            d, t = rtdata['TS'].split('T')
-        else:
-            d, t = rtdata['TS'].split(' ')
-        d = d.split('-')
-        t = t.split(':')
-        dtString = d[0][2:]+d[1]+d[2]+'T'+t[0]+t[1]+t[2]
-        print(rtdata)
-        displayLine(4, dtString + ' S' + rtdata['DI'][2:])
-        displayLine(5, 'R:' + rtdata['RSSI'] + ' S:' + rtdata['SNR'] + ' F:' + rtdata['FDEV'])
-      else:
-        rssi = parse[1].split('=')
-        #displayLine(2, "RSSI: " + rssi[1])
-        irssi = int(rssi[1])
-        lastRSSI = irssi
-        if config['wifi'] == 'enabled':
-          if irssi > -91:
-            pixels[0] = (16, 0, 0, 0)
-          elif irssi < -95:
-            pixels[0] = (0, 16, 0, 0)
-          else:
-            pixels[0] = (16, 16, 0, 0)
-          pixels.write()
-  if parse[0] == '$MT':
-    logTCP(f'unsent messages: {parse[1]}')
+  lastGN = (lat, lon, alt)
+  if len(streamClients) > 0:
+    streamSend(FRAME_GN, round(lat * 100000), round(lon * 100000), alt, course, speed)
+
+def tileOnMT(buf, n):
+  global tileUnsent
+  logTCP(f'unsent messages: {buf[4:n - 3].decode()}')
+  star = indexOf(buf, 0x2A, 4, n)
+  if star > 4 and 0x30 <= buf[4] <= 0x39:
+    tileUnsent = parseInt(buf, 4, star)
+    if sleepReconcile:
+      messagesReconcile(tileUnsent)
 
 def tilePoll():
-  global tilePtr
-  chars = tile.read(20)
-  if chars == None:
-    return
-  for c in chars:
-    if c == 0x0A:
-      s = tileLine[:tilePtr].decode()
-      shouldLog = True
-      for f in tileMessageFilters:
-        if s.startswith(f):
-          shouldLog = False
-      if shouldLog:
-        logTCP(s)
-      tileParseLine(s)
-      tilePtr = 0
-    elif c == 0x08 and tilePtr != 0:
-      tilePtr = tilePtr - 1
-    elif c >= 0x20 and c <= 0x7f and tilePtr < len(tileLine):
-      tileLine[tilePtr] = c
-      tilePtr = tilePtr + 1
-  pass
+  tileParser.poll(tile)
+  tileBringUp()
+  tileCommands.poll(tile, time.monotonic())
 
 def inaInit():
-  global ina3221, inaConnected, inaData
+  global ina3221, inaConnected, inaData, inaNextRead, inaCycled, inaPowerFlag
+  inaPinInit()
   try:
-    ina3221 = INA3221(i2c, shunt_resistor = (0.01, 0.01, 0.01))
-    ina3221.update(reg=C_REG_CONFIG, mask=C_AVERAGING_MASK | C_VBUS_CONV_TIME_MASK | C_SHUNT_CONV_TIME_MASK | C_MODE_MASK,
-                                     value=C_AVERAGING_128_SAMPLES | C_VBUS_CONV_TIME_8MS | C_SHUNT_CONV_TIME_8MS | C_MODE_SHUNT_AND_BUS_CONTINOUS)
+    ina3221 = INA3221(i2c, shunt_resistor = INA_SHUNT)
+    ina3221.update(reg=C_REG_CONFIG, mask=INA_CONFIG_MASK, value=INA_PROFILE_CONFIG if profiling else INA_CONFIG)
     ina3221.enable_channel(1)
     ina3221.enable_channel(2)
     ina3221.enable_channel(3)
+    inaLimits()
     inaConnected = True
+    inaNextRead = 0
+    inaCycled = False
+    inaPowerFlag = None
     # initialize all the values
     for channel in range(1, 4):
       bus_voltage = ina3221.bus_voltage(channel)
@@ -346,25 +757,169 @@ def inaInit():
     inaConnected = False
 
 
+def inaPinInit():
+  global inaAlertPin
+  if INA_ALERT_PIN is not None and inaAlertPin is None:
+    inaAlertPin = digitalio.DigitalInOut(INA_ALERT_PIN)
+    inaAlertPin.direction = digitalio.Direction.INPUT
+    inaAlertPin.pull = digitalio.Pull.UP
+
+
+def inaLimits():
+  for channel in range(1, 4):
+    critical = INA_CRITICAL_LIMITS[channel - 1]
+    warning = INA_WARNING_LIMITS[channel - 1]
+    shunt = INA_SHUNT[channel - 1]
+    ina3221.set_shunt_critical_alert_limit(channel, INA_NO_LIMIT if critical is None else critical * shunt)
+    ina3221.set_shunt_warning_alert_limit(channel, INA_NO_LIMIT if warning is None else warning * shunt)
+  ina3221.set_power_valid_limits(INA_PV_UPPER, INA_PV_LOWER)
+  ina3221.set_alert_latch()
+
+
+def inaMonitoring():
+  # stream clients get every conversion cycle, as while profiling
+  return config['monitor'] == 'alert' and not profiling and len(streamClients) == 0
+
+
+def inaInterval():
+  # how long inaTask sleeps
+  if profiling:
+    return PROFILE_INTERVAL
+  if not inaMonitoring():
+    return INA_READY_INTERVAL
+  return INA_ALERT_INTERVAL if inaAlertPin is None else INA_PIN_INTERVAL
+
+
+def inaAlerted(flags):
+  # a latched limit flag, or a change of power valid
+  return (flags & INA_ALERT_FLAGS) != 0 or (flags & C_POWER_ALERT_FLAG) != inaPowerFlag
+
+
 def inaPoll():
-  global inaChannel, inaTime, inaConnected, inaData
+  global inaChannel, inaConnected, inaData, inaShown, inaNextRead, inaCycled, inaReadings
   if not inaConnected:
     inaInit()
     return
-  if time.time() - inaTime > 5:
+  now = time.monotonic()
+  monitoring = inaMonitoring()
+  if monitoring and now < inaNextRead and inaAlertPin is not None and inaAlertPin.value:
+    # nothing latched, no need to go on the bus
+    return
+  try:
+    if monitoring:
+      flags = ina3221.alert_flags()
+      inaCycled = inaCycled or (flags & C_CONV_READY_FLAG) != 0
+      reading = None
+      if not inaCycled:
+        inaNextRead = now + INA_ALERT_INTERVAL
+      if inaCycled and (inaAlerted(flags) or now >= inaNextRead):
+        # the last cycle's rails, whether or not one completed since the flags were read
+        reading = ina3221.read_all(inaReading, force=True)
+        # often enough that telemetry samples aren't stale
+        interval = INA_MONITOR_INTERVAL
+        if config['telemetry'] > 0:
+          interval = min(interval, config['telemetry'])
+        inaNextRead = now + interval
+    else:
+      # all three rails from the same conversion cycle, None until a new cycle completes
+      reading = ina3221.read_all(inaReading)
+      flags = ina3221.flags
+      inaCycled = inaCycled or reading is not None
+      if reading is None and inaCycled and inaAlerted(flags):
+        reading = ina3221.read_all(inaReading, force=True)
+  except:
+    inaConnected = False
+    return
+  if reading is None:
+    return
+  if inaAlerted(flags):
+    inaAlert(flags, reading)
+  if len(streamClients) > 0:
+    streamOut(streamFrames.ina(streamMs(), reading))
+  inaReadings = inaReadings + 1
+  for channel in range(3):
+    inaSums[channel] = inaSums[channel] + reading[2 * channel + 1]
+  if profiling:
+    powerProfile.add(ticks_ms(), reading)
+    profileStream()
+    if now - inaShown < INA_SHOW_INTERVAL:
+      return
+  inaShown = now
+  for channel in range(1, 4):
+    inaData[channel] = (reading[2 * channel - 2], reading[2 * channel - 1])
+  # the display still shows one rail at a time, the next one each cycle
+  bus_voltage, current = inaData[inaChannel]
+  displayLine(1, "%s %6.3fV %6.3fA"%(INA_NAMES[inaChannel], bus_voltage, current))
+  inaChannel = inaChannel + 1
+  if inaChannel == 4:
+    inaChannel = 1
+
+
+def inaAlert(flags, reading):
+  global inaPowerFlag, nextSampleTime
+  for channel in range(1, 4):
+    if flags & C_CRITICAL_FLAG_CH[channel]:
+      inaAlertLog(f'{INA_NAMES[channel]} critical, above {INA_CRITICAL_LIMITS[channel - 1]}A')
+    if flags & C_WARNING_FLAG_CH[channel]:
+      inaAlertLog(f'{INA_NAMES[channel]} warning, {reading[2 * channel - 1]:.3f}A above {INA_WARNING_LIMITS[channel - 1]}A')
+  powerFlag = flags & C_POWER_ALERT_FLAG
+  if powerFlag != inaPowerFlag:
+    inaPowerFlag = powerFlag
+    low = False
+    for channel in range(1, 4):
+      if reading[2 * channel - 2] < INA_PV_LOWER:
+        low = True
+        inaAlertLog(f'{INA_NAMES[channel]} {reading[2 * channel - 2]:.3f}V below {INA_PV_LOWER}V')
+    if not low:
+      inaAlertLog('power valid')
+  # the next telemetry sample right away, so it shows
+  nextSampleTime = 0
+
+def inaAlertLog(text):
+  if len(inaAlerts) >= INA_ALERTS_MAX:
+    inaAlerts.pop(0)
+  inaAlerts.append((tileClock.iso(), text))
+  logTCP('ina: ' + text)
+
+def profileStart(on):
+  global profiling
+  if on == profiling:
+    return
+  profiling = on
+  powerProfile.reset()
+  powerEvents.clear()
+  if inaConnected:
     try:
-      inaChans = {1:'BAT:', 2:'SOL:', 3:'3V3:'}
-      bus_voltage = ina3221.bus_voltage(inaChannel)
-      current = ina3221.current(inaChannel)
-
-      displayLine(1, "%s %6.3fV %6.3fA"%(inaChans[inaChannel], bus_voltage, current))
-      inaData[inaChannel] = (bus_voltage, current)
-      inaChannel = inaChannel + 1
-      if inaChannel == 4:
-        inaChannel = 1
+      ina3221.update(reg=C_REG_CONFIG, mask=INA_CONFIG_MASK, value=INA_PROFILE_CONFIG if on else INA_CONFIG)
     except:
-      inaConnected = False
-    inaTime = time.time()
+      pass
+
+def profileStream():
+  # P,<ms since the previous sample>,<mV>,<mA> for channels 1, 2, 3
+  streaming = False
+  for client in tcpClients:
+    streaming = streaming or client.power
+  if not streaming:
+    return
+  i = powerProfile.newest()
+  v = powerProfile.values
+  line = f'P,{powerProfile.dt[i // 6]},{v[i]},{v[i + 1]},{v[i + 2]},{v[i + 3]},{v[i + 4]},{v[i + 5]}\n'.encode()
+  for client in tcpClients:
+    if client.power:
+      client.send(line)
+
+def profileEvent(tag, id):
+  # energy over the window before a $TD event, None when not profiling
+  if not profiling:
+    return None
+  energy = powerProfile.window()
+  if energy is None:
+    return None
+  if len(powerEvents) >= PROFILE_EVENTS_MAX:
+    powerEvents.pop(0)
+  powerEvents.append((tag, id, tileClock.iso(), energy))
+  logTCP(f'power: {tag} {id} {energy[0]} {energy[1]} {energy[2]} mJ')
+  return energy
 
 
 def tcpInit():
@@ -372,144 +927,481 @@ def tcpInit():
     return
   if wifi.radio.ipv4_address_ap is None and wifi.radio.ipv4_address is None:
     return
-  global TCPSTATE, tcplistener, tcpconn
-  print("Create TCP Server socket", (TCPHOST, TCPPORT))
-  tcplistener = pool.socket(pool.AF_INET, pool.SOCK_STREAM)
-  tcplistener.settimeout(TIMEOUT)
-  tcplistener.setblocking(False)
-  tcplistener.bind((TCPHOST, TCPPORT))
-  tcplistener.listen(BACKLOG)
+  global tcplistener, streamListener
+  tcplistener = tcpListen(TCPPORT)
+  streamListener = tcpListen(STREAMPORT)
   print("Listening")
 
+def tcpListen(port):
+  print("Create TCP Server socket", (TCPHOST, port))
+  listener = pool.socket(pool.AF_INET, pool.SOCK_STREAM)
+  listener.settimeout(TIMEOUT)
+  listener.setblocking(False)
+  listener.bind((TCPHOST, port))
+  listener.listen(BACKLOG)
+  return listener
+
 
 def tcpPoll():
   if config['wifi'] == 'disabled' or (wifi.radio.ipv4_address_ap is None and wifi.radio.ipv4_address is None):
     displayLine(4, "tcpPoll")
     return
-  global TCPSTATE, tcplistener, tcpconn, tcpPtr
-  if TCPSTATE == TCPSTATE_LISTENING:
+  tcpAccept(tcplistener, tcpClients, TCP_MAX_CLIENTS)
+  client = tcpAccept(streamListener, streamClients, STREAM_MAX_CLIENTS)
+  if client is not None:
+    client.send(streamFrames.pack(FRAME_HELLO, streamMs(), STREAM_MAGIC, STREAM_VERSION,
+                                  tileClock.unix() if tileClock.valid else 0))
+  tcpServe(tcpClients, tcpReceive)
+  tcpServe(streamClients, streamReceive)
+
+def tcpAccept(listener, clients, most):
+  # the new client, if one connected and there was room for it
+  try:
+    conn, addr = listener.accept()
+    conn.settimeout(0)
+    print("Accepted from", addr)
+    if len(clients) >= most:
+      # turned away on the bare socket, before any buffers are allocated for it
+      try:
+        conn.send(b"Too many clients.\n")
+      finally:
+        conn.close()
+      return None
+    client = TcpClient(conn, addr)
+    clients.append(client)
+    return client
+  except:
+    pass
+  return None
+
+def tcpServe(clients, receive):
+  global tcpDropped
+  now = time.monotonic()
+  i = len(clients) - 1
+  while i >= 0:
+    client = clients[i]
+    receive(client)
+    if not client.closed and not client.overflowed and client.due(now):
+      client.drain()
+    if client.closed or client.overflowed:
+      clients.pop(i)
+      client.close()
+      if client.overflowed:
+        # slow consumer, it would otherwise hold buffered output forever
+        tcpDropped = tcpDropped + 1
+        print("Dropped", client.addr)
+      else:
+        print("Closed", client.addr)
+    i = i - 1
+
+def tcpReceive(client):
+  # Lines are framed in the client's own receive buffer, which is only refilled
+  # once every line in it has been taken. A pasted batch is worked through
+  # TCP_LINES_PER_POLL lines a poll, and a $ line waits there while the Tile
+  # command queue is half full, so the console never crowds out our own
+  # commands; the rest of the paste stays in the socket meanwhile.
+  if client.rxStart == client.rxEnd:
     try:
-      tcpconn, addr = tcplistener.accept()
-      tcpconn.settimeout(0)
-      print("Accepted from", addr)
-      TCPSTATE = TCPSTATE_CONNECTED
-    except:
-      pass
-  elif TCPSTATE == TCPSTATE_CONNECTED:
-    buf = bytearray(MAXBUF)
+      size = client.conn.recv_into(client.rx, MAXBUF)
+    except OSError as e:
+      if e.errno not in (errno.EAGAIN, errno.ETIMEDOUT):
+        client.closed = True
+      return
+    if size == 0:
+      client.closed = True
+      return
+    client.rxStart = 0
+    client.rxEnd = size
+  rx = client.rx
+  lines = 0
+  while client.rxStart < client.rxEnd and lines < TCP_LINES_PER_POLL:
+    start = client.rxStart
+    end = rx.find(b'\n', start, client.rxEnd)
+    if end < 0:
+      tcpAppend(client, start, client.rxEnd)
+      client.rxStart = client.rxEnd
+      return
+    first = client.line[0] if client.ptr > 0 else rx[start]
+    if first == 0x24 and len(tileCommands.waiting) >= tileCommands.size // 2:
+      return
+    tcpAppend(client, start, end)
+    client.rxStart = end + 1
+    lines = lines + 1
     try:
-      size = tcpconn.recv_into(buf, MAXBUF)
-      if size == 0:
-        tcpconn.close()
-        tcpconn = None
-        print("Accepting connections")
-        TCPSTATE = TCPSTATE_LISTENING
-      else:
-        print("Received", buf[:size], size, "bytes")
-        for i in range(size):
-          if buf[i] == 0x0A:
-            if tcpLine[0] == 0x40:
-              command = tcpLine[:tcpPtr].decode()
-              params = command.split(' ')
-              if params[0] == '@reset':
-                tcpconn.send("Resetting...")
-                microcontroller.reset()
-              elif params[0] == '@color':
-                if len(params) ==  5:
-                  if config['wifi'] == 'enabled':
-                    pixels[1] = (int(params[1]),int(params[2]),int(params[3]),int(params[4]))
-                    pixels.write()
-              elif params[0] == '@set':
-                if params[1] == 'mode':
-                  if params[2] in ['ap', 'sta']:
-                    config['mode'] = params[2]
-                    tcpconn.send(f"Successfully set mode to {params[2]}.")
-                    writePreferences()
-                if params[1] == 'wifi':
-                  if params[2] in ['enabled', 'disabled']:
-                    config['wifi'] = params[2]
-                    if config['wifi'] == 'disabled':
-                      pixels[0] = (0,0,0,0)
-                      pixels[1] = (0,0,0,0)
-                      pixels.write()
-                    tcpconn.send(f"Successfully {params[2]} wifi.")
-                    tcpconn.send("Resetting...")
-                    microcontroller.reset()
-                    writePreferences()
-                if params[1] == 'ssid':
-                  config['ssid'] = command[10:].strip()
-                  tcpconn.send(f"Successfully set ssid to {config['ssid']}.")
-                  writePreferences()
-                if params[1] == 'pw':
-                  config['password'] = command[8:].strip()
-                  tcpconn.send(f"Successfully set password to {config['password']}.")
-                  writePreferences()
-                if params[1] == 'interval':
-                  if int(params[2]) == 0 or (int(params[2]) >= 15 and int(params[2]) <= 720):
-                    if int(params[2]) == 0 and config['interval'] > 0:
-                      config['interval'] = config['interval'] * -1
-                      tcpconn.send(f"Successfully set interval to off.")
-                    else:
-                      config['interval'] = int(params[2])
-                      tcpconn.send(f"Successfully set interval to {config['interval']}.")
-                    writePreferences()
-                  else:
-                    tcpconn.send("Interval can only be 0 or 15-720 minutes.")
-                if params[1] == 'broker':
-                  config['broker'] = command[12:].strip()
-                  tcpconn.send(f"Successfully set broker to {config['broker']}.")
-                  writePreferences()
-              elif params[0] == '@show':
-                if len(params) == 2:
-                  if params[1] == 'battery':
-                    tcpconn.send('BAT: ' + str(inaData[1][0]) + 'V ' + str(inaData[1][1]) + 'A')
-                  if params[1] == '3v3':
-                    tcpconn.send('3V3: ' + str(inaData[3][0]) + 'V ' + str(inaData[3][1]) + 'A')
-                  if params[1] == 'solar':
-                    tcpconn.send('SOL: ' + str(inaData[2][0]) + 'V ' + str(inaData[2][1]) + 'A')
-                else:
-                  tcpconn.send('wifi mode:' + config['mode'] + '\n')
-                  tcpconn.send('wifi:' + config['wifi'] + '\n')
-                  tcpconn.send('wifi ssid:' + config['ssid'] + '\n')
-                  tcpconn.send('wifi pw:  ' + config['password'] + '\n')
-                  tcpconn.send('gps interval: ' + (str(config['interval']), 'OFF')[config['interval'] <= 0] + '\n')
-                  if 'broker' in config:
-                      tcpconn.send('broker: ' + config['broker'] + '\n')
-              elif params[0] == '@factory':
-                microcontroller.nvm[0] = 0
-                tcpconn.send("Cleared NVM and Resetting...")
-                microcontroller.reset()
-              else:
-                tcpconn.send("Invalid command. Type @help for help.")
-              print("", end='')
-            tile.write(tcpLine[:tcpPtr])
-            tile.write(bytearray([0x0a]))
-            tcpPtr = 0
-          elif buf[i] == 0x08 and tcpPtr != 0:
-            tcpPtr = tcpPtr - 1
-          elif buf[i] >= 0x20 and buf[i] <= 0x7f and tcpPtr < len(tcpLine):
-            tcpLine[tcpPtr] = buf[i]
-            tcpPtr = tcpPtr + 1
+      tcpLine(client)
     except Exception as e:
       pass
+    client.ptr = 0
+
+def tcpAppend(client, start, end):
+  # rx[start:end] onto the line, what doesn't fit (with room for a newline) is dropped
+  n = min(end - start, len(client.line) - 1 - client.ptr)
+  if n > 0:
+    client.lineView[client.ptr:client.ptr + n] = client.rxView[start:start + n]
+    client.ptr = client.ptr + n
+
+def tcpLine(client):
+  line = client.line
+  n = client.ptr
+  # telnet ends lines with \r\n; only lines typed with backspace or carrying
+  # escapes or telnet negotiation are gone through byte by byte
+  if line.find(b'\x08', 0, n) >= 0 or line.find(b'\x7f', 0, n) >= 0 or \
+     line.find(b'\x1b', 0, n) >= 0 or line.find(b'\xff', 0, n) >= 0:
+    n = tcpEdit(line, n)
+  while n > 0 and line[n - 1] < 0x20:
+    n = n - 1
+  if n == 0:
+    return
+  if line[0] == 0x40:
+    tcpCommand(client, line[:n].decode())
+    return
+  line[n] = 0x0A
+  if line[0] == 0x24:
+    # queued like our own commands, so its answer isn't taken for one of theirs
+    tileSend(client.lineView[:n + 1])
+  else:
+    tile.write(client.lineView[:n + 1])
+
+def tcpEdit(line, n):
+  # apply backspaces and drop everything unprintable, in place
+  j = 0
+  for i in range(n):
+    c = line[i]
+    if c == 0x08 or c == 0x7F:
+      if j > 0:
+        j = j - 1
+    elif c >= 0x20 and c < 0x7F:
+      line[j] = c
+      j = j + 1
+  return j
+
+
+def streamReceive(client):
+  # stream clients only listen, all that is read is whether they hung up
+  try:
+    size = client.conn.recv_into(client.rx, MAXBUF)
+  except OSError as e:
+    if e.errno not in (errno.EAGAIN, errno.ETIMEDOUT):
+      client.closed = True
+    return
+  if size == 0:
+    client.closed = True
+
+def streamMs():
+  # from the ns count, float monotonic() loses ms resolution after an hour of uptime
+  return time.monotonic_ns() // 1000000 & 0xFFFFFFFF
+
+def streamSend(type, *values):
+  # a frame of type to every stream client, values after the ms
+  if len(streamClients) > 0:
+    streamOut(streamFrames.pack(type, streamMs(), *values))
+
+def streamOut(frame):
+  for client in streamClients:
+    client.send(frame)
+
+
+# @ commands: name -> (handler, fewest and most arguments, usage), most None
+# for any number. handler(client, params, command) gets the line split on
+# spaces and the whole line, and a ValueError from it (a bad number) shows the
+# usage. @set and @show look their first argument up the same way in
+# tcpSettings and tcpShows. Register more with tcpRegister().
+tcpCommands = {}
+tcpSettings = {}
+tcpShows = {}
+
+def tcpRegister(table, name, handler, least=0, most=0, usage=''):
+  table[name] = (handler, least, most, usage or name)
+
+def tcpCommand(client, command):
+  params = command.split(' ')
+  entry = tcpCommands.get(params[0])
+  if entry is None:
+    client.send("Invalid command. Type @help for help.\n")
+    return
+  tcpRun(client, entry, params, 0, command)
+
+def tcpRun(client, entry, params, first, command):
+  # entry's handler, if params after params[first] are as many as it takes
+  handler, least, most, usage = entry
+  n = len(params) - first - 1
+  if n < least or (most is not None and n > most):
+    client.send('Usage: ' + usage + '\n')
+    return
+  try:
+    handler(client, params, command)
+  except ValueError:
+    client.send('Usage: ' + usage + '\n')
+
+def tcpSub(client, table, params, command):
+  entry = table.get(params[1])
+  if entry is None:
+    client.send(f"{params[0]} takes one of: {' '.join(sorted(table))}\n")
+    return
+  tcpRun(client, entry, params, 1, command)
+
+
+def cmdHelp(client, params, command):
+  for table in (tcpCommands, tcpSettings, tcpShows):
+    for name in sorted(table):
+      client.send(table[name][3] + '\n')
+
+def cmdReset(client, params, command):
+  client.send("Resetting...")
+  client.drain()
+  microcontroller.reset()
 
-def getISOString(dt):
-  # input timestamp in form 20210408195123
-  # output is string in form 2021-04-08T19:51:23
-  if dt is not None:
-    return dt[0:4] + '-' + dt[4:6] + '-' + dt[6:8] + 'T' + dt[8:10] + ':' + dt[10:12] + ':' + dt[12:14]
+def cmdColor(client, params, command):
+  color = (int(params[1]), int(params[2]), int(params[3]), int(params[4]))
+  if not all(0 <= c <= 255 for c in color):
+    raise ValueError()
+  if config['wifi'] == 'enabled':
+    pixels[1] = color
+    pixels.write()
+
+def cmdSet(client, params, command):
+  tcpSub(client, tcpSettings, params, command)
+
+def cmdShow(client, params, command):
+  if len(params) == 1:
+    showConfig(client)
   else:
-    return ""
-
-def getDateTime(dt):
-  # input ISO string in form 2021-04-08T19:51:23
-  # output is UNIX timestamp
-  if dt is not None:
-    t = 946684800 + int(time.mktime((int(dt[0:4]), int(dt[5:7]), int(dt[8:10]), int(dt[11:13]), int(dt[14:16]), int(dt[17:]), -1, -1, -1)))
-    return round(t)
+    tcpSub(client, tcpShows, params, command)
+
+def cmdProfile(client, params, command):
+  # @profile on|off, @profile stream toggles raw samples to this client
+  if len(params) == 2 and params[1] in ['on', 'off']:
+    profileStart(params[1] == 'on')
+    client.send(f'profiling {params[1]}\n')
+  elif len(params) == 2 and params[1] == 'stream':
+    client.power = not client.power
+    client.send('streaming ' + ('on' if client.power else 'off') + '\n')
+  elif len(params) == 1:
+    client.send('profiling ' + ('on' if profiling else 'off') + '\n')
   else:
-    return 0
+    raise ValueError()
+
+def cmdSub(client, params, command):
+  # @sub $RT $DT shows those sentences to this client, @unsub hides them
+  for name in params[1:]:
+    if params[0] == '@sub':
+      client.muted.pop(sentenceTag(name), None)
+    else:
+      client.muted[sentenceTag(name)] = name
+  client.send('muted: ' + ' '.join(client.muted.values()) + '\n')
+
+def cmdFactory(client, params, command):
+  microcontroller.nvm[0] = 0
+  client.send("Cleared NVM and Resetting...")
+  client.drain()
+  microcontroller.reset()
+
+
+def setMode(client, params, command):
+  if params[2] not in ['ap', 'sta']:
+    raise ValueError()
+  config['mode'] = params[2]
+  client.send(f"Successfully set mode to {params[2]}.")
+  writePreferences()
+
+def setWifi(client, params, command):
+  if params[2] not in ['enabled', 'disabled']:
+    raise ValueError()
+  config['wifi'] = params[2]
+  if config['wifi'] == 'disabled':
+    pixels[0] = (0,0,0,0)
+    pixels[1] = (0,0,0,0)
+    pixels.write()
+  writePreferences()
+  client.send(f"Successfully {params[2]} wifi.")
+  client.send("Resetting...")
+  client.drain()
+  microcontroller.reset()
+
+def setSsid(client, params, command):
+  config['ssid'] = command[10:].strip()
+  client.send(f"Successfully set ssid to {config['ssid']}.")
+  writePreferences()
+
+def setPassword(client, params, command):
+  config['password'] = command[8:].strip()
+  client.send(f"Successfully set password to {config['password']}.")
+  writePreferences()
+
+def setInterval(client, params, command):
+  interval = int(params[2])
+  if interval == 0 or (interval >= 15 and interval <= 720):
+    if interval == 0 and config['interval'] > 0:
+      config['interval'] = config['interval'] * -1
+      client.send(f"Successfully set interval to off.")
+    else:
+      config['interval'] = interval
+      client.send(f"Successfully set interval to {config['interval']}.")
+    writePreferences()
+  else:
+    client.send("Interval can only be 0 or 15-720 minutes.")
+
+def setEncoding(client, params, command):
+  # @set encoding binary ina gps
+  if params[2] in ENCODERS and all(f in ['ina', 'gps'] for f in params[3:]):
+    config['encoding'] = ' '.join(params[2:])
+    client.send(f"Successfully set encoding to {config['encoding']}.")
+    writePreferences()
+  else:
+    client.send("Encoding can only be " + '/'.join(ENCODERS) + ", optionally followed by ina and gps.")
 
+def setTelemetry(client, params, command):
+  telemetry = int(params[2])
+  if telemetry == 0 or telemetry >= TELEMETRY_MIN_INTERVAL:
+    config['telemetry'] = telemetry
+    client.send(f"Successfully set telemetry to {config['telemetry']}.")
+    writePreferences()
+  else:
+    client.send(f"Telemetry can only be 0 or at least {TELEMETRY_MIN_INTERVAL} seconds.")
+
+def setPower(client, params, command):
+  if params[2] in POWER_MODES:
+    config['power'] = params[2]
+    client.send(f"Successfully set power to {params[2]}.")
+    writePreferences()
+    sleepTileRates()
+  else:
+    client.send("Power can only be " + '/'.join(POWER_MODES) + ".")
+
+def setSleep(client, params, command):
+  if SLEEP_MIN <= int(params[2]) <= SLEEP_MAX:
+    config['sleep'] = int(params[2])
+    client.send(f"Successfully set sleep to {config['sleep']}.")
+    writePreferences()
+  else:
+    client.send(f"Sleep can only be {SLEEP_MIN}-{SLEEP_MAX} seconds.")
+
+def setMonitor(client, params, command):
+  if params[2] in ['alert', 'poll']:
+    config['monitor'] = params[2]
+    client.send(f"Successfully set monitor to {params[2]}.")
+    writePreferences()
+  else:
+    client.send("Monitor can only be alert or poll.")
+
+def setBroker(client, params, command):
+  config['broker'] = command[12:].strip()
+  client.send(f"Successfully set broker to {config['broker']}.")
+  writePreferences()
+
+
+def showConfig(client):
+  client.send('wifi mode:' + config['mode'] + '\n')
+  client.send('wifi:' + config['wifi'] + '\n')
+  client.send('wifi ssid:' + config['ssid'] + '\n')
+  client.send('wifi pw:  ' + config['password'] + '\n')
+  client.send('interval: ' + (str(config['interval']), 'OFF')[config['interval'] <= 0] + '\n')
+  client.send('encoding: ' + config['encoding'] + '\n')
+  client.send('telemetry: ' + (str(config['telemetry']), 'OFF')[config['telemetry'] <= 0] + '\n')
+  client.send('monitor: ' + config['monitor'] + '\n')
+  client.send('power: ' + config['power'] + ' sleep: ' + str(config['sleep']) + '\n')
+  if 'broker' in config:
+      client.send('broker: ' + config['broker'] + '\n')
+
+def inaMean(channel):
+  # mean current since boot, what the average draw of a firmware change is measured by
+  if inaReadings == 0:
+    return ''
+  return f' mean: {inaSums[channel - 1] / inaReadings:.4f}A ({inaReadings})'
+
+def showBattery(client, params, command):
+  client.send('BAT: ' + str(inaData[1][0]) + 'V ' + str(inaData[1][1]) + 'A' + inaMean(1))
+
+def show3v3(client, params, command):
+  client.send('3V3: ' + str(inaData[3][0]) + 'V ' + str(inaData[3][1]) + 'A' + inaMean(3))
+
+def showSolar(client, params, command):
+  client.send('SOL: ' + str(inaData[2][0]) + 'V ' + str(inaData[2][1]) + 'A' + inaMean(2))
+
+def showSamples(client, params, command):
+  client.send(f'batched: {sampleBatch.count} dropped: {samplesDropped} unsent: {tileUnsent}\n')
+
+def showStats(client, params, command):
+  outstanding = 0
+  for m in messagesById.values():
+    if 'time_rx_sat' not in m:
+      outstanding = outstanding + 1
+  client.send(deliveryStats.summary() + f' outstanding: {outstanding}\n')
+
+def showSchedule(client, params, command):
+  if scheduler.next is not None:
+    client.send(f'next: {round(scheduler.next - time.time())}s\n')
+  client.send(f'noise: {scheduler.noise}\n')
+  for h in range(24):
+    if scheduler.samples[h] > 0:
+      client.send(f'{h:02d}h: {round(scheduler.latency[h])}s ({scheduler.samples[h]})\n')
+
+def showPower(client, params, command):
+  client.send(f'profiling: {"on" if profiling else "off"} samples: {powerProfile.samples}\n')
+  client.send('mJ: ' + ' '.join(str(mj) for mj in powerProfile.mj) + '\n')
+  client.send(f'asleep: {round(sleepTotal)}s wakes: ' + ' '.join(f'{k}:{v}' for k, v in sleepWakes.items()) + '\n')
+  for tag, id, when, energy in powerEvents:
+    client.send(f'{when} {tag} {id} {energy[0]} {energy[1]} {energy[2]} mJ\n')
+
+def showTile(client, params, command):
+  configured = 'no' if tileConfiguredIn is None else f'{tileConfiguredIn:.1f}s'
+  client.send(f'state: {tileState} configured in: {configured} bring-ups: {tileBringUps} retries: {tileRetries}\n')
+  client.send(f'in flight: {len(tileCommands.inflight)} waiting: {len(tileCommands.waiting)} timeouts: {tileCommands.timeouts} late: {tileCommands.late}\n')
+
+def showAlerts(client, params, command):
+  for when, text in inaAlerts:
+    client.send(f'{when} {text}\n')
+
+def showArchive(client, params, command):
+  if len(params) == 2:
+    client.send(f'archived: {archive.count()} indexed: {archive.indexed}\n')
+    return
+  # @show archive <id>
+  record = archive.lookup(int(params[2])) if params[2].isdigit() else None
+  if record is None:
+    client.send(f'{params[2]} not archived\n')
+  else:
+    client.send(f'{params[2]},{record[1]},{isoString(record[2])},{isoString(record[3])}\n')
+
+def showClients(client, params, command):
+  for c in tcpClients:
+    client.send(f'{c.addr} buffered:{c.count}' + (' (you)' if c is client else '') + '\n')
+  for c in streamClients:
+    client.send(f'{c.addr} buffered:{c.count} (stream)\n')
+  client.send(f'dropped: {tcpDropped}\n')
+
+
+tcpRegister(tcpCommands, '@help', cmdHelp, usage='@help')
+tcpRegister(tcpCommands, '@reset', cmdReset, usage='@reset')
+tcpRegister(tcpCommands, '@color', cmdColor, 4, 4, '@color <r> <g> <b> <w>')
+tcpRegister(tcpCommands, '@set', cmdSet, 1, None, '@set <setting> <value>')
+tcpRegister(tcpCommands, '@show', cmdShow, 0, None, '@show [<what>]')
+tcpRegister(tcpCommands, '@profile', cmdProfile, 0, 1, '@profile [on|off|stream]')
+tcpRegister(tcpCommands, '@sub', cmdSub, 1, None, '@sub <sentence>...')
+tcpRegister(tcpCommands, '@unsub', cmdSub, 1, None, '@unsub <sentence>...')
+tcpRegister(tcpCommands, '@factory', cmdFactory, usage='@factory')
+tcpRegister(tcpSettings, 'mode', setMode, 1, 1, '@set mode ap|sta')
+tcpRegister(tcpSettings, 'wifi', setWifi, 1, 1, '@set wifi enabled|disabled')
+tcpRegister(tcpSettings, 'ssid', setSsid, 1, None, '@set ssid <ssid>')
+tcpRegister(tcpSettings, 'pw', setPassword, 1, None, '@set pw <password>')
+tcpRegister(tcpSettings, 'interval', setInterval, 1, 1, '@set interval 0|15-720')
+tcpRegister(tcpSettings, 'encoding', setEncoding, 1, 3, '@set encoding ' + '|'.join(ENCODERS) + ' [ina] [gps]')
+tcpRegister(tcpSettings, 'telemetry', setTelemetry, 1, 1, f'@set telemetry 0|{TELEMETRY_MIN_INTERVAL}-')
+tcpRegister(tcpSettings, 'power', setPower, 1, 1, '@set power ' + '|'.join(POWER_MODES))
+tcpRegister(tcpSettings, 'sleep', setSleep, 1, 1, f'@set sleep {SLEEP_MIN}-{SLEEP_MAX}')
+tcpRegister(tcpSettings, 'monitor', setMonitor, 1, 1, '@set monitor alert|poll')
+tcpRegister(tcpSettings, 'broker', setBroker, 1, 1, '@set broker <host>')
+tcpRegister(tcpShows, 'battery', showBattery, usage='@show battery')
+tcpRegister(tcpShows, '3v3', show3v3, usage='@show 3v3')
+tcpRegister(tcpShows, 'solar', showSolar, usage='@show solar')
+tcpRegister(tcpShows, 'samples', showSamples, usage='@show samples')
+tcpRegister(tcpShows, 'stats', showStats, usage='@show stats')
+tcpRegister(tcpShows, 'schedule', showSchedule, usage='@show schedule')
+tcpRegister(tcpShows, 'power', showPower, usage='@show power')
+tcpRegister(tcpShows, 'tile', showTile, usage='@show tile')
+tcpRegister(tcpShows, 'alerts', showAlerts, usage='@show alerts')
+tcpRegister(tcpShows, 'archive', showArchive, 0, 1, '@show archive [<id>]')
+tcpRegister(tcpShows, 'clients', showClients, usage='@show clients')
 
 def writePreferences():
   configString = json.dumps(config)
@@ -542,13 +1434,23 @@ def readPreferences():
     config['interval'] = 60
   if not 'wifi' in config:
     config['wifi'] = "enabled"
+  if not 'encoding' in config:
+    config['encoding'] = "json"
+  if not 'telemetry' in config:
+    config['telemetry'] = 0
+  if not 'monitor' in config:
+    config['monitor'] = 'alert'
+  if not 'power' in config:
+    config['power'] = 'full'
+  if not 'sleep' in config:
+    config['sleep'] = 60
 # Add this back in if you want to automatically connect to a broker
   if not 'broker' in config:
     config['broker'] = "nootropicdesign.com"
 
 
 def watchDogInit():
-  w.timeout = 60
+  w.timeout = WATCHDOG_TIMEOUT
   w.mode = WatchDogMode.RESET
   w.feed()
 
@@ -565,12 +1467,18 @@ def buttonInit():
   pinC.direction = digitalio.Direction.INPUT
   pinC.pull = digitalio.Pull.UP
   switchC = Debouncer(pinC)
+  # released to the alarms while the board sleeps
+  buttonPins[:] = [pinA, pinC]
 
 
 
 def buttonPoll():
+  global buttonWoke
   switchA.update()
-  if switchA.rose: # just released
+  if switchA.rose and buttonWoke:
+    # the press that woke the board, it has brought WiFi up already
+    buttonWoke = False
+  elif switchA.rose: # just released
     if config['wifi'] == "enabled":
       config['wifi'] = "disabled"
       pixels[0] = (0,0,0,0)
@@ -597,17 +1505,47 @@ def factoryResetCheck():
 def messageAccepted(line):
   global messagesById, messagesByTileMsgId
   msg_id = line[line.index(',')+1:line.index('*')]
-  time_tx = getISOString(lastDT)
-  if lastId is None:
+  time_tx = tileClock.iso()
+  # the id the $TD this answers was sent with, None if it came from the console
+  id = tileCommands.context
+  if id is None:
     return
-  id = lastId
   messagesById[id] = {
     "tile_msg_id": msg_id,
     "time_tx": time_tx,
   }
   # maintain a mapping between tile message IDs and the main index id
   messagesByTileMsgId[msg_id] = id
-  saveMessages()
+  journalAppend(f'A,{id},{msg_id},{time_tx}')
+  streamSend(FRAME_MSG, MSG_ACCEPTED, int(id), int(msg_id), 0, 0, 0)
+  profileEvent('OK', id)
+  messagesEvict()
+
+def messagesEvict():
+  now = tileClock.unix() if tileClock.valid else 0
+  # completed messages are kept in the order they completed, so only the head ever needs checking
+  while len(completedIds) > 0:
+    id = completedIds[0]
+    if len(completedIds) <= MESSAGES_MAX_COMPLETED and now - isoSeconds(messagesById[id]['time_rx_sat']) < MESSAGES_MAX_AGE:
+      break
+    completedIds.pop(0)
+    messageArchive(id)
+  if not tileClock.valid:
+    return
+  # in-flight messages are bounded by what the tile can hold, drop the ones it will never send
+  for id in [id for id in messagesById if 'time_rx_sat' not in messagesById[id]]:
+    if now - isoSeconds(messagesById[id]['time_tx']) > MESSAGES_INFLIGHT_EXPIRY:
+      messageArchive(id)
+
+def messageArchive(id):
+  message = messagesById.pop(id)
+  messagesByTileMsgId.pop(message["tile_msg_id"], None)
+  try:
+    archive.append(int(id), int(message["tile_msg_id"]), isoSeconds(message["time_tx"]),
+                   isoSeconds(message.get("time_rx_sat", "")))
+  except (OSError, ValueError) as e:  # Typically when the filesystem isn't writeable...
+    pass
+  journalAppend(f'E,{id}')
 
 def messageSent(line):
   global messagesById
@@ -620,25 +1558,45 @@ def messageSent(line):
     logTCP(f'messageSent: message {msg_id} not known')
     return
   id = messagesByTileMsgId[msg_id]
-  time_rx_sat = getISOString(lastDT)
+  if 'time_rx_sat' in messagesById[id]:
+    # messagesReconcile() already took it for sent
+    logTCP(f'messageSent: message {id} already sent')
+    return
+  if not tileClock.valid:
+    # just woken or brought up, it is recorded with the time the next $DT brings
+    if len(sentWaiting) < SENT_WAITING_MAX:
+      sentWaiting.append(line)
+    return
+  streamSend(FRAME_MSG, MSG_SENT, int(id), int(msg_id), int(rssi), int(snr), int(fdev))
+  energy = profileEvent('SENT', id)
+  messageDelivered(id, None if energy is None else energy[PROFILE_TX_CHANNEL - 1])
+  messagesEvict()
+
+def messageDelivered(id, energy=None, inferred=False):
+  # once per message; a send messagesReconcile() inferred is marked as such in the stats
+  if "time_rx_sat" in messagesById[id]:
+    return
+  time_rx_sat = tileClock.iso()
+  completedIds.append(id)
   messagesById[id]["time_rx_sat"] = time_rx_sat
-  saveMessages()
-  saveStats(id)
-
-def packetReceived(line):
-  parts = line[4:-3].split(',')
-  if (len(parts) < 5):
-    return
-  fields = []
-  for p in parts:
-      fields.append(p.split('='))
-  fields = dict(fields)
-  if 'T' in fields['TS']:
-      d, t = fields['TS'].split('T')
-  else:
-      d, t = fields['TS'].split(' ')
-  d = d.split('-')
-  t = t.split(':')
+  journalAppend(f'S,{id},{time_rx_sat}')
+  saveStats(id, energy, inferred)
+
+def messagesReconcile(unsent):
+  # after a sleep, see POWER_MODES. How many went out is known, which ones isn't:
+  # the Tile doesn't promise to send in order, but taking the oldest is the best
+  # guess, and they are marked inferred with the time the board woke
+  global sleepReconcile
+  sleepReconcile = False
+  if not tileClock.valid:
+    return
+  inflight = [id for id in messagesById if 'time_rx_sat' not in messagesById[id]]
+  inflight.sort(key=lambda id: messagesById[id]['time_tx'])
+  for id in inflight[:len(inflight) - unsent]:
+    logTCP(f'messageSent: {id} went out while asleep')
+    streamSend(FRAME_MSG, MSG_SENT, int(id), int(messagesById[id]['tile_msg_id']), 0, 0, 0)
+    messageDelivered(id, inferred=True)
+  messagesEvict()
 
 def getRandomId():
   s = str(random.getrandbits(32))
@@ -647,54 +1605,125 @@ def getRandomId():
   return s
 
 def sendMessage():
-  global lastId
   log("Sending message...")
   id = getRandomId()
-  payload = getISOString(lastDT)
-  appId = 123
-  satMessage = {
-    "id": id,
-    "payload": payload
-  }
-  satMessageJSON = json.dumps(satMessage)
-  satMessageJSON = satMessageJSON.replace(' ', '')
-  s = ('$TD AI=' + str(appId) + ',').encode() + hexlify(satMessageJSON.encode())
-  s = appendChecksum(s)
-  lastId = id
-  tile.write(s)
+  # config['encoding'] is the encoder name followed by the optional fields to include
+  encoding = config['encoding'].split(' ')
+  payload = ENCODERS[encoding[0]](id, tileClock.unix(),
+                                  inaData if 'ina' in encoding else None,
+                                  lastGN if 'gps' in encoding else None)
+  sendPayload(id, payload)
+
+def sendPayload(id, payload):
+  s = tdBuffer.td(APP_ID, payload)
+  if s is None:
+    log(f"Message too long: {len(payload)} bytes")
+    return False
+  sleepStayAwake()
+  return tileSend(s, id)
+
+def sendBatch():
+  global tileUnsent
+  log(f"Sending {sampleBatch.count} samples...")
+  id = getRandomId()
+  # counted until the next $MT C=U says otherwise, so batches can't pile up in between
+  tileUnsent = tileUnsent + 1
+  sendPayload(id, sampleBatch.pack(id))
+
+def samplePoll():
+  global nextSampleTime, samplesDropped, batteryLow
+  if config['telemetry'] <= 0 or not tileClock.valid or time.time() < nextSampleTime:
+    return
+  nextSampleTime = time.time() + config['telemetry']
+  values = inaValues(inaData)
+  if values is None:
+    return
+  t = tileClock.unix()
+  priority = values[0] < BATTERY_LOW * 1000 and not batteryLow
+  batteryLow = values[0] < BATTERY_LOW * 1000
+  backpressure = tileUnsent >= SAMPLE_MAX_UNSENT
+  if not sampleBatch.add(t, values):
+    if backpressure:
+      samplesDropped = samplesDropped + 1
+      return
+    sendBatch()
+    sampleBatch.add(t, values)
+  if not backpressure and (priority or t - sampleBatch.start >= SAMPLE_MAX_AGE):
+    sendBatch()
 
 def requestNumberUnsent():
-  s = ('$MT C=U').encode()
-  s = appendChecksum(s)
-  tile.write(s)
+  tileSend(makeTileCmd('$MT C=U'))
 
 def loadMessages():
-  global messagesById, messagesByTileMsgId
-  try:
-    with open("/messages.json", "r") as f:
-      messagesById = json.load(f)
-  except OSError as e:
-    pass
-
+  global messagesById, messagesByTileMsgId, completedIds, journalRecords
+  messagesById, journalRecords = swarm_journal.load(MESSAGES_FILE, JOURNAL_FILE)
+  messagesByTileMsgId = {}
   for id in messagesById.keys():
     message = messagesById[id]
     messagesByTileMsgId[message["tile_msg_id"]] = id;
+  completedIds = [id for id in messagesById if 'time_rx_sat' in messagesById[id]]
+  completedIds.sort(key=lambda id: messagesById[id]['time_rx_sat'])
+
+  if journalRecords >= JOURNAL_COMPACT_RECORDS:
+    compactMessages()
+
+def journalAppend(record):
+  global journalRecords
+  try:
+    with open(JOURNAL_FILE, "a") as f:
+      f.write(record + '\n')
+      f.flush()
+  except OSError as e:  # Typically when the filesystem isn't writeable...
+    return
+  journalRecords = journalRecords + 1
+  if journalRecords >= JOURNAL_COMPACT_RECORDS:
+    compactMessages()
+
+def compactMessages():
+  global journalRecords
+  if not saveMessages():
+    return
+  try:
+    with open(JOURNAL_FILE, "w") as f:
+      f.flush()
+  except OSError as e:
+    return
+  journalRecords = 0
 
 def saveMessages():
+  # write the snapshot next to the old one and swap it in, so a power loss never leaves us without one
   try:
-    with open("/messages.json", "w") as f:
+    with open(MESSAGES_FILE + ".tmp", "w") as f:
       json.dump(messagesById, f)
       f.flush()
+    try:
+      os.remove(MESSAGES_FILE)
+    except OSError as e:
+      pass
+    os.rename(MESSAGES_FILE + ".tmp", MESSAGES_FILE)
+    return True
   except OSError as e:  # Typically when the filesystem isn't writeable...
-    pass
+    return False
 
-def saveStats(id):
+def saveStats(id, energy=None, inferred=False):
+  # id,time_tx,latency and, when profiling, the mJ the transmission took;
+  # ,,inferred after the latency for a send messagesReconcile() inferred
+  global statsSummarySaved
   stats = f'{id},{messagesById[id]["time_tx"]},'
-  time_tx = getDateTime(messagesById[id]['time_tx'])
-  time_rx_sat = getDateTime(messagesById[id]['time_rx_sat'])
+  time_tx = isoSeconds(messagesById[id]['time_tx'])
+  time_rx_sat = isoSeconds(messagesById[id]['time_rx_sat'])
   stats += f'{str(time_rx_sat-time_tx)}'
+  if inferred:
+    stats += ',,inferred'
+  elif energy is not None:
+    stats += f',{energy}'
+  statsSummarySaved = False
+  record = parseStatsLine(stats)
+  if record is not None:
+    scheduler.learn(int(record[0][11:13]), record[1])
+    deliveryStats.add(record[0], record[1], record[2])
   try:
-    with open("/stats.csv", "a") as f:
+    with open(STATS_FILE, "a") as f:
       logTCP(stats)
       print(stats, file=f)
       f.flush()
@@ -702,49 +1731,353 @@ def saveStats(id):
     pass
 
 
+def statsSize():
+  try:
+    return os.stat(STATS_FILE)[6]
+  except OSError as e:
+    return 0
+
+def loadStats():
+  # the scheduler and @show stats from the summary, or with one pass over
+  # stats.csv if it has grown since the summary was saved
+  global scheduler, deliveryStats, statsSummarySaved
+  try:
+    with open(STATS_SUMMARY_FILE, "r") as f:
+      summary = json.load(f)
+    if summary['size'] == statsSize():
+      scheduler = SendScheduler.fromDict(summary['scheduler'])
+      deliveryStats = DeliveryStats.fromDict(summary['stats'])
+      statsSummarySaved = True
+      return
+  except (OSError, ValueError, KeyError) as e:
+    pass
+  try:
+    with open(STATS_FILE, "r") as f:
+      for line in f:
+        record = parseStatsLine(line)
+        if record is not None:
+          scheduler.learn(int(record[0][11:13]), record[1])
+          deliveryStats.add(record[0], record[1], record[2])
+          if deliveryStats.count % 256 == 0:
+            w.feed()  # years of log take a while
+  except OSError as e:
+    pass
+  saveStatsSummary()
+
+def saveStatsSummary():
+  # before a deep sleep and after reading stats.csv, not with every message
+  global statsSummarySaved
+  if statsSummarySaved:
+    return
+  try:
+    with open(STATS_SUMMARY_FILE, "w") as f:
+      json.dump({'size': statsSize(), 'scheduler': scheduler.toDict(), 'stats': deliveryStats.toDict()}, f)
+      f.flush()
+    statsSummarySaved = True
+  except OSError as e:  # Typically when the filesystem isn't writeable...
+    pass
+
+
 def sendPoll():
-  global nextSendTime
-  if (lastDT is not None) and (time.time() > nextSendTime):
-    nextSendTime = (15 * 60) + time.time()
+  if not tileClock.valid or config['interval'] <= 0:
+    return
+  now = time.time()
+  interval = config['interval'] * 60
+  if scheduler.due(now, tileClock.hour(), interval):
+    scheduler.sent(now, interval)
     sendMessage()
 
+def sleepStayAwake():
+  global sleepAwakeUntil
+  sleepAwakeUntil = time.monotonic() + SLEEP_AWAKE
+
+def sleepTileRates():
+  # the Tile's periodic sentences would wake the board every few seconds, so
+  # they are off while it sleeps; turning $DT off clears the time, ask for it
+  low = config['power'] != 'full'
+  tile.write(b'\n')
+  for cmd in tileStateTable[TILE_STATE_CONFIGURING][0]:
+    tileSend(makeTileCmd(cmd[:3] + ' 0' if low else cmd))
+  if low:
+    tileSend(makeTileCmd('$DT @'))
+  sleepStayAwake()
+
+def sleepWoke(cause):
+  # catch up with what the periodic sentences would have said
+  global sleepReconcile, buttonWoke, nextStatusTime
+  sleepWakes[cause] = sleepWakes[cause] + 1
+  if cause == 'button':
+    buttonWoke = not switchA.value
+    wifiUp()
+  tile.write(b'\n')
+  tileSend(makeTileCmd('$DT @'))
+  tileSend(makeTileCmd('$RT @'))
+  if 'gps' in config['encoding']:
+    tileSend(makeTileCmd('$GN @'))
+  sleepReconcile = True
+  requestNumberUnsent()
+  # that was this minute's $MT C=U, see statusPoll()
+  nextStatusTime = time.time() + 60
+  sleepStayAwake()
+
+def sleepCause(woke):
+  if isinstance(woke, alarm.pin.PinAlarm):
+    if woke.pin is board.RX:
+      return 'tile'
+    if woke.pin is INA_ALERT_PIN:
+      return 'ina'
+    return 'button'
+  return 'timer'
+
+def sleepAlarms(seconds, deep):
+  alarms = [alarm.time.TimeAlarm(monotonic_time=time.monotonic() + seconds)]
+  pins = [(board.D5, True)]
+  if not deep:
+    pins.append((board.RX, False))
+  if INA_ALERT_PIN is not None:
+    pins.append((INA_ALERT_PIN, True))
+  for pin, pull in pins:
+    try:
+      alarms.append(alarm.pin.PinAlarm(pin=pin, value=False, pull=pull))
+    except (ValueError, RuntimeError):
+      # not a pin that can wake the board from this sleep
+      pass
+  return alarms
+
+def sleepTime():
+  # seconds until the next message or sample may be due, at most config['sleep']
+  now = time.time()
+  t = now + config['sleep']
+  if config['interval'] > 0:
+    t = min(t, scheduler.nextCheck(now, config['interval'] * 60))
+  if config['telemetry'] > 0:
+    t = min(t, nextSampleTime)
+  return t - now
+
+def sleepPoll():
+  global sleepWifiUntil
+  if config['power'] == 'full' or profiling or tileState != TILE_STATE_CONFIGURED or not tileClock.valid:
+    return
+  now = time.monotonic()
+  if wifiOn:
+    if len(tcpClients) > 0 or len(streamClients) > 0:
+      sleepWifiUntil = now + SLEEP_WIFI_WINDOW
+    if now < sleepWifiUntil:
+      return
+    wifiDown()
+  if now < sleepAwakeUntil or buttonWoke or tile.in_waiting > 0:
+    return
+  if len(tileCommands.inflight) > 0 or len(tileCommands.waiting) > 0:
+    # an answer coming in while asleep would be lost, a $TD OK with its message
+    return
+  seconds = sleepTime()
+  if seconds < SLEEP_SHORTEST:
+    return
+  if config['power'] == 'deep':
+    sleepDeep(seconds)
+  else:
+    sleepLight(seconds)
+
+def sleepLight(seconds):
+  # the whole loop stops here, the UART and the pins are handed to the alarms
+  global inaAlertPin, sleepTotal
+  start = time.monotonic()
+  deadline = start + seconds
+  tile.deinit()
+  for pin in buttonPins:
+    pin.deinit()
+  if inaAlertPin is not None:
+    inaAlertPin.deinit()
+    inaAlertPin = None
+  while True:
+    # woken in time to feed the watchdog, which may be counting
+    w.feed()
+    woke = alarm.light_sleep_until_alarms(*sleepAlarms(min(deadline - time.monotonic(), WATCHDOG_TIMEOUT - 10), False))
+    if not isinstance(woke, alarm.time.TimeAlarm) or time.monotonic() >= deadline - 1:
+      break
+  w.feed()
+  slept = time.monotonic() - start
+  sleepTotal = sleepTotal + slept
+  # the tasks didn't hang, they were asleep too
+  for name in taskDeadlines:
+    taskDeadlines[name] = taskDeadlines[name] + slept
+  tileUART()
+  buttonInit()
+  inaPinInit()
+  sleepWoke(sleepCause(woke))
+
+def sleepDeep(seconds):
+  # code.py starts over when the board wakes, see sleepInit()
+  state = SleepState()
+  state.tileTime = tileClock.now()
+  now = time.time()
+  state.sendIn = None if scheduler.next is None else scheduler.next - now
+  state.sampleIn = nextSampleTime - now if nextSampleTime > 0 else None
+  state.noise = scheduler.noise
+  state.unsent = tileUnsent
+  state.dropped = samplesDropped
+  state.batteryLow = batteryLow
+  state.save(alarm.sleep_memory, sampleBatch)
+  saveStatsSummary()
+  for pin in buttonPins:
+    pin.deinit()
+  alarm.exit_and_deep_sleep_until_alarms(*sleepAlarms(seconds, True))
+
+def sleepInit(woke):
+  # at boot; woke is the alarm that ended a deep sleep, tileConfigured() takes it from here
+  global sleepResume, sleepBootWake
+  sleepBootWake = woke
+  if woke is not None:
+    state = SleepState()
+    if state.load(alarm.sleep_memory, sampleBatch):
+      sleepResume = state
+  if woke is None or config['power'] == 'full':
+    # at power-on there is a window to connect
+    wifiUp()
+
+def sleepRestore():
+  # put the due times back against the Tile time
+  global sleepResume, nextSampleTime, tileUnsent, samplesDropped, batteryLow
+  state = sleepResume
+  sleepResume = None
+  elapsed = tileClock.now() - state.tileTime
+  now = time.time()
+  if state.sendIn is not None:
+    scheduler.next = now + state.sendIn - elapsed
+  if state.sampleIn is not None:
+    nextSampleTime = now + state.sampleIn - elapsed
+  if scheduler.noise is None:
+    scheduler.noise = state.noise
+  tileUnsent = state.unsent
+  samplesDropped = state.dropped
+  batteryLow = state.batteryLow
+
+def wifiUp():
+  global wifiOn, sleepWifiUntil
+  sleepWifiUntil = time.monotonic() + SLEEP_WIFI_WINDOW
+  if wifiOn or config['wifi'] == 'disabled':
+    return
+  wifi.radio.enabled = True
+  wifiInit()
+  tcpInit()
+  wifiOn = True
+
+def wifiDown():
+  global wifiOn, tcplistener, streamListener
+  if not wifiOn:
+    return
+  for client in tcpClients + streamClients:
+    client.close()
+  tcpClients.clear()
+  streamClients.clear()
+  for listener in (tcplistener, streamListener):
+    if listener is not None:
+      listener.close()
+  tcplistener = None
+  streamListener = None
+  wifi.radio.enabled = False
+  wifiOn = False
+  displayLine(0, "Wifi asleep")
+
 def statusPoll():
   global nextStatusTime
-  if (lastDT is not None) and (time.time() > nextStatusTime):
+  tileWatch()
+  if tileClock.valid and (time.time() > nextStatusTime):
     nextStatusTime = (60) + time.time()
     requestNumberUnsent()
 
 
+async def taskSleep(name, seconds):
+  taskDeadlines[name] = time.monotonic() + seconds + HEALTH_GRACE
+  await asyncio.sleep(seconds)
+
+async def tileTask():
+  while True:
+    tilePoll()
+    await taskSleep('tile', TILE_POLL_INTERVAL)
+
+async def inaTask():
+  while True:
+    inaPoll()
+    samplePoll()
+    await taskSleep('ina', inaInterval())
+
+async def tcpTask():
+  while True:
+    tcpPoll()
+    if len(tcpClients) > 0 or len(streamClients) > 0:
+      await taskSleep('tcp', TCP_POLL_INTERVAL)
+    else:
+      await taskSleep('tcp', TCP_LISTEN_INTERVAL)
+
+async def buttonTask():
+  while True:
+    buttonPoll()
+    await taskSleep('button', BUTTON_POLL_INTERVAL)
+
+async def sendTask():
+  while True:
+    sendPoll()
+    if not tileClock.valid:
+      await taskSleep('send', 1)
+    else:
+      await taskSleep('send', SEND_POLL_INTERVAL)
+
+async def statusTask():
+  while True:
+    statusPoll()
+    if not tileClock.valid:
+      await taskSleep('status', 1)
+    else:
+      await taskSleep('status', max(1, nextStatusTime - time.time() + 1))
+
+async def sleepTask():
+  while True:
+    sleepPoll()
+    await taskSleep('sleep', SLEEP_POLL_INTERVAL)
+
+async def healthTask():
+  # only feed the watchdog while every task keeps waking up on schedule
+  while True:
+    now = time.monotonic()
+    healthy = True
+    for name in taskDeadlines:
+      if taskDeadlines[name] < now:
+        healthy = False
+        print("task", name, "is not responding")
+    if healthy:
+      w.feed()
+    gc.collect()
+    await asyncio.sleep(HEALTH_INTERVAL)
+
+async def main():
+  await asyncio.gather(tileTask(), inaTask(), tcpTask(), buttonTask(), sendTask(), statusTask(), sleepTask(), healthTask())
+
+
 ### BEGIN
+woke = alarm.wake_alarm
 watchDogInit()
 buttonInit()
-factoryResetCheck()
+if woke is None:
+  # after deep sleep button A may still be down from the press that woke the board
+  factoryResetCheck()
 i2c = busio.I2C(board.SCL, board.SDA, frequency=400000)
-displayInit()
+displayInit(woke is None)
 readPreferences()
 if config['wifi'] == 'enabled':
   import wifi
   import socketpool
   import ipaddress
 
-tileInit()
-wifiInit()
-tcpInit()
 loadMessages()
+loadStats()
+sleepInit(woke)
+tileInit(woke)
 
 try:
-  while True:
-    tilePoll()
-    inaPoll()
-    tcpPoll()
-    buttonPoll()
-    sendPoll()
-    statusPoll()
-    w.feed()
-    gc.collect()
+  asyncio.run(main())
 except Exception as e:
   print(e)
   print("Resetting...")
   microcontroller.reset()
 
-
@@ -0,0 +1,192 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Fixed-width binary archive of completed messages.
+#
+# archive.bin is an 8 byte header followed by one 20 byte record per message,
+# all little-endian:
+#   header  'SWA1'  u16 version  u16 record size
+#   record  u32 id  u64 tile_msg_id  u32 time_tx  u32 time_rx_sat
+# Times are seconds since 1970, 0 if unknown (a message that never reached a
+# satellite). Records are appended in the order messages leave messagesById.
+#
+# archive.idx holds (u32 id, u32 record number) pairs sorted by id for the
+# first `indexed` records of archive.bin:
+#   header  'SWX1'  u16 version  u16 entry size  u32 indexed
+# Records appended since are the tail, searched linearly until there are more
+# than INDEX_TAIL_MAX of them and the tail is merged into a new index. Lookups
+# binary search the index with seeks, and scans stream the records in small
+# chunks, so neither needs the file in RAM.
+
+import os
+import struct
+
+ARCHIVE_MAGIC = b'SWA1'
+INDEX_MAGIC = b'SWX1'
+ARCHIVE_VERSION = 1
+HEADER = '<4sHH'
+HEADER_SIZE = 8
+RECORD = '<IQII'
+RECORD_SIZE = 20
+INDEX_HEADER = '<4sHHI'
+INDEX_HEADER_SIZE = 12
+ENTRY = '<II'
+ENTRY_SIZE = 8
+INDEX_TAIL_MAX = 32
+SCAN_CHUNK = 32  # records read at a time by scan() and reindex()
+
+
+def indexPath(path):
+  return path[:path.rindex('.')] + '.idx' if '.' in path else path + '.idx'
+
+
+def fileSize(path):
+  try:
+    return os.stat(path)[6]
+  except OSError:
+    return -1
+
+
+class Archive:
+  # Seek-based access to archive.bin and its index. Records come back as
+  # (id, tile_msg_id, time_tx, time_rx_sat) tuples of ints.
+
+  def __init__(self, path):
+    self.path = path
+    self.indexPath = indexPath(path)
+    self.record = bytearray(RECORD_SIZE)
+    self.chunk = bytearray(RECORD_SIZE * SCAN_CHUNK)
+    self.entry = bytearray(ENTRY_SIZE)
+    self.indexed = self.readIndexed()
+
+  def count(self):
+    size = fileSize(self.path)
+    return 0 if size < HEADER_SIZE else (size - HEADER_SIZE) // RECORD_SIZE
+
+  def readIndexed(self):
+    # how many records the index covers, 0 if there isn't a usable one
+    try:
+      with open(self.indexPath, 'rb') as f:
+        magic, version, size, indexed = struct.unpack(INDEX_HEADER, f.read(INDEX_HEADER_SIZE))
+    except (OSError, ValueError, struct.error):
+      return 0
+    if magic != INDEX_MAGIC or size != ENTRY_SIZE or indexed > self.count():
+      return 0
+    return indexed
+
+  def append(self, id, tileMsgId, timeTx, timeRxSat):
+    new = fileSize(self.path) <= 0
+    with open(self.path, 'ab') as f:
+      if new:
+        f.write(struct.pack(HEADER, ARCHIVE_MAGIC, ARCHIVE_VERSION, RECORD_SIZE))
+      struct.pack_into(RECORD, self.record, 0, id, tileMsgId, timeTx, timeRxSat)
+      f.write(self.record)
+      f.flush()
+    if self.count() - self.indexed > INDEX_TAIL_MAX:
+      self.reindex()
+
+  def get(self, f, n):
+    f.seek(HEADER_SIZE + n * RECORD_SIZE)
+    if f.readinto(self.record) != RECORD_SIZE:
+      return None
+    return struct.unpack_from(RECORD, self.record)
+
+  def lookup(self, id):
+    # the record of message id, None if it isn't archived
+    if self.count() == 0:
+      return None
+    with open(self.path, 'rb') as f:
+      n = self.search(id)
+      if n is not None:
+        return self.get(f, n)
+      for record in self.records(f, self.indexed):
+        if record[0] == id:
+          return record
+    return None
+
+  def search(self, id):
+    # binary search of the index, the record number of id or None
+    if self.indexed == 0:
+      return None
+    with open(self.indexPath, 'rb') as f:
+      lo = 0
+      hi = self.indexed
+      while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(INDEX_HEADER_SIZE + mid * ENTRY_SIZE)
+        f.readinto(self.entry)
+        key, n = struct.unpack_from(ENTRY, self.entry)
+        if key == id:
+          return n
+        if key < id:
+          lo = mid + 1
+        else:
+          hi = mid
+    return None
+
+  def records(self, f, first=0):
+    # every record from record number first on, SCAN_CHUNK at a time
+    f.seek(HEADER_SIZE + first * RECORD_SIZE)
+    view = memoryview(self.chunk)
+    while True:
+      n = f.readinto(self.chunk) // RECORD_SIZE
+      for i in range(n):
+        yield struct.unpack_from(RECORD, view, i * RECORD_SIZE)
+      if n < SCAN_CHUNK:
+        return
+
+  def scan(self, start, end):
+    # records with start <= time_tx < end, in archive order
+    try:
+      with open(self.path, 'rb') as f:
+        for record in self.records(f):
+          if start <= record[2] < end:
+            yield record
+    except OSError:
+      return
+
+  def reindex(self):
+    # merge the sorted tail into the old index, streaming both, and swap it in
+    count = self.count()
+    with open(self.path, 'rb') as f:
+      tail = [(record[0], self.indexed + i) for i, record in enumerate(self.records(f, self.indexed))]
+    tail.sort()
+    tmp = self.indexPath + '.tmp'
+    with open(tmp, 'wb') as out:
+      out.write(struct.pack(INDEX_HEADER, INDEX_MAGIC, ARCHIVE_VERSION, ENTRY_SIZE, count))
+      t = 0
+      if self.indexed > 0:
+        with open(self.indexPath, 'rb') as f:
+          f.seek(INDEX_HEADER_SIZE)
+          for i in range(self.indexed):
+            f.readinto(self.entry)
+            key, n = struct.unpack_from(ENTRY, self.entry)
+            while t < len(tail) and tail[t][0] < key:
+              out.write(struct.pack(ENTRY, *tail[t]))
+              t = t + 1
+            out.write(self.entry)
+      while t < len(tail):
+        out.write(struct.pack(ENTRY, *tail[t]))
+        t = t + 1
+      out.flush()
+    try:
+      os.remove(self.indexPath)
+    except OSError:
+      pass
+    os.rename(tmp, self.indexPath)
+    self.indexed = count
+
+
+def write(path, records):
+  # a whole archive with a complete index at once, for the host converters
+  records = list(records)
+  with open(path, 'wb') as f:
+    f.write(struct.pack(HEADER, ARCHIVE_MAGIC, ARCHIVE_VERSION, RECORD_SIZE))
+    for record in records:
+      f.write(struct.pack(RECORD, *record))
+  entries = sorted((record[0], n) for n, record in enumerate(records))
+  with open(indexPath(path), 'wb') as f:
+    f.write(struct.pack(INDEX_HEADER, INDEX_MAGIC, ARCHIVE_VERSION, ENTRY_SIZE, len(records)))
+    for entry in entries:
+      f.write(struct.pack(ENTRY, *entry))
@@ -0,0 +1,52 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# The resident message index: messages.json, a snapshot of id -> message,
+# and messages.log, the journal of what happened to messages since.
+#
+#   A,<id>,<tile_msg_id>,<time_tx>  message accepted by the tile
+#   S,<id>,<time_rx_sat>            message sent to a satellite
+#   E,<id>                          message evicted to the archive
+#
+# code.py appends to the journal and folds it into a new snapshot now and
+# then; load() puts the two back together the same way on the board and in
+# the host tools. Replay must be idempotent, since the journal may be
+# replayed over a snapshot that already has it.
+
+import json
+
+
+def replay(messages, record):
+  # one journal record, without its newline, applied to messages
+  fields = record.split(',')
+  if fields[0] == 'A' and len(fields) == 4:
+    message = messages.setdefault(fields[1], {})
+    message["tile_msg_id"] = fields[2]
+    message["time_tx"] = fields[3]
+  elif fields[0] == 'S' and len(fields) == 3 and fields[1] in messages:
+    messages[fields[1]]["time_rx_sat"] = fields[2]
+  elif fields[0] == 'E' and len(fields) == 2:
+    messages.pop(fields[1], None)
+
+
+def load(snapshot, journal):
+  # (messages, journal records replayed); the .tmp snapshot only survives if
+  # power was lost in the middle of a compaction
+  messages = {}
+  for name in (snapshot, snapshot + ".tmp"):
+    try:
+      with open(name, "r") as f:
+        messages = json.load(f)
+      break
+    except (OSError, ValueError) as e:
+      pass
+  records = 0
+  try:
+    with open(journal, "r") as f:
+      for record in f:
+        replay(messages, record.strip())
+        records = records + 1
+  except OSError as e:
+    pass
+  return messages, records
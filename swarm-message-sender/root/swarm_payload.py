@@ -0,0 +1,191 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Payload encoders for the messages sent with $TD.
+#
+# Every encoder takes the message id, the Tile's time (seconds since 1970, see
+# swarm_time.TileClock), the INA3221 readings (inaData) and the last GPS fix
+# as (lat, lon, alt) or None, and returns the bytes that go on air. ENCODERS
+# maps the names @set encoding accepts to them.
+#
+# 'json' is the original {"id":"...","payload":"<ISO time>"} object.
+# 'binary' packs the same information into about a fifth of the bytes:
+#
+#   header   1 byte, format version in the high nibble, field flags in the low
+#   id       varint
+#   time     varint, seconds since PAYLOAD_EPOCH
+#   FLAG_INA bus mV (uint16) and current mA (int16) for channels 1, 2, 3
+#   FLAG_GPS latitude, longitude (int32, 1e-5 degrees), altitude (int16, m)
+#
+# Fixed-size fields are little-endian.
+#
+# A batch (format version 2, see SampleBatch) carries a series of INA3221
+# samples in one payload: the same header, id and time, then for each sample
+# the seconds since the previous one and the six INA values, each as a zigzag
+# varint of the difference from the previous sample's.
+#
+# decode() understands all formats and is what the host tools use on payloads
+# coming back from the Swarm Hive.
+
+import json
+import struct
+
+from swarm_time import isoString
+
+PAYLOAD_VERSION = 1
+PAYLOAD_BATCH = 2
+PAYLOAD_MAX = 192  # bytes the Tile accepts in one $TD
+BATCH_HEADER_MAX = 11  # header byte and two 5-byte varints
+PAYLOAD_EPOCH = 1640995200  # 2022-01-01T00:00:00Z
+FLAG_INA = 0x01
+FLAG_GPS = 0x02
+INA_FORMAT = '<HhHhHh'
+GPS_FORMAT = '<iih'
+
+
+def appendVarint(buf, n):
+  while n >= 0x80:
+    buf.append((n & 0x7F) | 0x80)
+    n = n >> 7
+  buf.append(n)
+
+def readVarint(data, pos):
+  n = 0
+  shift = 0
+  while True:
+    b = data[pos]
+    pos = pos + 1
+    n = n | ((b & 0x7F) << shift)
+    if b < 0x80:
+      return n, pos
+    shift = shift + 7
+
+def zigzag(n):
+  return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+def unzigzag(n):
+  return n >> 1 if n & 1 == 0 else -((n + 1) >> 1)
+
+def clamp(n, low, high):
+  return low if n < low else high if n > high else n
+
+
+def inaValues(ina):
+  # inaData to [bus mV, current mA] for channels 1, 2, 3, or None if a reading is missing
+  values = []
+  for channel in (1, 2, 3):
+    volts, amps = ina[channel]
+    if volts is None or amps is None:
+      return None
+    values.append(clamp(round(volts * 1000), 0, 65535))
+    values.append(clamp(round(amps * 1000), -32768, 32767))
+  return values
+
+
+def encodeJSON(id, t, ina=None, gn=None):
+  return json.dumps({"id": id, "payload": isoString(t)}).replace(' ', '').encode()
+
+def encodeBinary(id, t, ina=None, gn=None):
+  flags = 0
+  values = None if ina is None else inaValues(ina)
+  if values is not None:
+    flags = flags | FLAG_INA
+  if gn is not None:
+    flags = flags | FLAG_GPS
+  buf = bytearray()
+  buf.append((PAYLOAD_VERSION << 4) | flags)
+  appendVarint(buf, int(id))
+  appendVarint(buf, max(0, t - PAYLOAD_EPOCH))
+  if flags & FLAG_INA:
+    buf.extend(struct.pack(INA_FORMAT, *values))
+  if flags & FLAG_GPS:
+    lat, lon, alt = gn
+    buf.extend(struct.pack(GPS_FORMAT, round(lat * 100000), round(lon * 100000), clamp(alt, -32768, 32767)))
+  return buf
+
+ENCODERS = {
+  'json': encodeJSON,
+  'binary': encodeBinary,
+}
+
+
+class SampleBatch:
+  # INA samples waiting to go out together. Each one is encoded as it is added,
+  # so the size of the payload is always known and a sample that would push it
+  # over the limit is refused instead.
+
+  def __init__(self, limit=PAYLOAD_MAX):
+    self.limit = limit
+    self.clear()
+
+  def clear(self):
+    self.body = bytearray()
+    self.count = 0
+    self.start = 0
+    self.last = 0
+    self.previous = [0, 0, 0, 0, 0, 0]
+
+  def add(self, t, values):
+    # t is seconds since 1970, values as returned by inaValues(), False if it doesn't fit
+    sample = bytearray()
+    appendVarint(sample, 0 if self.count == 0 else max(0, t - self.last))
+    for i in range(6):
+      appendVarint(sample, zigzag(values[i] - self.previous[i]))
+    if BATCH_HEADER_MAX + len(self.body) + len(sample) > self.limit:
+      return False
+    if self.count == 0:
+      self.start = t
+    self.body.extend(sample)
+    self.count = self.count + 1
+    self.last = t
+    self.previous[:] = values
+    return True
+
+  def pack(self, id):
+    # the payload for everything added so far, the batch starts over empty
+    buf = bytearray()
+    buf.append((PAYLOAD_BATCH << 4) | FLAG_INA)
+    appendVarint(buf, int(id))
+    appendVarint(buf, max(0, self.start - PAYLOAD_EPOCH))
+    buf.extend(self.body)
+    self.clear()
+    return buf
+
+
+def decode(data):
+  # payload bytes back to a dict, 'time' is seconds since 1970
+  if data[0:1] == b'{':
+    return json.loads(data)
+  header = data[0]
+  if header >> 4 not in (PAYLOAD_VERSION, PAYLOAD_BATCH):
+    raise ValueError('unknown payload version %d' % (header >> 4))
+  id, pos = readVarint(data, 1)
+  offset, pos = readVarint(data, pos)
+  message = {'id': '%010d' % id, 'time': PAYLOAD_EPOCH + offset}
+  if header >> 4 == PAYLOAD_BATCH:
+    message['samples'] = []
+    t = message['time']
+    values = [0, 0, 0, 0, 0, 0]
+    while pos < len(data):
+      delta, pos = readVarint(data, pos)
+      t = t + delta
+      for i in range(6):
+        n, pos = readVarint(data, pos)
+        values[i] = values[i] + unzigzag(n)
+      ina = {}
+      for channel in (1, 2, 3):
+        ina[channel] = (values[channel * 2 - 2] / 1000, values[channel * 2 - 1] / 1000)
+      message['samples'].append({'time': t, 'ina': ina})
+    return message
+  if header & FLAG_INA:
+    values = struct.unpack_from(INA_FORMAT, data, pos)
+    pos = pos + struct.calcsize(INA_FORMAT)
+    message['ina'] = {}
+    for channel in (1, 2, 3):
+      message['ina'][channel] = (values[channel * 2 - 2] / 1000, values[channel * 2 - 1] / 1000)
+  if header & FLAG_GPS:
+    lat, lon, alt = struct.unpack_from(GPS_FORMAT, data, pos)
+    pos = pos + struct.calcsize(GPS_FORMAT)
+    message['gps'] = (lat / 100000, lon / 100000, alt)
+  return message
@@ -0,0 +1,114 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Power profiling with the INA3221.
+#
+# While profiling, code.py reads all three rails every INA3221 conversion
+# cycle and adds them to a PowerProfile. The samples go into a ring buffer
+# preallocated as array('h'): bus mV and current mA of channels 1, 2, 3 and
+# the ms since the previous sample, so sampling allocates nothing. Energy
+# is integrated per channel as the samples come in, in whole mJ with the
+# nJ left over carried to the next sample.
+#
+# Sample times are supervisor.ticks_ms() (see adafruit_ticks), not
+# time.monotonic(): CircuitPython's float monotonic() loses ms resolution
+# after an hour of uptime and moves in 64 ms steps after a few days, which is
+# coarser than the profile interval.
+#
+# window() works out the energy each channel used over the last seconds of
+# the ring, less what it would have used at its baseline (the mean power over
+# the PROFILE_BASELINE seconds before). code.py takes one when the Tile
+# accepts a message ($TD OK) and when it reports it sent ($TD SENT); the
+# transmission happens in the seconds before SENT.
+
+from array import array
+
+from adafruit_ticks import ticks_diff
+
+PROFILE_SAMPLES = 1024  # about 50 s at 20 samples a second
+PROFILE_WINDOW = 20
+PROFILE_BASELINE = 10
+
+
+def clamp16(n):
+  return -32768 if n < -32768 else 32767 if n > 32767 else n
+
+
+class PowerProfile:
+
+  def __init__(self, size=PROFILE_SAMPLES):
+    self.size = size
+    self.values = array('h', [0] * (6 * size))
+    self.dt = array('h', [0] * size)
+    self.mj = [0, 0, 0]
+    self.nj = [0, 0, 0]  # less than a mJ, not yet in mj
+    self.reset()
+
+  def reset(self):
+    self.head = 0  # where the next sample goes
+    self.count = 0
+    self.last = None  # ticks_ms() of the newest sample
+    self.samples = 0
+    for channel in range(3):
+      self.mj[channel] = 0
+      self.nj[channel] = 0
+
+  def add(self, ms, reading):
+    # ms is ticks_ms(), reading is [bus V, current A] for channels 1, 2, 3, as
+    # INA3221.read_all() fills it
+    i = self.head * 6
+    for k in range(6):
+      self.values[i + k] = clamp16(round(reading[k] * 1000))
+    if self.last is None:
+      self.dt[self.head] = 0
+    else:
+      dt = clamp16(ticks_diff(ms, self.last))
+      self.dt[self.head] = dt
+      for channel in range(3):
+        # mV * mA * ms is nJ
+        nj = self.nj[channel] + self.values[i + 2 * channel] * self.values[i + 2 * channel + 1] * dt
+        self.mj[channel] = self.mj[channel] + nj // 1000000
+        self.nj[channel] = nj % 1000000
+    self.last = ms
+    self.head = (self.head + 1) % self.size
+    if self.count < self.size:
+      self.count = self.count + 1
+    self.samples = self.samples + 1
+
+  def window(self, seconds=PROFILE_WINDOW, baseline=PROFILE_BASELINE):
+    # mJ per channel used over the last seconds above baseline, None without
+    # enough samples. Each sample's power counts for the interval before it.
+    energy = [0.0, 0.0, 0.0]
+    base = [0.0, 0.0, 0.0]
+    spent = 0.0
+    baseSpent = 0.0
+    j = self.head
+    for n in range(self.count - 1):
+      j = (j - 1) % self.size
+      dt = self.dt[j] / 1000
+      inWindow = spent < seconds
+      if not inWindow and baseSpent >= baseline:
+        break
+      i = j * 6
+      for channel in range(3):
+        e = self.values[i + 2 * channel] * self.values[i + 2 * channel + 1] * dt / 1000
+        if inWindow:
+          energy[channel] = energy[channel] + e
+        else:
+          base[channel] = base[channel] + e
+      if inWindow:
+        spent = spent + dt
+      else:
+        baseSpent = baseSpent + dt
+    if spent == 0:
+      return None
+    for channel in range(3):
+      if baseSpent > 0:
+        energy[channel] = energy[channel] - base[channel] / baseSpent * spent
+      energy[channel] = round(energy[channel])
+    return energy
+
+  def newest(self):
+    # index of the newest sample's values
+    return ((self.head - 1) % self.size) * 6
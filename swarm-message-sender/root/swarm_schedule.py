@@ -0,0 +1,99 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Decides when the next message is handed to the Tile.
+#
+# A message queued on the Tile waits for the next satellite pass, so the
+# delivery latency depends on the time of day it was queued. SendScheduler
+# keeps a running average of that latency for each UTC hour, learned from
+# /stats.csv at boot and from every $TD SENT after that, along with a running
+# average of the background noise the Tile reports in $RT RSSI. code.py saves
+# the hourly averages with toDict() so a boot needn't learn them again.
+#
+# Messages are due on a fixed timeline, one every interval. A message may go
+# out up to SCHEDULE_EARLY intervals before it is due when the hour has one of
+# the shorter latencies seen so far and the noise is low, and may be held back
+# up to SCHEDULE_HOLD intervals past it while the noise is high. The timeline
+# itself doesn't move, so the same number of messages is sent either way.
+
+SCHEDULE_EARLY = 0.5  # how early a message may go, in intervals
+SCHEDULE_HOLD = 1.0   # how late it may go while it is noisy
+QUIET_RSSI = -95      # background noise below this is a good time to send
+NOISY_RSSI = -91      # and above this a bad one
+LATENCY_WEIGHT = 0.25  # weight of a new latency in the hourly average
+NOISE_WEIGHT = 0.1     # weight of a new $RT RSSI in the noise average
+
+
+class SendScheduler:
+  def __init__(self):
+    self.latency = [0.0] * 24
+    self.samples = [0] * 24
+    self.noise = None
+    self.next = None
+
+  def learn(self, hour, seconds):
+    # a message queued during this hour took this long to reach a satellite
+    if self.samples[hour] == 0:
+      self.latency[hour] = seconds
+    else:
+      self.latency[hour] = self.latency[hour] + (seconds - self.latency[hour]) * LATENCY_WEIGHT
+    self.samples[hour] = self.samples[hour] + 1
+
+  def hearNoise(self, rssi):
+    if self.noise is None:
+      self.noise = rssi
+    else:
+      self.noise = self.noise + (rssi - self.noise) * NOISE_WEIGHT
+
+  def goodHour(self, hour):
+    # an hour we know nothing about gets the benefit of the doubt
+    if self.samples[hour] == 0:
+      return True
+    known = sorted([self.latency[h] for h in range(24) if self.samples[h] > 0])
+    return self.latency[hour] <= known[len(known) // 2]
+
+  def due(self, now, hour, interval):
+    # now in seconds, hour of the day (UTC), interval in seconds
+    if self.next is None:
+      return True
+    late = now - self.next
+    if late < -interval * SCHEDULE_EARLY:
+      return False
+    if late >= interval * SCHEDULE_HOLD:
+      return True
+    if self.noise is not None and self.noise > NOISY_RSSI:
+      return False
+    if late >= 0:
+      return True
+    return (self.noise is None or self.noise < QUIET_RSSI) and self.goodHour(hour)
+
+  def sent(self, now, interval):
+    # start a new timeline at boot, or when sending was off or the interval changed a lot
+    if self.next is None or abs(now - self.next) > interval * 2:
+      self.next = now + interval
+    else:
+      self.next = self.next + interval
+
+  def nextCheck(self, now, interval):
+    # the first time from now on that due() can turn True by the clock alone,
+    # for sleeping until then; in between it also depends on noise and the hour
+    if self.next is None:
+      return now
+    early = self.next - interval * SCHEDULE_EARLY
+    if now < early:
+      return early
+    if now < self.next:
+      return self.next
+    return max(now, self.next + interval * SCHEDULE_HOLD)
+
+  def toDict(self):
+    # what was learned from stats.csv; the noise and the timeline go in SleepState
+    return {'latency': self.latency, 'samples': self.samples}
+
+  @staticmethod
+  def fromDict(d):
+    scheduler = SendScheduler()
+    scheduler.latency = d['latency']
+    scheduler.samples = d['samples']
+    return scheduler
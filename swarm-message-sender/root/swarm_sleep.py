@@ -0,0 +1,75 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# What code.py carries across deep sleep in alarm.sleep_memory.
+#
+# Deep sleep ends in a reset. Messages, stats and the configuration are on
+# flash or in NVM already; SleepState holds the rest of what the board works
+# from: when the next message and telemetry sample are due, the noise average,
+# the counters, and the telemetry samples waiting to be batched. The due times
+# are stored relative to the Tile time the board went to sleep at, so they are
+# put back against the Tile time heard after waking, whatever the board's own
+# clock did in between. All little-endian:
+#
+#   'SWS1'  u32 Tile time (seconds since TIME_EPOCH)  i32 send in  i32 sample in
+#   f32 noise  u16 unsent  u16 dropped  u8 flags  u16 batch count  u16 batch bytes
+#   u32 batch start  u32 batch last  6 x i32 batch previous values  batch bytes
+
+import struct
+
+SLEEP_MAGIC = b'SWS1'
+SLEEP_HEADER = '<4sIiifHHBHHII6i'
+SLEEP_HEADER_SIZE = 61
+FLAG_BATTERY_LOW = 0x01
+FLAG_SEND = 0x02  # send in is set
+FLAG_SAMPLE = 0x04  # sample in is set
+FLAG_NOISE = 0x08  # noise is set
+
+
+class SleepState:
+
+  def __init__(self):
+    self.tileTime = 0
+    self.sendIn = None  # seconds from tileTime until the scheduler's next message
+    self.sampleIn = None  # and until the next telemetry sample
+    self.noise = None
+    self.unsent = 0
+    self.dropped = 0
+    self.batteryLow = False
+
+  def save(self, memory, batch):
+    # this state and the samples in batch (a SampleBatch) into memory
+    flags = FLAG_BATTERY_LOW if self.batteryLow else 0
+    if self.sendIn is not None:
+      flags = flags | FLAG_SEND
+    if self.sampleIn is not None:
+      flags = flags | FLAG_SAMPLE
+    if self.noise is not None:
+      flags = flags | FLAG_NOISE
+    header = struct.pack(SLEEP_HEADER, SLEEP_MAGIC, self.tileTime, int(self.sendIn or 0), int(self.sampleIn or 0),
+                         self.noise or 0.0, min(self.unsent, 0xFFFF), min(self.dropped, 0xFFFF), flags,
+                         batch.count, len(batch.body), batch.start, batch.last, *batch.previous)
+    memory[0:SLEEP_HEADER_SIZE] = header
+    memory[SLEEP_HEADER_SIZE:SLEEP_HEADER_SIZE + len(batch.body)] = batch.body
+
+  def load(self, memory, batch):
+    # from memory, refilling batch, False if it doesn't hold a state; a state
+    # is only good for one wake, so it is invalidated as it is read
+    if len(memory) < SLEEP_HEADER_SIZE or bytes(memory[0:4]) != SLEEP_MAGIC:
+      return False
+    fields = struct.unpack(SLEEP_HEADER, bytes(memory[0:SLEEP_HEADER_SIZE]))
+    memory[0:4] = b'\0\0\0\0'
+    magic, self.tileTime, sendIn, sampleIn, noise, self.unsent, self.dropped, flags, count, size, start, last = fields[:12]
+    self.sendIn = sendIn if flags & FLAG_SEND else None
+    self.sampleIn = sampleIn if flags & FLAG_SAMPLE else None
+    self.noise = noise if flags & FLAG_NOISE else None
+    self.batteryLow = (flags & FLAG_BATTERY_LOW) != 0
+    batch.clear()
+    if count > 0 and SLEEP_HEADER_SIZE + size <= len(memory):
+      batch.body.extend(memory[SLEEP_HEADER_SIZE:SLEEP_HEADER_SIZE + size])
+      batch.count = count
+      batch.start = start
+      batch.last = last
+      batch.previous[:] = fields[12:]
+    return True
@@ -0,0 +1,176 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Delivery latency statistics over stats.csv.
+#
+# stats.csv has one  id,time_tx,latency_seconds  line per delivered message,
+# with a fourth field, energy_mJ, for messages sent while power profiling, and
+# a fifth, 'inferred', for messages that went out while the board slept. Their
+# latency runs to when the board woke and found them gone, so it is an upper
+# bound; DeliveryStats counts them in the distribution and separately.
+# DeliveryStats reads it a line at a time and keeps the latency distribution in
+# a LatencySketch, plus a count and latency sum per UTC hour of the day. Memory
+# doesn't grow with the length of the log, and the results of several units
+# (or several logs) can be merged and saved as JSON. code.py keeps one up to
+# date for @show stats, the host tools use the same classes.
+
+import math
+
+SKETCH_ACCURACY = 0.02  # relative error of the quantiles
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+
+def parseStatsLine(line):
+  # '1234567890,2022-07-01T13:00:05,636' to ('2022-07-01T13:00:05', 636, False), None if
+  # malformed; the last is True for an inferred send, the energy field is ignored
+  fields = line.strip().split(',')
+  if len(fields) not in (3, 4, 5) or len(fields[1]) < 19:
+    return None
+  try:
+    return fields[1], int(fields[2]), len(fields) == 5 and fields[4] == 'inferred'
+  except ValueError:
+    return None
+
+
+class LatencySketch:
+  # Log-bucketed histogram: a value x > 0 is counted in bucket ceil(log(x) / log(gamma)),
+  # so any quantile comes back within SKETCH_ACCURACY of the true value and a
+  # latency range of one second to three years needs fewer than 600 buckets.
+  # Sketches merge by adding up their buckets.
+
+  def __init__(self):
+    self.buckets = {}
+    self.zeros = 0
+    self.count = 0
+
+  def add(self, x, n=1):
+    if x <= 0:
+      self.zeros = self.zeros + n
+    else:
+      i = math.ceil(math.log(x) / SKETCH_LOG_GAMMA)
+      self.buckets[i] = self.buckets.get(i, 0) + n
+    self.count = self.count + n
+
+  def merge(self, other):
+    for i in other.buckets:
+      self.buckets[i] = self.buckets.get(i, 0) + other.buckets[i]
+    self.zeros = self.zeros + other.zeros
+    self.count = self.count + other.count
+
+  def quantile(self, q):
+    if self.count == 0:
+      return None
+    rank = q * (self.count - 1)
+    seen = self.zeros
+    if rank < seen:
+      return 0
+    for i in sorted(self.buckets):
+      seen = seen + self.buckets[i]
+      if rank < seen:
+        return 2 * SKETCH_GAMMA ** i / (SKETCH_GAMMA + 1)
+    return 2 * SKETCH_GAMMA ** max(self.buckets) / (SKETCH_GAMMA + 1)
+
+  def toDict(self):
+    buckets = {}
+    for i in self.buckets:
+      buckets[str(i)] = self.buckets[i]
+    return {'buckets': buckets, 'zeros': self.zeros, 'count': self.count}
+
+  @staticmethod
+  def fromDict(d):
+    sketch = LatencySketch()
+    for i in d['buckets']:
+      sketch.buckets[int(i)] = d['buckets'][i]
+    sketch.zeros = d['zeros']
+    sketch.count = d['count']
+    return sketch
+
+
+class DeliveryStats:
+  def __init__(self):
+    self.sketch = LatencySketch()
+    self.hourCount = [0] * 24
+    self.hourTotal = [0] * 24
+    self.count = 0
+    self.total = 0
+    self.min = None
+    self.max = None
+    self.first = None
+    self.last = None
+    self.inferred = 0
+
+  def add(self, time_tx, latency, inferred=False):
+    hour = int(time_tx[11:13])
+    if inferred:
+      self.inferred = self.inferred + 1
+    self.sketch.add(latency)
+    self.hourCount[hour] = self.hourCount[hour] + 1
+    self.hourTotal[hour] = self.hourTotal[hour] + latency
+    self.count = self.count + 1
+    self.total = self.total + latency
+    if self.min is None or latency < self.min:
+      self.min = latency
+    if self.max is None or latency > self.max:
+      self.max = latency
+    if self.first is None or time_tx < self.first:
+      self.first = time_tx
+    if self.last is None or time_tx > self.last:
+      self.last = time_tx
+
+  def load(self, path):
+    # returns the number of lines that couldn't be parsed
+    bad = 0
+    with open(path, "r") as f:
+      for line in f:
+        record = parseStatsLine(line)
+        if record is None:
+          bad = bad + 1
+        else:
+          self.add(record[0], record[1], record[2])
+    return bad
+
+  def merge(self, other):
+    self.sketch.merge(other.sketch)
+    for h in range(24):
+      self.hourCount[h] = self.hourCount[h] + other.hourCount[h]
+      self.hourTotal[h] = self.hourTotal[h] + other.hourTotal[h]
+    self.count = self.count + other.count
+    self.total = self.total + other.total
+    self.inferred = self.inferred + other.inferred
+    for name in ('min', 'first'):
+      if getattr(self, name) is None or (getattr(other, name) is not None and getattr(other, name) < getattr(self, name)):
+        setattr(self, name, getattr(other, name))
+    for name in ('max', 'last'):
+      if getattr(self, name) is None or (getattr(other, name) is not None and getattr(other, name) > getattr(self, name)):
+        setattr(self, name, getattr(other, name))
+
+  def mean(self):
+    return self.total / self.count if self.count > 0 else None
+
+  def hourMean(self, hour):
+    return self.hourTotal[hour] / self.hourCount[hour] if self.hourCount[hour] > 0 else None
+
+  def summary(self):
+    # the short form @show stats prints
+    if self.count == 0:
+      return 'delivered: 0'
+    return 'delivered: %d inferred: %d p50: %ds p90: %ds p99: %ds max: %ds' % (self.count, self.inferred,
+      round(self.sketch.quantile(0.5)), round(self.sketch.quantile(0.9)),
+      round(self.sketch.quantile(0.99)), self.max)
+
+  def toDict(self):
+    return {'sketch': self.sketch.toDict(), 'hourCount': self.hourCount, 'hourTotal': self.hourTotal,
+            'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max,
+            'first': self.first, 'last': self.last, 'inferred': self.inferred}
+
+  @staticmethod
+  def fromDict(d):
+    stats = DeliveryStats()
+    stats.sketch = LatencySketch.fromDict(d['sketch'])
+    for name in ('hourCount', 'hourTotal', 'count', 'total', 'min', 'max', 'first', 'last'):
+      setattr(stats, name, d[name])
+    # summaries saved before inferred sends were counted have none
+    stats.inferred = d.get('inferred', 0)
+    return stats
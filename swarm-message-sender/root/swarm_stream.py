@@ -0,0 +1,92 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Binary telemetry frames for the stream port.
+#
+# Every frame is a 3 byte header, u16 body length and u8 frame type, followed
+# by the body. Bodies start with u32 ms, the board's time.monotonic_ns() in
+# milliseconds (it wraps after 49 days), and are fixed-size for their type,
+# all little-endian:
+#
+#   HELLO  'SWT1'  u16 version  u32 Tile time (0 if not yet known)
+#   INA    bus mV (u16) and current mA (i16) for channels 1, 2, 3
+#   RT     i16 RSSI  i16 SNR  i16 FDEV  u8 1 for a satellite packet, 0 for
+#          background noise (SNR and FDEV 0)
+#   DT     u32 Tile time
+#   GN     latitude, longitude (i32, 1e-5 degrees)  i16 altitude (m)
+#          i16 course  i16 speed
+#   MSG    u8 event  u32 id  u64 tile_msg_id  i16 RSSI  i16 SNR  i16 FDEV,
+#          the radio values only for SENT
+#
+# Tile times are seconds since 1970. HELLO is sent once when a client
+# connects, and DT with every $DT, so the host can put times to the ms.
+# A reader skips frame types it doesn't know by their length.
+#
+# StreamFrames keeps a buffer per frame type with its header already in
+# place, so a frame is packed without allocating. The host decodes frames
+# with ../host/stream_client.py, which builds its NumPy dtypes from FRAMES.
+
+import struct
+
+STREAM_MAGIC = b'SWT1'
+STREAM_VERSION = 1
+HEADER = '<HB'
+HEADER_SIZE = 3
+
+FRAME_HELLO = 0
+FRAME_INA = 1
+FRAME_RT = 2
+FRAME_DT = 3
+FRAME_GN = 4
+FRAME_MSG = 5
+
+MSG_ACCEPTED = 1  # $TD OK
+MSG_REJECTED = 2  # $TD ERR, tile_msg_id 0
+MSG_SENT = 3  # $TD SENT, or found sent after a sleep (radio values 0)
+
+# type -> (body format, field names)
+FRAMES = {
+  FRAME_HELLO: ('<I4sHI', ('ms', 'magic', 'version', 'time')),
+  FRAME_INA: ('<IHhHhHh', ('ms', 'bat_mv', 'bat_ma', 'sol_mv', 'sol_ma', 'v3_mv', 'v3_ma')),
+  FRAME_RT: ('<IhhhB', ('ms', 'rssi', 'snr', 'fdev', 'packet')),
+  FRAME_DT: ('<II', ('ms', 'time')),
+  FRAME_GN: ('<Iiihhh', ('ms', 'lat', 'lon', 'alt', 'course', 'speed')),
+  FRAME_MSG: ('<IBIQhhh', ('ms', 'event', 'id', 'tile_msg_id', 'rssi', 'snr', 'fdev')),
+}
+FRAME_NAMES = {
+  FRAME_HELLO: 'hello',
+  FRAME_INA: 'ina',
+  FRAME_RT: 'rt',
+  FRAME_DT: 'dt',
+  FRAME_GN: 'gn',
+  FRAME_MSG: 'msg',
+}
+
+
+def clamp16(n):
+  return -32768 if n < -32768 else 32767 if n > 32767 else n
+
+
+class StreamFrames:
+
+  def __init__(self):
+    self.buffers = {}
+    for type, (format, names) in FRAMES.items():
+      size = struct.calcsize(format)
+      buf = bytearray(HEADER_SIZE + size)
+      struct.pack_into(HEADER, buf, 0, size, type)
+      self.buffers[type] = buf
+
+  def pack(self, type, *values):
+    # the frame, valid until the next one of its type is packed
+    buf = self.buffers[type]
+    struct.pack_into(FRAMES[type][0], buf, HEADER_SIZE, *values)
+    return buf
+
+  def ina(self, ms, reading):
+    # reading is [bus V, current A] for channels 1, 2, 3, as INA3221.read_all() fills it
+    return self.pack(FRAME_INA, ms,
+                     min(max(round(reading[0] * 1000), 0), 65535), clamp16(round(reading[1] * 1000)),
+                     min(max(round(reading[2] * 1000), 0), 65535), clamp16(round(reading[3] * 1000)),
+                     min(max(round(reading[4] * 1000), 0), 65535), clamp16(round(reading[5] * 1000)))
@@ -0,0 +1,359 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Streaming parser for the NMEA-style sentences spoken by the Swarm Tile, and
+# the queue of commands waiting for the Tile's answers.
+#
+# Sentences look like  $TD OK,1234*2a  and are identified by their tag, the
+# 1-4 characters after the '$' packed 7 bits per char into a small int so a
+# tag can be compared without allocating.  Plain Python so it also runs on
+# the host for benchmarking.
+
+from binascii import hexlify
+
+TAG_INVALID = 0
+HEX_DIGITS = b'0123456789abcdef'
+HEX_UPPER = b'0123456789ABCDEF'
+# HEX_XOR[b] is the XOR of the two hex digits of byte b
+HEX_XOR = bytes(HEX_DIGITS[b >> 4] ^ HEX_DIGITS[b & 15] for b in range(256))
+TD_MAX_PAYLOAD = 192  # the most a $TD can carry
+
+
+def sentenceTag(name):
+  # '$TD' or b'$TD' -> packed tag
+  if isinstance(name, str):
+    name = name.encode()
+  tag = 0
+  for i in range(1, min(len(name), 5)):
+    c = name[i]
+    if c == 0x20 or c == 0x2C or c == 0x2A:
+      break
+    tag = (tag << 7) | c
+  return tag
+
+
+def hexValue(c):
+  if c >= 0x30 and c <= 0x39:
+    return c - 0x30
+  c = c | 0x20
+  if c >= 0x61 and c <= 0x66:
+    return c - 0x57
+  return -1
+
+
+def parseInt(buf, start, end):
+  # parse a signed decimal number from buf[start:end] without building a str
+  n = 0
+  neg = False
+  if start < end and buf[start] == 0x2D:
+    neg = True
+    start = start + 1
+  for i in range(start, end):
+    c = buf[i] - 0x30
+    if c < 0 or c > 9:
+      break
+    n = n * 10 + c
+  return -n if neg else n
+
+
+def indexOf(buf, c, start, end):
+  for i in range(start, end):
+    if buf[i] == c:
+      return i
+  return -1
+
+
+def checksum(data, start, end):
+  # XOR of data[start:end], what follows the '*' of a sentence
+  cs = 0
+  for i in range(start, end):
+    cs = cs ^ data[i]
+  return cs
+
+
+# every constant command code.py sends, with its checksum, built on first use
+commandCache = {}
+
+
+def command(cmd):
+  # '$MT C=U' -> b'$MT C=U*12\n'
+  data = commandCache.get(cmd)
+  if data is None:
+    body = cmd.encode()
+    cs = checksum(body, 1, len(body))
+    data = body + b'*' + bytes((HEX_UPPER[cs >> 4], HEX_UPPER[cs & 15])) + b'\n'
+    commandCache[cmd] = data
+  return data
+
+
+class CommandBuffer:
+  # $TD commands built in place in a preallocated buffer. The prefix and its
+  # checksum are kept from one command to the next, the payload is hex encoded
+  # by hexlify() and copied in, and the checksum is taken over the payload
+  # bytes through HEX_XOR, one lookup per byte instead of one XOR per digit.
+  # td() returns a memoryview of the buffer, so no command is copied on its
+  # way to tile.write(). The view is only good until the next td();
+  # TileCommands copies it if it has to hold on to it.
+
+  def __init__(self, maxPayload=TD_MAX_PAYLOAD):
+    self.buf = bytearray(32 + 2 * maxPayload)
+    self.view = memoryview(self.buf)
+    self.maxPayload = maxPayload
+    self.appId = None
+    self.start = 0  # where the payload goes, after '$TD AI=<appId>,'
+    self.prefixSum = 0
+
+  def td(self, appId, payload):
+    # '$TD AI=<appId>,<hex payload>*XX\n', None if the payload is too long
+    n = len(payload)
+    if n > self.maxPayload:
+      return None
+    buf = self.buf
+    if appId != self.appId:
+      prefix = b'$TD AI=%d,' % appId
+      buf[0:len(prefix)] = prefix
+      self.appId = appId
+      self.start = len(prefix)
+      self.prefixSum = checksum(prefix, 1, len(prefix))
+    cs = self.prefixSum
+    for b in payload:
+      cs = cs ^ HEX_XOR[b]
+    p = self.start + 2 * n
+    buf[self.start:p] = hexlify(payload)
+    buf[p] = 0x2A
+    buf[p + 1] = HEX_UPPER[cs >> 4]
+    buf[p + 2] = HEX_UPPER[cs & 15]
+    buf[p + 3] = 0x0A
+    return self.view[0:p + 4]
+
+
+class TileParser:
+  # Lines are found with find() over what the UART delivered and copied into
+  # self.line a piece at a time; only a complete line is looked at byte by
+  # byte, for its checksum. A line with a backspace or a CR in it is first
+  # edited the way a terminal would, dropping control characters; any other
+  # stray byte fails the checksum.
+  #
+  # onSentence(tag, line, n) sees every line, with the line buffer and its length
+  # (including the *XX); lines that fail the checksum are passed with TAG_INVALID
+  # so they can still be logged. Unless it returns True the sentence is then
+  # dispatched to the handler(line, n) registered for its tag, if any.
+
+  def __init__(self, size=800, rxsize=512):
+    self.line = bytearray(size)
+    self.rx = bytearray(rxsize)
+    self.rxView = memoryview(self.rx)
+    self.ptr = 0
+    self.onSentence = None
+    self.handlers = {}
+
+  def register(self, name, handler):
+    # name is the sentence as it appears on the wire, e.g. '$TD' or '$M138'
+    self.handlers[sentenceTag(name)] = handler
+
+  def unregister(self, name):
+    self.handlers.pop(sentenceTag(name), None)
+
+  def poll(self, uart):
+    # drain everything the UART has buffered
+    rx = self.rx
+    while True:
+      n = uart.readinto(rx)
+      if not n:
+        return
+      self.feed(rx, n)
+      if n < len(rx):
+        return
+
+  def feed(self, data, n):
+    line = self.line
+    size = len(line)
+    view = self.rxView if data is self.rx else memoryview(data)
+    start = 0
+    while start < n:
+      end = data.find(b'\n', start, n)
+      stop = n if end < 0 else end
+      # what doesn't fit the line buffer is dropped, the checksum will tell
+      k = min(stop - start, size - self.ptr)
+      if k > 0:
+        line[self.ptr:self.ptr + k] = view[start:start + k]
+        self.ptr = self.ptr + k
+      if end < 0:
+        return
+      ptr = self.ptr
+      self.ptr = 0
+      if ptr > 0:
+        self.sentence(ptr)
+      start = end + 1
+
+  def edit(self, n):
+    # line[:n] with its backspaces applied and control characters dropped
+    line = self.line
+    ptr = 0
+    for i in range(n):
+      c = line[i]
+      if c == 0x08:
+        if ptr > 0:
+          ptr = ptr - 1
+      elif c >= 0x20 and c <= 0x7f:
+        line[ptr] = c
+        ptr = ptr + 1
+    return ptr
+
+  def sentence(self, n):
+    line = self.line
+    if line.find(b'\x08', 0, n) >= 0 or line.find(b'\r', 0, n) >= 0:
+      n = self.edit(n)
+      if n == 0:
+        return
+    tag = TAG_INVALID
+    if n > 3 and line[0] == 0x24 and line.find(b'*', 1, n) == n - 3:
+      hi = hexValue(line[n - 2])
+      lo = hexValue(line[n - 1])
+      if hi >= 0 and lo >= 0:
+        cksum = 0
+        for i in range(1, n - 3):
+          cksum = cksum ^ line[i]
+        if (hi << 4) + lo == cksum:
+          tag = sentenceTag(line)
+    if self.onSentence is not None and self.onSentence(tag, line, n):
+      return
+    handler = self.handlers.get(tag)
+    if handler is not None:
+      handler(line, n)
+
+
+def isQuery(data):
+  # a command answered with data rather than OK or ERR: a bare tag ($FV), a
+  # query of a value or rate ($DT @, $GN ?) or the unsent count ($MT C=U)
+  i = indexOf(data, 0x20, 1, min(len(data), 6))
+  if i < 0 or data[i + 1] == 0x2A:
+    return True
+  c = data[i + 1]
+  return c == 0x40 or c == 0x3F or (c == 0x43 and data[i + 2] == 0x3D)
+
+
+def isReply(buf, n):
+  # the sentence in buf[:n] is an OK or an ERR
+  i = indexOf(buf, 0x20, 1, min(n, 6))
+  if i < 0 or i + 3 > n:
+    return False
+  if buf[i + 1] == 0x4F and buf[i + 2] == 0x4B:
+    return True
+  return i + 4 <= n and buf[i + 1] == 0x45 and buf[i + 2] == 0x52 and buf[i + 3] == 0x52
+
+
+class TileCommands:
+  # Commands written to the Tile and the answers they are waiting for.
+  #
+  # The Tile answers its commands in the order it gets them, each with a
+  # sentence of the command's own tag ($TD OK,<id> or $TD ERR,... for $TD), so
+  # an answer belongs to the oldest in-flight command with its tag. Every
+  # command carries a context, for $TD the id of the message it sends; answer()
+  # leaves it in self.context for the handler of the answer. Up to `window`
+  # commands are in flight at once, more wait here and go out as answers come
+  # in.
+  #
+  # Only an OK or an ERR answers a command that sets something; the periodic
+  # $DT, $RT and $GN reports share their tags with the rate commands but
+  # answer nothing. A query (see isQuery()) is answered by any sentence of its
+  # tag, as its answer looks like the reports.
+  #
+  # A command unanswered by its deadline is passed to onTimeout(tag, context)
+  # but stays in flight, without its context, for another `grace` seconds to
+  # take its late answer. Meanwhile no new command of its tag is sent, so every
+  # answer of the tag that comes in belongs to a command sent before: a late
+  # answer is never taken for a newer command's. If the answer is lost for
+  # good, the next answer of the tag can be taken for it instead, which only
+  # loses that one.
+
+  def __init__(self, window=8, size=16, grace=10):
+    self.window = window
+    self.size = size
+    self.grace = grace
+    self.inflight = []  # [tag, context, deadline, query, live]
+    self.waiting = []  # [tag, context, timeout, data]
+    self.context = None
+    self.timeouts = 0
+    self.late = 0  # answers that came in after their command timed out
+    self.stale = 0  # timed out commands still in flight
+    self.onTimeout = None
+
+  def fenced(self, tag):
+    # a command of this tag timed out and may still be answered
+    if self.stale == 0:
+      return False
+    for entry in self.inflight:
+      if entry[0] == tag and not entry[4]:
+        return True
+    return False
+
+  def send(self, uart, data, context, timeout, now):
+    # False if the queue is full and data was not sent
+    tag = sentenceTag(data)
+    if len(self.inflight) < self.window and len(self.waiting) == 0 and not self.fenced(tag):
+      uart.write(data)
+      self.inflight.append([tag, context, now + timeout, isQuery(data), True])
+      return True
+    if len(self.waiting) >= self.size:
+      return False
+    # data may be a CommandBuffer view, which the next command overwrites
+    self.waiting.append([tag, context, timeout, bytes(data)])
+    return True
+
+  def answer(self, tag, buf, n):
+    # the oldest in-flight command of this tag that the sentence in buf[:n]
+    # can answer has its answer; False if there is none, or it had timed out
+    self.context = None
+    inflight = self.inflight
+    if len(inflight) == 0:
+      return False
+    reply = isReply(buf, n)
+    for i in range(len(inflight)):
+      entry = inflight[i]
+      if entry[0] == tag and (reply or entry[3]):
+        inflight.pop(i)
+        if not entry[4]:
+          self.stale = self.stale - 1
+          self.late = self.late + 1
+          return False
+        self.context = entry[1]
+        return True
+    return False
+
+  def poll(self, uart, now):
+    # time out and expire in-flight commands, and send what fits in the window
+    inflight = self.inflight
+    i = 0
+    while i < len(inflight):
+      entry = inflight[i]
+      if now < entry[2]:
+        i = i + 1
+      elif entry[4]:
+        context = entry[1]
+        entry[1] = None
+        entry[2] = now + self.grace
+        entry[4] = False
+        self.stale = self.stale + 1
+        self.timeouts = self.timeouts + 1
+        if self.onTimeout is not None:
+          self.onTimeout(entry[0], context)
+        i = i + 1
+      else:
+        inflight.pop(i)
+        self.stale = self.stale - 1
+    i = 0
+    while i < len(self.waiting) and len(inflight) < self.window:
+      if self.fenced(self.waiting[i][0]):
+        i = i + 1
+        continue
+      tag, context, timeout, data = self.waiting.pop(i)
+      uart.write(data)
+      inflight.append([tag, context, now + timeout, isQuery(data), True])
+
+  def clear(self):
+    # after the Tile restarts, nothing sent before will be answered
+    del self.inflight[:]
+    del self.waiting[:]
+    self.stale = 0
@@ -0,0 +1,192 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Copyright (C) 2022, nootropic design, LLC     All rights reserved.  #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Date and time for the firmware and the host tools.
+#
+# TileClock holds the last $DT time as seconds since TIME_EPOCH together with
+# the time.monotonic() reading it arrived at, and runs on from there between
+# sentences. TIME_EPOCH is recent enough that these values stay small ints on
+# the device (below 2**30 until 2056), which CircuitPython doesn't allocate.
+# The ISO text of the current second is kept in a preallocated bytearray and
+# only the digits that changed are rewritten when the second changes. On the
+# device, where small ints and floats are immediate values, stamp() and
+# parseDT()/parseTS() allocate nothing; a new day costs a tuple, iso() builds its
+# str once a second and isoSeconds() encodes its argument. On CPython every
+# int above 256 is an object, so host/bench.py counts bytes for all of them.
+#
+# The conversions between calendar dates and day numbers are the proleptic
+# Gregorian ones from http://howardhinnant.github.io/date_algorithms.html,
+# which need neither time.mktime() (whose epoch differs between CircuitPython
+# and CPython) nor time zones.
+
+import time
+
+TIME_EPOCH = 1640995200  # 2022-01-01T00:00:00Z
+EPOCH_DAYS = TIME_EPOCH // 86400
+
+
+def daysFromCivil(y, m, d):
+  # days since 1970-01-01
+  if m <= 2:
+    y = y - 1
+    m = m + 9
+  else:
+    m = m - 3
+  era = y // 400
+  yoe = y - era * 400
+  doe = yoe * 365 + yoe // 4 - yoe // 100 + (153 * m + 2) // 5 + d - 1
+  return era * 146097 + doe - 719468
+
+
+def civilFromDays(days):
+  # (year, month, day) of days since 1970-01-01
+  days = days + 719468
+  era = days // 146097
+  doe = days - era * 146097
+  yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+  doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+  mp = (5 * doy + 2) // 153
+  d = doy - (153 * mp + 2) // 5 + 1
+  m = mp + 3 if mp < 10 else mp - 9
+  return yoe + era * 400 + (m <= 2), m, d
+
+
+def number(buf, start, n):
+  # the n decimal digits at buf[start], -1 if any of them isn't one
+  value = 0
+  for i in range(start, start + n):
+    c = buf[i] - 0x30
+    if c < 0 or c > 9:
+      return -1
+    value = value * 10 + c
+  return value
+
+
+def fieldSeconds(y, mo, d, h, mi, s):
+  # seconds since TIME_EPOCH, None unless every field is in range
+  if y < 0 or not (1 <= mo <= 12 and 1 <= d <= 31 and 0 <= h <= 23 and 0 <= mi <= 59 and 0 <= s <= 60):
+    return None
+  return (daysFromCivil(y, mo, d) - EPOCH_DAYS) * 86400 + h * 3600 + mi * 60 + s
+
+
+def parseDT(buf, start):
+  # '20220701130005' at buf[start] (bytes), as in $DT, to seconds since TIME_EPOCH or None
+  if len(buf) < start + 14:
+    return None
+  return fieldSeconds(number(buf, start, 4), number(buf, start + 4, 2), number(buf, start + 6, 2),
+                      number(buf, start + 8, 2), number(buf, start + 10, 2), number(buf, start + 12, 2))
+
+
+def parseTS(buf, start):
+  # '2022-07-01 13:00:05' or '2022-07-01T13:00:05' at buf[start] (bytes), as in
+  # the TS= field of $RT, to seconds since TIME_EPOCH or None
+  if len(buf) < start + 19:
+    return None
+  return fieldSeconds(number(buf, start, 4), number(buf, start + 5, 2), number(buf, start + 8, 2),
+                      number(buf, start + 11, 2), number(buf, start + 14, 2), number(buf, start + 17, 2))
+
+
+def isoSeconds(s):
+  # '2022-07-01T13:00:05' to seconds since 1970, 0 for '' or anything malformed
+  t = parseTS(s.encode(), 0) if len(s) >= 19 else None
+  return 0 if t is None else TIME_EPOCH + t
+
+
+def isoString(t):
+  # seconds since 1970 to '2022-07-01T13:00:05', '' for 0
+  if t == 0:
+    return ''
+  y, m, d = civilFromDays(t // 86400)
+  s = t % 86400
+  return '%04d-%02d-%02dT%02d:%02d:%02d' % (y, m, d, s // 3600, s // 60 % 60, s % 60)
+
+
+def compactString(t):
+  # seconds since TIME_EPOCH to '220701T130005', short enough for a display line
+  y, m, d = civilFromDays(EPOCH_DAYS + t // 86400)
+  s = t % 86400
+  return '%02d%02d%02dT%02d%02d%02d' % (y % 100, m, d, s // 3600, s // 60 % 60, s % 60)
+
+
+def putDigits(buf, start, n, value):
+  for i in range(start + n - 1, start - 1, -1):
+    buf[i] = 0x30 + value % 10
+    value = value // 10
+
+
+class TileClock:
+
+  def __init__(self):
+    self.valid = False
+    self.base = 0  # seconds since TIME_EPOCH at the last $DT
+    self.anchor = 0.0  # time.monotonic() when it arrived
+    self.second = -1  # what text holds
+    self.day = -1
+    self.text = bytearray(b'0000-00-00T00:00:00 ')  # ISO time and a space, the console log stamp
+    self.isoSecond = -1
+    self.isoText = ''
+
+  def set(self, t):
+    self.base = t
+    self.anchor = time.monotonic()
+    self.valid = True
+
+  def setDT(self, buf, start):
+    # from a $DT sentence in buf, False if it doesn't hold a time
+    t = parseDT(buf, start)
+    if t is None:
+      return False
+    self.set(t)
+    return True
+
+  def clear(self):
+    self.valid = False
+
+  def now(self):
+    # seconds since TIME_EPOCH, counted on from the last $DT
+    return self.base + int(time.monotonic() - self.anchor)
+
+  def unix(self):
+    return TIME_EPOCH + self.now()
+
+  def hour(self):
+    return self.now() // 3600 % 24
+
+  def refresh(self):
+    t = self.now()
+    if t == self.second:
+      return
+    self.second = t
+    day = t // 86400
+    s = t - day * 86400
+    putDigits(self.text, 11, 2, s // 3600)
+    putDigits(self.text, 14, 2, s // 60 % 60)
+    putDigits(self.text, 17, 2, s % 60)
+    if day != self.day:
+      self.day = day
+      y, m, d = civilFromDays(EPOCH_DAYS + day)
+      putDigits(self.text, 0, 4, y)
+      putDigits(self.text, 5, 2, m)
+      putDigits(self.text, 8, 2, d)
+
+  def stamp(self):
+    # b'2022-07-01T13:00:05 ' for the current second, b'' without a time; the
+    # buffer is reused, so copy it rather than keep it
+    if not self.valid:
+      return b''
+    self.refresh()
+    return self.text
+
+  def iso(self):
+    # '2022-07-01T13:00:05' for the current second, '' without a time
+    if not self.valid:
+      return ''
+    self.refresh()
+    if self.isoSecond != self.second:
+      self.isoSecond = self.second
+      self.isoText = self.text[0:19].decode()
+    return self.isoText
+
+  def compact(self):
+    return compactString(self.now()) if self.valid else ''